@@ -6,6 +6,11 @@ from datetime import datetime, timedelta
 import logging
 import numpy as np
 from collections import defaultdict
+import sys
+
+# The crawler modules live one directory up.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chan_post_store import with_replies
 
 load_dotenv()
 
@@ -14,6 +19,7 @@ client = pymongo.MongoClient(MONGO_DB_URL)
 db = client['4chan_data']
 g_tv_threads_collection = db['g_tv_threads']
 pol_threads_collection = db['pol_threads']
+g_tv_posts_collection = db['g_tv_posts']
 
 PLOT_DIR = r"/home/Data_Crawlers/project-2-implementation-elbaf/Final_Plots/Chan_Plots"
 if not os.path.exists(PLOT_DIR):
@@ -25,6 +31,10 @@ logger = logging.getLogger("ChanAnalysis")
 start_date = datetime(2024, 11, 1)
 end_date = datetime(2024, 11, 14, 23, 59, 59)
 
+# Reads g_tv threads with their replies filled in, also for threads stored in the split post layout.
+def find_threads(query):
+    return with_replies(g_tv_threads_collection.find(query), g_tv_posts_collection)
+
 def save_plot(fig, filename):
     plot_path = os.path.join(PLOT_DIR, filename)
     fig.savefig(plot_path)
@@ -39,7 +49,7 @@ def analyze_thread_activity_by_board(board):
     vibrant_colors = {"threads_created": "#FF6F61", "replies_received": "#6B5B95"}
 
     logger.info(f"Analyzing thread activity for /{board}/ board...")
-    cursor = g_tv_threads_collection.find({
+    cursor = find_threads({
         "board": board,
         "original_post.OP_Created_at": {
             "$gte": start_date.strftime('%Y-%m-%d %H:%M:%S'),
@@ -100,7 +110,7 @@ def analyze_reply_frequency():
     logger.info("Analyzing reply frequency...")
     reply_counts = defaultdict(list)
 
-    cursor = g_tv_threads_collection.find({
+    cursor = find_threads({
         "original_post.OP_Created_at": {
             "$gte": start_date.strftime('%Y-%m-%d %H:%M:%S'),
             "$lte": end_date.strftime('%Y-%m-%d %H:%M:%S')
@@ -136,7 +146,7 @@ def analyze_thread_lifespan():
     logger.info("Analyzing thread lifespan...")
     most_popular_threads = {}
 
-    cursor = g_tv_threads_collection.find({
+    cursor = find_threads({
         "original_post.OP_Created_at": {
             "$gte": start_date.strftime('%Y-%m-%d %H:%M:%S'),
             "$lte": end_date.strftime('%Y-%m-%d %H:%M:%S')
@@ -185,7 +195,7 @@ def generate_popular_vs_unpopular_stacked_bar_chart():
     vibrant_colors = {"popular": "#4CAF50", "unpopular": "#FF6347"}
 
     board_data = defaultdict(lambda: {"popular": 0, "unpopular": 0})
-    cursor = g_tv_threads_collection.find({
+    cursor = find_threads({
         "original_post.OP_Created_at": {
             "$gte": start_date.strftime('%Y-%m-%d %H:%M:%S'),
             "$lte": end_date.strftime('%Y-%m-%d %H:%M:%S')
@@ -298,7 +308,7 @@ def generate_hourly_activity_heatmap():
     days = (end_date - start_date).days + 1
     hourly_activity = np.zeros((days, 24))
 
-    cursor = g_tv_threads_collection.find({
+    cursor = find_threads({
         "original_post.OP_Created_at": {
             "$gte": start_date.strftime('%Y-%m-%d %H:%M:%S'),
             "$lte": end_date.strftime('%Y-%m-%d %H:%M:%S')
@@ -348,7 +358,7 @@ def generate_thread_popularity_histogram(board):
     vibrant_color = "#FFB347"
 
     reply_counts = []
-    cursor = g_tv_threads_collection.find({
+    cursor = find_threads({
         "board": board,
         "original_post.OP_Created_at": {
             "$gte": start_date.strftime('%Y-%m-%d %H:%M:%S'),
@@ -400,7 +410,7 @@ def generate_replies_vs_posts_stacked_bar_chart():
 
     board_data = defaultdict(lambda: {"original_posts": 0, "replies": 0})
 
-    cursor = g_tv_threads_collection.find({
+    cursor = find_threads({
         "original_post.OP_Created_at": {
             "$gte": start_date.strftime('%Y-%m-%d %H:%M:%S'),
             "$lte": end_date.strftime('%Y-%m-%d %H:%M:%S')
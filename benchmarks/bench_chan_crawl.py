@@ -0,0 +1,177 @@
+# End-to-end throughput benchmark of a chan crawler against the local fake 4chan API (fake_chan_server).
+# Runs crawl_board on every board, then the crawl jobs it queues (inline instead of through Faktory) for a few
+# rounds of simulated board activity, and reports threads/sec, HTTP requests/thread, Mongo ops/thread and
+# p50/p99 job latency.
+# Needs a scratch MongoDB: the crawler writes to its usual databases there and --reset drops them first.
+# Usage: python benchmarks/bench_chan_crawl.py --mongo-url mongodb://localhost:27018/ [--crawler chan_moderate_crawler]
+#        [--rounds 3] [--threads 150] [--latency-ms 20] [--not-found-rate 0.01] [--rate-limit-rate 0.005] [--threads-per-job 25]
+import argparse
+import collections
+import concurrent.futures
+import importlib
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_chan_server import start_fake_server
+
+class CommandCounter:
+    """pymongo command listener counting the commands sent to MongoDB, by command name."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = collections.Counter()
+
+    def started(self, event):
+        with self.lock:
+            self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def total(self):
+        with self.lock:
+            return sum(self.commands.values())
+
+class InlineFaktoryClient:
+    """Stands in for the Faktory producer connection, the queued jobs are run by the benchmark itself."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class InlineProducer:
+    jobs = []
+    lock = threading.Lock()
+
+    def __init__(self, client=None):
+        pass
+
+    def push(self, job):
+        with self.lock:
+            InlineProducer.jobs.append(job)
+        return True
+
+    def push_bulk(self, jobs):
+        with self.lock:
+            InlineProducer.jobs.extend(jobs)
+        return {}
+
+    @classmethod
+    def drain(cls):
+        with cls.lock:
+            jobs, cls.jobs = cls.jobs, []
+        return jobs
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark a chan crawler against the fake 4chan API.")
+    parser.add_argument("--mongo-url", required=True, help="scratch MongoDB, never the production one")
+    parser.add_argument("--crawler", default="chan_crawler", choices=["chan_crawler", "chan_moderate_crawler"])
+    parser.add_argument("--boards", default="g,tv")
+    parser.add_argument("--threads", type=int, default=150, help="threads per board")
+    parser.add_argument("--replies", type=int, default=40, help="average replies per thread at start")
+    parser.add_argument("--rounds", type=int, default=3, help="board sweeps, the boards change between them")
+    parser.add_argument("--activity", type=float, default=0.3, help="share of threads receiving replies between rounds")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--not-found-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=5, help="jobs run at once, like the Faktory consumer")
+    parser.add_argument("--threads-per-job", type=int, default=1, help="> 1 queues thread-batch jobs")
+    parser.add_argument("--requests-per-second", type=float, default=1000, help="rate governor budget, 1 is the real API's")
+    parser.add_argument("--reset", action="store_true", help="drop the crawler databases on the scratch MongoDB first")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    boards = args.boards.split(",")
+
+    # The crawler modules read their settings at import time.
+    os.environ["MONGO_DB_URL"] = args.mongo_url
+    os.environ["BOARDS"] = args.boards
+    os.environ.setdefault("FAKTORY_SERVER_URL", "tcp://localhost:7419")
+    os.environ["CHAN_THREADS_PER_JOB"] = str(args.threads_per_job)
+    os.environ["CHAN_REQUESTS_PER_SECOND"] = str(args.requests_per_second)
+    os.environ["CHAN_REQUEST_BURST"] = str(max(1, int(args.requests_per_second)))
+
+    import pymongo.monitoring
+    counter = CommandCounter()
+    pymongo.monitoring.register(counter)
+
+    server = start_fake_server(
+        boards=boards, threads=args.threads, replies=args.replies, latency_ms=args.latency_ms,
+        not_found_rate=args.not_found_rate, rate_limit_rate=args.rate_limit_rate
+    )
+    import chan_client
+    import chan_moderate_client
+    import chan_async_client
+    for client_class in (chan_client.ChanClient, chan_moderate_client.ChanModerateClient, chan_async_client.AsyncChanClient):
+        client_class.API_BASE = server.url
+
+    import chan_fetch_pipeline
+    chan_fetch_pipeline.Client = InlineFaktoryClient
+    chan_fetch_pipeline.Producer = InlineProducer
+    crawler = importlib.import_module(args.crawler)
+    if args.reset:
+        crawler.client.drop_database(crawler.db.name)
+        crawler.client.drop_database("4chan_shared")
+    crawler.job_leases.ensure_indexes()
+
+    moderate = args.crawler == "chan_moderate_crawler"
+    job_functions = {
+        "crawl-moderate-thread" if moderate else "crawl-thread": crawler.crawl_thread,
+        "crawl-moderate-thread-batch" if moderate else "crawl-thread-batch": crawler.crawl_threads,
+    }
+
+    def run_job(job):
+        started = time.perf_counter()
+        job_functions[job.jobtype](*job.args)
+        return time.perf_counter() - started
+
+    server.reset_stats()
+    mongo_ops_before = counter.total()
+    job_latencies = []
+    threads_crawled = 0
+    started = time.perf_counter()
+    for round_number in range(args.rounds):
+        if round_number:
+            changed = server.advance(activity=args.activity)
+            print(f"Round {round_number + 1}: {changed} threads changed on the fake boards.")
+        for board in boards:
+            crawler.crawl_board(board)
+        jobs = InlineProducer.drain()
+        threads_crawled += sum(1 if isinstance(job.args[1], int) else len(job.args[1]) for job in jobs)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            job_latencies.extend(executor.map(run_job, jobs))
+    elapsed = time.perf_counter() - started
+
+    stats = server.stats()
+    mongo_ops = counter.total() - mongo_ops_before
+    per_thread = max(threads_crawled, 1)
+    print(f"crawler: {args.crawler}, boards: {args.boards}, rounds: {args.rounds}, threads per job: {args.threads_per_job}")
+    print(f"threads crawled: {threads_crawled} in {elapsed:.2f} s ({threads_crawled / elapsed:.1f} threads/sec), {len(job_latencies)} jobs")
+    print(f"requests/thread: {stats['requests'] / per_thread:.2f} ({stats['requests']} requests, by status {stats['by_status']}, by endpoint {stats['by_endpoint']})")
+    print(f"bytes downloaded/thread: {stats['bytes_sent'] / per_thread:.0f}")
+    print(f"mongo ops/thread: {mongo_ops / per_thread:.2f} ({dict(counter.commands.most_common())})")
+    print(f"job latency p50: {percentile(job_latencies, 0.5) * 1000:.1f} ms, p99: {percentile(job_latencies, 0.99) * 1000:.1f} ms, "
+          f"mean: {statistics.mean(job_latencies) * 1000 if job_latencies else 0:.1f} ms")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Microbenchmark: decoding + filtering a bump-limit (310 post) thread with chan_decoder
+# against the filter_thread_data the crawlers used before (json + list lookups + per-reply re.sub).
+# Usage: python benchmarks/bench_chan_decoder.py [repeats]
+import datetime
+import html
+import json
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chan_decoder import decode_json, filter_thread_data
+
+BUMP_LIMIT = 310
+
+# Builds a synthetic thread with the fields /g/ and /tv/ threads carry, roughly a third of replies quote/link.
+def synthesize_thread(number_of_posts=BUMP_LIMIT, seed=4):
+    rng = random.Random(seed)
+    start = 1731600000
+    thread_number = 103000000
+    words = ["anon", "thread", "install", "gentoo", "based", "cringe", "kino", "episode", "season", "linux", "rust", "python"]
+    posts = []
+    for i in range(number_of_posts):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(5, 40)))
+        if rng.random() < 0.35:
+            text = f'<a href="#p{thread_number + i - 1}" class="quotelink">&gt;&gt;{thread_number + i - 1}</a><br>{text}'
+        if rng.random() < 0.2:
+            text += '<br><span class="quote">&gt;implying &quot;this&quot; works</span>'
+        post = {
+            "no": thread_number + i, "now": "11/14/24(Thu)12:00:00", "name": "Anonymous", "com": text,
+            "time": start + i * rng.randint(1, 30), "resto": 0 if i == 0 else thread_number
+        }
+        if rng.random() < 0.3:
+            post.update({"filename": "image", "ext": ".png", "w": 1024, "h": 768, "tn_w": 250, "tn_h": 187,
+                         "tim": 1731600000000 + i, "md5": "abcdefghijklmnopqrstuv==", "fsize": 123456})
+        if i == 0:
+            post.update({"sub": "General", "replies": number_of_posts - 1, "images": 100, "bumplimit": 1,
+                         "imagelimit": 0, "semantic_url": "general", "unique_ips": 120, "tail_size": 50})
+        posts.append(post)
+    return json.dumps({"posts": posts}).encode()
+
+# The previous implementation, kept verbatim for comparison.
+def legacy_clean_html_content(html_content):
+    decoded_html = html.unescape(html_content)
+    cleaned_text = re.sub(r'<.*?>', '', decoded_html)
+    return cleaned_text
+
+def legacy_filter_thread_data(thread_data):
+    original_post_exclude_fields = [
+        "now", "filename", "ext", "w", "h", "tn_w", "tn_h", "md5",
+        "fsize", "resto", "m_img", "imagelimit", "semantic_url",
+        "custom_spoiler", "replies", "images", "sticky", "closed", "capcode",
+        "unique_ips", "tail_size", "tim", "bumplimit", "no", "time", "id",
+        "country_name", "board_flag", "flag_name"
+    ]
+    replies_exclude_fields = [
+        "now", "filename", "ext", "w", "h", "tn_w", "tn_h", "md5", "tim",
+        "fsize", "capcode", "resto", "time", "id", "country_name", "m_img"
+    ]
+
+    def convert_timestamp_to_readable(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+    filtered_original_post = {
+        key: value for key, value in thread_data['posts'][0].items()
+        if key not in original_post_exclude_fields
+    }
+    filtered_original_post['com'] = legacy_clean_html_content(filtered_original_post.get('com', ''))
+    filtered_original_post['OP_Created_at'] = convert_timestamp_to_readable(thread_data['posts'][0]['time'])
+
+    filtered_replies = [
+        {**{key: value for key, value in reply.items() if key not in replies_exclude_fields},
+         "com": legacy_clean_html_content(reply.get('com', '')),
+         "Reply_Created_at": convert_timestamp_to_readable(reply['time'])}
+        for reply in thread_data['posts'][1:]
+    ]
+
+    return filtered_original_post, filtered_replies
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    raw = synthesize_thread()
+
+    assert legacy_filter_thread_data(json.loads(raw)) == filter_thread_data(decode_json(raw)), "decoders disagree"
+
+    legacy = min(timeit.repeat(lambda: legacy_filter_thread_data(json.loads(raw)), number=repeats, repeat=5)) / repeats
+    fast = min(timeit.repeat(lambda: filter_thread_data(decode_json(raw)), number=repeats, repeat=5)) / repeats
+
+    print(f"Thread: {BUMP_LIMIT} posts, {len(raw) / 1024:.1f} KiB")
+    print(f"legacy json + filter_thread_data: {legacy * 1000:.3f} ms/thread")
+    print(f"chan_decoder decode + filter:     {fast * 1000:.3f} ms/thread")
+    print(f"speedup: {legacy / fast:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+# Local stand-in for the read-only 4chan API (a.4cdn.org), for load-testing the chan crawlers offline.
+# Serves synthesized boards that keep changing: catalog.json, threads.json, archive.json,
+# thread/N.json and thread/N-tail.json, with Last-Modified / If-Modified-Since (304s),
+# configurable latency and injected 404s and 429s (with Retry-After).
+# Recorded payloads can be replayed by pointing --replay at a directory laid out like the API (e.g. g/catalog.json).
+# Usage: python benchmarks/fake_chan_server.py [--port 8080] [--boards g,tv] [--tick 60] [--latency-ms 50] ...
+import argparse
+import collections
+import email.utils
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+THREADS_PER_PAGE = 15
+PAGES = 10
+# Threads with more replies than this advertise tail_size and serve a -tail.json.
+TAIL_THRESHOLD = 100
+TAIL_SIZE = 50
+
+WORDS = ["anon", "thread", "install", "gentoo", "based", "cringe", "kino", "episode", "season", "linux", "rust", "python"]
+
+THREAD_PATH = re.compile(r"^/(\w+)/thread/(\d+)(-tail)?\.json$")
+BOARD_PATH = re.compile(r"^/(\w+)/(catalog|threads|archive)\.json$")
+
+class FakeBoard:
+    """
+    One synthesized board. Threads are kept in bump order and move on a virtual clock, so Last-Modified
+    behaves like the real API no matter how fast the benchmark runs. advance() simulates one tick of activity:
+    replies on a share of the threads (which bumps them), new threads, moderator deletions, and pruning of
+    threads pushed off the last page into the archive.
+    """
+
+    def __init__(self, name, threads=150, replies=40, seed=4):
+        self.name = name
+        self.rng = random.Random(seed)
+        self.clock = int(time.time()) - 3600
+        self.next_no = 100000000
+        self.threads = {}
+        self.bump_order = []
+        self.archive = []
+        self.lock = threading.Lock()
+        for _ in range(threads):
+            self.create_thread(self.rng.randint(0, replies * 2))
+        self.prune()
+
+    def new_post(self, thread_number=0):
+        number = self.next_no
+        self.next_no += 1
+        text = " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(5, 40)))
+        if self.rng.random() < 0.35:
+            text = f'<a href="#p{number - 1}" class="quotelink">&gt;&gt;{number - 1}</a><br>{text}'
+        return {"no": number, "now": "11/14/24(Thu)12:00:00", "name": "Anonymous", "com": text, "time": self.clock, "resto": thread_number}
+
+    def create_thread(self, replies):
+        op = self.new_post()
+        op.update({"sub": "General", "semantic_url": "general", "bumplimit": 0, "imagelimit": 0})
+        thread = {"posts": [op], "last_modified": self.clock}
+        self.threads[op["no"]] = thread
+        self.bump_order.insert(0, op["no"])
+        self.add_replies(op["no"], replies)
+
+    def add_replies(self, thread_number, count):
+        thread = self.threads[thread_number]
+        for _ in range(count):
+            thread["posts"].append(self.new_post(thread_number))
+        thread["last_modified"] = self.clock
+        if count:
+            self.bump_order.remove(thread_number)
+            self.bump_order.insert(0, thread_number)
+
+    # One tick of board activity. Returns how many threads changed.
+    def advance(self, activity=0.3, new_threads=2, deletions=1, seconds=60):
+        with self.lock:
+            self.clock += seconds
+            changed = 0
+            for thread_number in list(self.bump_order):
+                if self.rng.random() < activity:
+                    self.add_replies(thread_number, self.rng.randint(1, 10))
+                    changed += 1
+            for _ in range(new_threads):
+                self.create_thread(self.rng.randint(0, 5))
+                changed += 1
+            for _ in range(min(deletions, len(self.bump_order))):
+                del self.threads[self.bump_order.pop(self.rng.randrange(len(self.bump_order)))]
+            self.prune()
+            return changed
+
+    # Moves threads pushed off the last page into the archive.
+    def prune(self):
+        while len(self.bump_order) > THREADS_PER_PAGE * PAGES:
+            pruned = self.bump_order.pop()
+            self.archive.append(pruned)
+            self.threads[pruned]["posts"][0]["archived"] = 1
+            self.threads[pruned]["posts"][0]["archived_on"] = self.clock
+            self.threads[pruned]["last_modified"] = self.clock
+
+    def thread_payload(self, thread_number, tail=False):
+        thread = self.threads.get(thread_number)
+        if thread is None:
+            return None, None
+        op = dict(thread["posts"][0])
+        replies = thread["posts"][1:]
+        op.update({"replies": len(replies), "images": 0})
+        if len(replies) > TAIL_THRESHOLD:
+            op["tail_size"] = TAIL_SIZE
+        if tail:
+            if "tail_size" not in op:
+                return None, None
+            replies = replies[-TAIL_SIZE:]
+            op["tail_id"] = replies[0]["no"]
+        return {"posts": [op] + replies}, thread["last_modified"]
+
+    def listing_payload(self, kind):
+        pages = []
+        live = self.bump_order
+        for page in range(0, len(live), THREADS_PER_PAGE):
+            entries = []
+            for thread_number in live[page:page + THREADS_PER_PAGE]:
+                thread = self.threads[thread_number]
+                entry = {"no": thread_number, "last_modified": thread["last_modified"], "replies": len(thread["posts"]) - 1}
+                if kind == "catalog":
+                    entry.update(thread["posts"][0])
+                    entry["last_replies"] = thread["posts"][-5:][1:]
+                entries.append(entry)
+            pages.append({"page": page // THREADS_PER_PAGE + 1, "threads": entries})
+        last_modified = max((self.threads[thread_number]["last_modified"] for thread_number in live), default=self.clock)
+        return pages, last_modified
+
+    # Returns (payload, last_modified) for an API path, (None, None) when it does not exist.
+    def resolve(self, path):
+        with self.lock:
+            match = THREAD_PATH.match(path)
+            if match:
+                thread_number = int(match.group(2))
+                if thread_number in self.archive or thread_number in self.threads:
+                    return self.thread_payload(thread_number, tail=bool(match.group(3)))
+                return None, None
+            match = BOARD_PATH.match(path)
+            if match.group(2) == "archive":
+                return list(self.archive), self.clock
+            return self.listing_payload(match.group(2))
+
+class FakeChanServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, boards, latency_ms=0, not_found_rate=0.0, rate_limit_rate=0.0, retry_after=1, replay_dir=None, seed=4):
+        super().__init__(address, FakeChanHandler)
+        self.boards = boards
+        self.latency = latency_ms / 1000
+        self.not_found_rate = not_found_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.replay_dir = replay_dir
+        self.rng = random.Random(seed)
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def reset_stats(self):
+        with self.stats_lock:
+            # (endpoint, status) -> count
+            self.requests = collections.Counter()
+            self.bytes_sent = 0
+
+    def record(self, endpoint, status, size=0):
+        with self.stats_lock:
+            self.requests[(endpoint, status)] += 1
+            self.bytes_sent += size
+
+    def stats(self):
+        with self.stats_lock:
+            by_status = collections.Counter()
+            by_endpoint = collections.Counter()
+            for (endpoint, status), count in self.requests.items():
+                by_status[status] += count
+                by_endpoint[endpoint] += count
+            return {"requests": sum(self.requests.values()), "by_status": dict(by_status), "by_endpoint": dict(by_endpoint), "bytes_sent": self.bytes_sent}
+
+    def advance(self, **kwargs):
+        return sum(board.advance(**kwargs) for board in self.boards.values())
+
+class FakeChanHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_empty(self, endpoint, status, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.server.record(endpoint, status)
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        thread_match = THREAD_PATH.match(self.path)
+        board_match = BOARD_PATH.match(self.path)
+        if thread_match:
+            board_name, endpoint = thread_match.group(1), "thread-tail" if thread_match.group(3) else "thread"
+        elif board_match:
+            board_name, endpoint = board_match.group(1), board_match.group(2)
+        else:
+            return self.send_empty("other", 404)
+        board = server.boards.get(board_name)
+        if board is None:
+            return self.send_empty(endpoint, 404)
+
+        with server.stats_lock:
+            roll = server.rng.random()
+        if roll < server.rate_limit_rate:
+            return self.send_empty(endpoint, 429, [("Retry-After", str(server.retry_after))])
+        if thread_match and roll < server.rate_limit_rate + server.not_found_rate:
+            return self.send_empty(endpoint, 404)
+
+        body, last_modified = self.replayed_payload()
+        if body is None:
+            payload, last_modified = board.resolve(self.path)
+            if payload is None:
+                return self.send_empty(endpoint, 404)
+            body = json.dumps(payload).encode()
+
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                if email.utils.parsedate_to_datetime(if_modified_since).timestamp() >= last_modified:
+                    return self.send_empty(endpoint, 304)
+            except (TypeError, ValueError):
+                pass
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Last-Modified", email.utils.formatdate(last_modified, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+        server.record(endpoint, 200, len(body))
+
+    # Recorded payload for this path from --replay, its Last-Modified is the file's mtime.
+    def replayed_payload(self):
+        if not self.server.replay_dir:
+            return None, None
+        file_path = os.path.join(self.server.replay_dir, self.path.lstrip("/"))
+        if not os.path.isfile(file_path):
+            return None, None
+        with open(file_path, "rb") as f:
+            return f.read(), int(os.path.getmtime(file_path))
+
+def start_fake_server(boards=("g", "tv"), host="127.0.0.1", port=0, threads=150, replies=40, **kwargs):
+    server = FakeChanServer((host, port), {board: FakeBoard(board, threads, replies, seed=index) for index, board in enumerate(boards)}, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the 4chan read-only API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--boards", default="g,tv")
+    parser.add_argument("--threads", type=int, default=150, help="threads per board at start")
+    parser.add_argument("--replies", type=int, default=40, help="average replies per thread at start")
+    parser.add_argument("--tick", type=float, default=60, help="seconds between simulated activity ticks, 0 freezes the boards")
+    parser.add_argument("--activity", type=float, default=0.3, help="share of threads receiving replies per tick")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--not-found-rate", type=float, default=0.0, help="share of thread requests answered 404")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--replay", default=None, help="directory of recorded payloads laid out like the API")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = start_fake_server(
+        boards=args.boards.split(","), host=args.host, port=args.port, threads=args.threads, replies=args.replies,
+        latency_ms=args.latency_ms, not_found_rate=args.not_found_rate, rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after, replay_dir=args.replay
+    )
+    print(f"Fake 4chan API listening on {server.url}, point ChanClient.API_BASE at it.")
+    try:
+        while True:
+            time.sleep(args.tick or 3600)
+            if args.tick:
+                changed = server.advance(activity=args.activity, seconds=int(args.tick))
+                print(f"Tick: {changed} threads changed, {json.dumps(server.stats())}")
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+import aiohttp
+from chan_validator_store import NOT_MODIFIED, ValidatorStore
+from chan_rate_governor import local_rate_governor
+from chan_decoder import decode_json
+from crawler_metrics import record_response, RETRY_SLEEP_SECONDS
+from response_capture import capture_response
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan async client")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Constants used when retrying incase of http errors, same as chan_client
+MAX_RETRIES = 5
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 60
+
+# Size of the shared keep-alive pool and how many requests one board may have in flight at once.
+MAX_CONNECTIONS = 20
+PER_BOARD_CONCURRENCY = 8
+REQUEST_TIMEOUT = 30
+
+class AsyncChanClient:
+    """
+    Asyncio version of ChanClient. Same get_catalog/get_thread/get_threads surface,
+    but every request goes through one aiohttp session so many fetches share a keep-alive pool.
+    Use it as an async context manager:
+
+        async with AsyncChanClient() as chan_client:
+            threads = await chan_client.fetch_threads("g", [1, 2, 3])
+    """
+    # Base Url
+    API_BASE = "http://a.4cdn.org"
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, per_board_concurrency=PER_BOARD_CONCURRENCY, validator_store=None, rate_governor=None):
+        # Caches the Last-Modified/ETag validators for each API call, same as ChanClient.
+        self.validator_store = validator_store if validator_store is not None else ValidatorStore()
+        # Every request waits for a slot from the rate governor, same as ChanClient.
+        self.rate_governor = rate_governor if rate_governor is not None else local_rate_governor
+        self.max_connections = max_connections
+        self.per_board_concurrency = per_board_concurrency
+        # One semaphore per board so a big board can't starve the others in the pool.
+        self.board_semaphores = {}
+        self.session = None
+        # Validators of the responses fetched so far, kept here until the caller has stored their data.
+        self.fetched_validators = {}
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    def board_semaphore(self, board):
+        if board not in self.board_semaphores:
+            self.board_semaphores[board] = asyncio.Semaphore(self.per_board_concurrency)
+        return self.board_semaphores[board]
+
+    async def execute_request(self, board, api_call, retries=MAX_RETRIES, retrying_wait_time=RETRY_DELAY):
+        """
+        Executes the Http Get request to crawl from 4chan API Endpoints without blocking the event loop.
+        Error handling and retrying mirrors ChanClient.execute_request.
+        """
+        # Validators may be read from Mongo and captures are file writes, so both run off the event loop.
+        headers = await asyncio.to_thread(self.validator_store.conditional_headers, api_call)
+
+        for attempt in range(1, retries + 1):
+            try:
+                async with self.board_semaphore(board):
+                    # Reserving a slot may hit Mongo, so it runs off the event loop.
+                    wait = await asyncio.to_thread(self.rate_governor.reserve)
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    started = time.perf_counter()
+                    async with self.session.get(api_call, headers=headers) as response:
+                        status_code = response.status
+
+                        if status_code == 304:
+                            record_response(api_call, status_code, time.perf_counter() - started)
+                            logger.info(f"No new data since last modified: {api_call}")
+                            return NOT_MODIFIED
+
+                        if status_code < 400:
+                            body = await response.read()
+                            record_response(api_call, status_code, time.perf_counter() - started, len(body))
+                            await asyncio.to_thread(capture_response, "chan", api_call, status_code, body)
+                            data = decode_json(body)
+                            # If available. we keep the validators to use in subsequent requests, see pop_validators.
+                            self.fetched_validators[api_call] = {"last_modified": response.headers.get('Last-Modified'), "etag": response.headers.get('ETag')}
+                            return data
+
+                        record_response(api_call, status_code, time.perf_counter() - started)
+                        await asyncio.to_thread(capture_response, "chan", api_call, status_code, b"")
+
+                        retry_after_header = response.headers.get("Retry-After")
+
+                # Case when thread maybe deleted or fell into archive board or resource not found in general
+                if status_code == 404:
+                    logger.warning(f"Resource not found (404): {api_call}")
+                    return None
+
+                # Client-side error
+                elif 400 <= status_code < 500:
+                    retry_after = int(retry_after_header or retrying_wait_time) if status_code == 429 else retrying_wait_time
+                    # On 429 every client backs off, not just this one.
+                    if status_code == 429:
+                        await asyncio.to_thread(self.rate_governor.penalize, retry_after)
+                    logger.warning(f"Client error {status_code} on {api_call}. Retrying in {retry_after} seconds (Attempt {attempt}/{retries})...")
+                    RETRY_SLEEP_SECONDS.inc(retry_after, reason=str(status_code))
+                    await asyncio.sleep(retry_after)
+
+                # Case when Server Side Error
+                elif 500 <= status_code < 600:
+                    logger.error(f"Server error {status_code} on {api_call}. Retrying in {retrying_wait_time} seconds (Attempt {attempt}/{retries})...")
+                    RETRY_SLEEP_SECONDS.inc(retrying_wait_time, reason="5xx")
+                    await asyncio.sleep(retrying_wait_time)
+                    # Capped exponential backoff
+                    retrying_wait_time = min(retrying_wait_time * 2, MAX_RETRY_DELAY)
+                else:
+                    logger.error(f"Unexpected HTTP status {status_code} on {api_call}")
+                    return None
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as req_err:
+                # Network-related error, retrying with backoff
+                logger.error(f"Network error: {req_err!r}. Retrying in {retrying_wait_time} seconds (Attempt {attempt}/{retries})...")
+                RETRY_SLEEP_SECONDS.inc(retrying_wait_time, reason="network")
+                await asyncio.sleep(retrying_wait_time)
+                retrying_wait_time = min(retrying_wait_time * 2, MAX_RETRY_DELAY)
+
+        logger.error(f"Max retries reached. Failed to execute request after {retries} attempts: {api_call}")
+        return None
+
+    # Hands over the validators fetched since the last call, {api_call: {"last_modified", "etag"}}.
+    def pop_validators(self):
+        validators, self.fetched_validators = self.fetched_validators, {}
+        return validators
+
+    # Connects to API endpoint which fetches all the threads in a specific board.
+    async def get_threads(self, board):
+        api_call = f"{self.API_BASE}/{board}/threads.json"
+        return await self.execute_request(board, api_call)
+
+    # Connects to API endpoint which fetches all the attributes of a specific thread on a specific board.
+    async def get_thread(self, board, thread_number):
+        api_call = f"{self.API_BASE}/{board}/thread/{thread_number}.json"
+        return await self.execute_request(board, api_call)
+
+    # Connects to API endpoint which fetches the OP and only the last tail_size replies of a large thread.
+    async def get_thread_tail(self, board, thread_number):
+        api_call = f"{self.API_BASE}/{board}/thread/{thread_number}-tail.json"
+        return await self.execute_request(board, api_call)
+
+    # Connects to API endpoint which lists the thread numbers in the archive of a specific board (boards without an archive return 404).
+    async def get_archive(self, board):
+        api_call = f"{self.API_BASE}/{board}/archive.json"
+        return await self.execute_request(board, api_call)
+
+    # Connects to API endpoint which fetches the catalog (list of live threads) of a specific board.
+    async def get_catalog(self, board):
+        api_call = f"{self.API_BASE}/{board}/catalog.json"
+        return await self.execute_request(board, api_call)
+
+    # Fetches many threads of one board concurrently, bounded by the per-board semaphore.
+    # Returns {thread_number: thread_data}, thread_data is NOT_MODIFIED for 304 and None for 404/failed fetches.
+    async def fetch_threads(self, board, thread_numbers):
+        thread_numbers = list(thread_numbers)
+        # One Mongo query for every validator of the batch, off the event loop like every other store call.
+        await asyncio.to_thread(self.validator_store.preload, [f"{self.API_BASE}/{board}/thread/{thread_number}.json" for thread_number in thread_numbers])
+        results = await asyncio.gather(*(self.get_thread(board, thread_number) for thread_number in thread_numbers))
+        logger.info(f"Fetched {len(thread_numbers)} threads from /{board}/.")
+        return dict(zip(thread_numbers, results))
+
+# Blocking helper so synchronous Faktory jobs can run a bulk fetch with one pool.
+# Returns the fetched threads and their validators, the caller saves the validators once the threads are stored.
+def fetch_threads_blocking(board, thread_numbers, **client_kwargs):
+    async def run():
+        async with AsyncChanClient(**client_kwargs) as chan_client:
+            threads = await chan_client.fetch_threads(board, thread_numbers)
+            return threads, chan_client.pop_validators()
+
+    return asyncio.run(run())
@@ -0,0 +1,231 @@
+import logging
+import datetime
+import pymongo
+from pymongo import UpdateMany
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan board state")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Builds a fingerprint for every live thread in a catalog.json or threads.json listing,
+# keyed by thread number (as a string, Mongo keys must be strings).
+# Only uses fields both endpoints return so sweeps can switch between them without re-queueing everything.
+# last_modified changes on any new post/edit/deletion and replies catches the rest.
+def thread_fingerprints_from_catalog(catalog):
+    fingerprints = {}
+    for page in catalog:
+        for thread in page["threads"]:
+            fingerprints[str(thread["no"])] = {
+                "last_modified": thread.get("last_modified"),
+                "replies": thread.get("replies", 0)
+            }
+    return fingerprints
+
+# Position of every live thread in a catalog.json or threads.json listing: {thread number: (page, bump order)}.
+# Pages count from 1, bump order counts from 0 for the most recently bumped thread of the board.
+def thread_positions_from_catalog(catalog):
+    positions = {}
+    bump_order = 0
+    for page in catalog:
+        for thread in page["threads"]:
+            positions[thread["no"]] = (page["page"], bump_order)
+            bump_order += 1
+    return positions
+
+# Threads on the last final_pages pages of a listing, the next ones 4chan prunes.
+# Ordered by bump order, the thread closest to being pruned first.
+def final_page_threads(catalog, final_pages):
+    positions = thread_positions_from_catalog(catalog)
+    first_final_page = len(catalog) - final_pages + 1
+    threads = [thread_number for thread_number, (page, _) in positions.items() if page >= first_final_page]
+    return sorted(threads, key=lambda thread_number: positions[thread_number][1], reverse=True)
+
+# Loads the fingerprints we saved for a board on the previous sweep. Empty on the very first sweep.
+def load_previous_fingerprints(state_collection, board):
+    try:
+        state = state_collection.find_one({"_id": board}, {"fingerprints": 1})
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error loading catalog fingerprints for /{board}/: {e}")
+        return {}
+    return state.get("fingerprints", {}) if state else {}
+
+# Replaces the saved fingerprints of a board with the ones from the current sweep.
+def save_fingerprints(state_collection, board, fingerprints):
+    try:
+        state_collection.update_one(
+            {"_id": board},
+            {"$set": {"fingerprints": fingerprints, "updated_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}},
+            upsert=True
+        )
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error saving catalog fingerprints for /{board}/: {e}")
+
+# Drops the saved fingerprints of threads whose crawl failed, so the next sweep sees them as new and queues them again.
+def clear_fingerprints(state_collection, board, thread_numbers):
+    thread_numbers = list(thread_numbers)
+    if not thread_numbers:
+        return
+    try:
+        state_collection.update_one({"_id": board}, {"$unset": {f"fingerprints.{thread_number}": "" for thread_number in thread_numbers}})
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error clearing catalog fingerprints for /{board}/: {e}")
+
+# Loads the threads that were on the final pages of a board in the previous sweep. They already got their
+# final pre-prune fetch, and a thread that vanishes from there was pruned rather than deleted.
+def load_final_captures(state_collection, board):
+    try:
+        state = state_collection.find_one({"_id": board}, {"final_captures": 1})
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error loading final captures for /{board}/: {e}")
+        return set()
+    return set(state.get("final_captures", [])) if state else set()
+
+def save_final_captures(state_collection, board, thread_numbers):
+    try:
+        state_collection.update_one({"_id": board}, {"$set": {"final_captures": list(thread_numbers)}}, upsert=True)
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error saving final captures for /{board}/: {e}")
+
+# Returns the thread numbers that are new or whose fingerprint changed since the previous sweep.
+def find_changed_threads(previous_fingerprints, current_fingerprints):
+    return [
+        int(thread_number) for thread_number, fingerprint in current_fingerprints.items()
+        if previous_fingerprints.get(thread_number) != fingerprint
+    ]
+
+# Reads the active (stored and not deleted) thread numbers of a board from the index in one query.
+# The first time a board is seen the index is seeded from the thread collection with a projection-only distinct.
+def load_active_threads(index_collection, threads_collection, board):
+    try:
+        index = index_collection.find_one({"_id": board}, {"thread_numbers": 1})
+        if index is not None:
+            return set(index.get("thread_numbers", []))
+
+        thread_numbers = threads_collection.distinct("thread_number", {"board": board, "is_deleted": {"$ne": True}})
+        index_collection.update_one({"_id": board}, {"$set": {"thread_numbers": thread_numbers}}, upsert=True)
+        logger.info(f"Seeded active thread index for /{board}/ with {len(thread_numbers)} threads.")
+        return set(thread_numbers)
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error loading active thread index for /{board}/: {e}")
+        return set()
+
+# Which of the given threads of a board are stored and not deleted, in one projection-only distinct.
+def load_stored_threads(threads_collection, board, thread_numbers):
+    thread_numbers = list(thread_numbers)
+    if not thread_numbers:
+        return set()
+    try:
+        return set(threads_collection.distinct("thread_number", {"board": board, "thread_number": {"$in": thread_numbers}, "is_deleted": {"$ne": True}}))
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error loading stored threads for /{board}/: {e}")
+        return set()
+
+# Adds newly stored threads to the active index of a board.
+def add_active_threads(index_collection, board, thread_numbers):
+    thread_numbers = list(thread_numbers)
+    if not thread_numbers:
+        return
+    try:
+        index_collection.update_one({"_id": board}, {"$addToSet": {"thread_numbers": {"$each": thread_numbers}}}, upsert=True)
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error adding threads to active index for /{board}/: {e}")
+
+# Removes deleted threads from the active index of a board.
+def remove_active_threads(index_collection, board, thread_numbers):
+    thread_numbers = list(thread_numbers)
+    if not thread_numbers:
+        return
+    try:
+        index_collection.update_one({"_id": board}, {"$pull": {"thread_numbers": {"$in": thread_numbers}}})
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error removing threads from active index for /{board}/: {e}")
+
+# Update pipeline that marks a thread as deleted while keeping previous context.
+# It is an aggregation pipeline, so the snapshot kept in history and the "[deleted]" replies
+# are computed by MongoDB from the stored document itself.
+def deleted_thread_pipeline(deleted_at):
+    return [{"$set": {
+        # History - previous context to modify json structure after Deletion.
+        "history": [{
+            "crawled_at": deleted_at,
+            "original_post": "$original_post",
+            "replies": "$replies",
+            "number_of_replies": {"$ifNull": ["$number_of_replies", 0]}
+        }],
+        "original_post.com": "[deleted]",
+        # Threads in the split post layout keep their replies in the posts collection, see chan_post_store.
+        "replies": {"$cond": [
+            {"$eq": ["$post_store", "split"]},
+            "$$REMOVE",
+            {"$map": {
+                "input": {"$ifNull": ["$replies", []]},
+                "as": "reply",
+                "in": {"$mergeObjects": ["$$reply", {"com": "[deleted]"}]}
+            }}
+        ]},
+        "number_of_replies": 0,
+        "deleted_at": {"$ifNull": ["$deleted_at", deleted_at]},
+        "is_deleted": True
+    }}]
+
+# Marks many threads of a board as deleted with one update_many and no document reads.
+# Threads already marked as deleted are left alone. Returns the number of threads that were marked.
+def mark_threads_as_deleted(threads_collection, board, thread_numbers):
+    thread_numbers = list(thread_numbers)
+    if not thread_numbers:
+        return 0
+    deleted_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        result = threads_collection.update_many(
+            {"board": board, "thread_number": {"$in": thread_numbers}, "is_deleted": {"$ne": True}},
+            deleted_thread_pipeline(deleted_at)
+        )
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error marking {len(thread_numbers)} threads on /{board}/ as deleted: {e}")
+        return 0
+    return result.modified_count
+
+# Splits the stored threads missing from a listing by why they left the board, with set operations only:
+#   archived - listed in the board's archive.json, still readable and left untouched.
+#   pruned   - sank off the final pages without being archived, their content is kept as last crawled.
+#   deleted  - everything else, removed by a moderator or the poster.
+# Returns (archived, pruned, deleted).
+def classify_missing_threads(missing_threads, archived_threads=None, final_page_threads=()):
+    missing_threads = set(missing_threads)
+    archived = missing_threads & set(archived_threads or ())
+    pruned = (missing_threads - archived) & set(final_page_threads)
+    deleted = missing_threads - archived - pruned
+    return archived, pruned, deleted
+
+# Records the outcome of classify_missing_threads with a single bulk_write of (at most) three update_many.
+# Returns the bulk write result, None if nothing was written.
+def resolve_missing_threads(threads_collection, board, archived, pruned, deleted):
+    resolved_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    writes = []
+    if archived:
+        writes.append(UpdateMany(
+            {"board": board, "thread_number": {"$in": list(archived)}, "is_deleted": {"$ne": True}},
+            {"$set": {"is_archived": True, "archived_at": resolved_at}}
+        ))
+    if pruned:
+        writes.append(UpdateMany(
+            {"board": board, "thread_number": {"$in": list(pruned)}, "is_deleted": {"$ne": True}},
+            {"$set": {"is_pruned": True, "pruned_at": resolved_at}}
+        ))
+    if deleted:
+        writes.append(UpdateMany(
+            {"board": board, "thread_number": {"$in": list(deleted)}, "is_deleted": {"$ne": True}},
+            deleted_thread_pipeline(resolved_at)
+        ))
+    if not writes:
+        return None
+    try:
+        return threads_collection.bulk_write(writes, ordered=False)
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error resolving {len(archived) + len(pruned) + len(deleted)} missing threads on /{board}/: {e}")
+        return None
@@ -0,0 +1,91 @@
+import datetime
+import functools
+import html
+import json
+import re
+
+# orjson parses 4chan payloads several times faster than the standard json module, use it when installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Declared post schema: the 4chan fields we never store. Everything else the API returns is kept,
+# so new fields added by 4chan still end up in the database like before.
+# Attributes to exclude from the original post
+ORIGINAL_POST_EXCLUDE_FIELDS = frozenset([
+    "now", "filename", "ext", "w", "h", "tn_w", "tn_h", "md5",
+    "fsize", "resto", "m_img", "imagelimit", "semantic_url",
+    "custom_spoiler", "replies", "images", "sticky", "closed", "capcode",
+    "unique_ips", "tail_size", "tim", "bumplimit", "no", "time", "id",
+    "country_name", "board_flag", "flag_name", "tail_id"
+])
+# Attributes to exclude from replies
+REPLIES_EXCLUDE_FIELDS = frozenset([
+    "now", "filename", "ext", "w", "h", "tn_w", "tn_h", "md5", "tim",
+    "fsize", "capcode", "resto", "time", "id", "country_name", "m_img"
+])
+
+# Compiled once instead of on every reply. Same pattern as before, so cleaned text is unchanged.
+HTML_TAG_PATTERN = re.compile(r'<.*?>')
+
+# Parses a raw API response body (bytes or str).
+def decode_json(raw):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+# Cleans up "com" for OP and replies: unescapes html entities, then strips tags.
+# Most replies have neither, those are returned without touching the regex engine.
+def clean_html_content(html_content):
+    if '&' not in html_content and '<' not in html_content:
+        return html_content
+    return HTML_TAG_PATTERN.sub('', html.unescape(html_content))
+
+# Converting the UNIX Timestamp to a human-readable format.
+# Replies arrive in bursts within the same second, so formatted values are memoised.
+@functools.lru_cache(maxsize=65536)
+def convert_timestamp_to_readable(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+def convert_timestamps_to_readable(timestamps):
+    return [convert_timestamp_to_readable(timestamp) for timestamp in timestamps]
+
+# we filter the unwanted fields from the original post and replies.
+# Accepts a decoded thread or the raw response body.
+def filter_thread_data(thread_data):
+    if isinstance(thread_data, (bytes, str)):
+        thread_data = decode_json(thread_data)
+
+    posts = thread_data['posts']
+    original_post = posts[0]
+    replies = posts[1:]
+
+    filtered_original_post = {
+        key: value for key, value in original_post.items()
+        if key not in ORIGINAL_POST_EXCLUDE_FIELDS
+    }
+    filtered_original_post['com'] = clean_html_content(filtered_original_post.get('com', ''))
+    filtered_original_post['OP_Created_at'] = convert_timestamp_to_readable(original_post['time'])
+
+    reply_created_at = convert_timestamps_to_readable([reply['time'] for reply in replies])
+    filtered_replies = []
+    for reply, created_at in zip(replies, reply_created_at):
+        filtered_reply = {key: value for key, value in reply.items() if key not in REPLIES_EXCLUDE_FIELDS}
+        filtered_reply['com'] = clean_html_content(reply.get('com', ''))
+        filtered_reply['Reply_Created_at'] = created_at
+        filtered_replies.append(filtered_reply)
+
+    return filtered_original_post, filtered_replies
+
+# Merges the replies of a -tail.json fetch into the replies we already hold for a thread.
+# The tail must overlap what we hold (its first reply is not newer than our last one), otherwise
+# replies in between may be missing and None is returned so the caller fetches the full thread.
+def merge_tail_replies(existing_replies, tail_replies):
+    if not existing_replies or not tail_replies:
+        return None
+    first_tail_reply_no = tail_replies[0]['no']
+    last_existing_reply_no = max(reply['no'] for reply in existing_replies)
+    if first_tail_reply_no > last_existing_reply_no:
+        return None
+    return [reply for reply in existing_replies if reply['no'] < first_tail_reply_no] + tail_replies
@@ -0,0 +1,421 @@
+import logging
+import os
+import time
+import datetime
+from pyfaktory import Client, Producer, Consumer, Job
+from requests.exceptions import HTTPError, RequestException
+from chan_async_client import fetch_threads_blocking
+from chan_decoder import filter_thread_data, merge_tail_replies
+from chan_validator_store import NOT_MODIFIED
+from chan_board_state import thread_fingerprints_from_catalog, load_previous_fingerprints, save_fingerprints, clear_fingerprints, find_changed_threads
+from chan_board_state import final_page_threads, load_final_captures, save_final_captures
+from chan_jobs import thread_jobs, push_jobs, job_thread_numbers
+from chan_recrawl_scheduler import RecrawlScheduler
+from worker_supervisor import TimedJob, faktory_queue_depth
+from crawler_metrics import MONGO_OPERATION_SECONDS
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan fetch pipeline")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Constants used when retrying incase of http errors
+MAX_RETRIES = 5
+RETRY_DELAY = 5
+MAX_RETRY_DELAY = 60
+
+# How crawl_board lists live threads: "threads" uses the small threads.json (number, last_modified, replies per page),
+# "catalog" downloads the full catalog.json with OP bodies. threads mode falls back to the catalog if threads.json fails.
+SWEEP_MODE = os.getenv("CHAN_SWEEP_MODE", "threads")
+# "sweep" queues a board crawl every sweep interval, "adaptive" keeps every live thread in a
+# RecrawlScheduler and queues each one when it is due based on its reply velocity and page (see chan_recrawl_scheduler).
+SCHEDULE_MODE = os.getenv("CHAN_SCHEDULE_MODE", "sweep")
+# In adaptive mode, how often the board listings are re-read to pick up new, moved and vanished threads.
+LISTING_INTERVAL_SECONDS = int(os.getenv("CHAN_LISTING_INTERVAL_SECONDS", 60))
+# Threads reaching the last FINAL_CAPTURE_PAGES pages of a board get one last fetch before 4chan prunes them (0 disables).
+FINAL_CAPTURE_PAGES = int(os.getenv("CHAN_FINAL_CAPTURE_PAGES", 1))
+# Give threads that left the board into its archive a final fetch of their archived state.
+FINAL_CAPTURE_ARCHIVE = os.getenv("CHAN_FINAL_CAPTURE_ARCHIVE", "false").lower() == "true"
+
+# Gets all the thread numbers of a catalog, Used in crawl_board function.
+def thread_numbers_from_catalog(catalog):
+    thread_numbers = []
+    for page in catalog:
+        for thread in page["threads"]:
+            thread_numbers.append(thread["no"])
+    return thread_numbers
+
+# The sinks (thread stores) that store a board.
+def board_sinks(sinks, board):
+    return [sink for sink in sinks if board in sink.boards]
+
+class FetchPipeline:
+    """
+    The fetch side of the chan crawlers. It lists the boards, queues new, changed and final threads once through
+    Faktory behind job leases, fetches and decodes every thread once and hands it to each sink of its board.
+    A sink is a ThreadStore (see chan_thread_store). chan_crawler and chan_moderate_crawler each run a pipeline with
+    their own store, chan_pipeline runs one with both so every thread is downloaded and decoded once for the two.
+    Validators, fingerprints and leases describe what this pipeline fetched, so every pipeline keeps its own.
+    Faktory jobs must be module-level functions to pickle by reference, the crawler modules wrap the crawl_* methods.
+    """
+
+    def __init__(self, sinks, client_class, validator_store, rate_governor, catalog_state_collection, job_leases,
+                 board_jobtype, thread_jobtype, batch_jobtype, faktory_url, logger=logger):
+        self.sinks = sinks
+        # Every board some sink stores, each swept once.
+        self.boards = list(dict.fromkeys(board for sink in sinks for board in sink.boards))
+        self.client_class = client_class
+        self.validator_store = validator_store
+        self.rate_governor = rate_governor
+        self.catalog_state_collection = catalog_state_collection
+        self.job_leases = job_leases
+        self.board_jobtype = board_jobtype
+        self.thread_jobtype = thread_jobtype
+        self.batch_jobtype = batch_jobtype
+        self.worker_queues = [board_jobtype, thread_jobtype, batch_jobtype]
+        self.faktory_url = faktory_url
+        self.logger = logger
+        # archive.json is read with validators kept in this process only, so a 304 can always be answered from the cached list.
+        self.archive_client = client_class(rate_governor=rate_governor)
+        self.archived_threads_cache = {}
+
+    def board_sinks(self, board):
+        return board_sinks(self.sinks, board)
+
+    # Error handling incase of HTTP or network errors, same as the error handling in execute_request in chan_client.
+    def retry_on_network_and_http_errors(self, func, *args):
+        retries = 0
+        delay = RETRY_DELAY
+        while retries < MAX_RETRIES:
+            try:
+                return func(*args)
+            except HTTPError as http_err:
+                status_code = http_err.response.status_code
+
+                # Case when thread maybe deleted or fell into archive board or resource not found in general
+                if status_code == 404:
+                    self.logger.warning(f"Resource not found (404). Thread {args[1]} might be deleted.")
+                    return None
+
+                # Case when Too Many Requests (Rate Limit Error)
+                elif status_code == 429:
+                    retry_after = int(http_err.response.headers.get("Retry-After", delay))
+                    self.logger.warning(f"Rate limit hit (429). Retrying after {retry_after} seconds...")
+                    time.sleep(retry_after)
+
+                # Client-side error
+                elif 400 <= status_code < 500:
+                    self.logger.warning(f"Client error {status_code} occurred for thread {args[1]}. Retrying in {delay} seconds...")
+                    time.sleep(delay)
+
+                # Case when Server Side Error
+                elif 500 <= status_code < 600:
+                    self.logger.error(f"Server error (status {status_code}) occurred. Retrying in {delay} seconds...")
+                    time.sleep(delay)
+                    # Capped exponential backoff
+                    delay = min(delay * 2, MAX_RETRY_DELAY)
+                else:
+                    self.logger.error(f"Unexpected HTTP error: {http_err}")
+                    return None
+
+            except RequestException as req_err:
+                self.logger.error(f"Network error: {req_err}. Retrying in {delay} seconds...")
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+        self.logger.error(f"Max retries reached. Failed to execute {func.__name__} after {MAX_RETRIES} attempts.")
+        return None
+
+    # A thread whose fetch or store failed loses its fingerprint, the next sweep then queues it again
+    # even if the listing shows no change since.
+    def retry_next_sweep(self, board, thread_numbers):
+        thread_numbers = list(thread_numbers)
+        if thread_numbers:
+            self.logger.warning(f"Crawl of {len(thread_numbers)} threads on /{board}/ failed, they are queued again on the next sweep.")
+            clear_fingerprints(self.catalog_state_collection, board, thread_numbers)
+
+    # Used when a fetch returns nothing. The thread is not marked here, the next listing of the board
+    # resolves it together with every other thread that left (archived, pruned or deleted) in one write.
+    def handle_missing_thread(self, board, thread_number):
+        self.logger.warning(f"Thread {thread_number} might be deleted or unavailable, leaving it to the next board sweep.")
+
+    # Fetches a thread for an update. A stored thread that advertises tail_size is refreshed from the much smaller
+    # -tail.json and merged with the replies we hold, the full thread is only downloaded when the tail doesn't overlap.
+    # Returns NOT_MODIFIED, None (deleted/unavailable) or (filtered_original_post, filtered_replies, tail_size).
+    def fetch_thread_update(self, chan_client, board, thread_number, existing_thread):
+        if existing_thread and existing_thread.get("tail_size") and not existing_thread.get("is_deleted", False):
+            tail_data = self.retry_on_network_and_http_errors(chan_client.get_thread_tail, board, thread_number)
+            if tail_data is NOT_MODIFIED:
+                return NOT_MODIFIED
+            if tail_data is not None:
+                filtered_original_post, tail_replies = filter_thread_data(tail_data)
+                merged_replies = merge_tail_replies(existing_thread.get("replies", []), tail_replies)
+                if merged_replies is not None:
+                    self.logger.info(f"Merged {len(tail_replies)} tail replies into thread {board}/{thread_number}.")
+                    return filtered_original_post, merged_replies, tail_data['posts'][0].get('tail_size')
+            self.logger.info(f"Tail of thread {board}/{thread_number} doesn't overlap the stored replies, fetching the full thread.")
+
+        thread_data = self.retry_on_network_and_http_errors(chan_client.get_thread, board, thread_number)
+        if thread_data is NOT_MODIFIED or thread_data is None:
+            return thread_data
+        filtered_original_post, filtered_replies = filter_thread_data(thread_data)
+        return filtered_original_post, filtered_replies, thread_data['posts'][0].get('tail_size')
+
+    # Crawls a single thread and hands it to every sink of its board.
+    # With a single sink a stored large thread is refreshed from its -tail.json, merged with the replies that sink holds.
+    # With several sinks the stored replies differ, so the thread is always fetched in full.
+    def crawl_thread(self, board, thread_number):
+        chan_client = self.client_class(validator_store=self.validator_store, rate_governor=self.rate_governor)
+        self.logger.info(f"Fetching thread {board}/{thread_number}...")
+        # From here on a new change to the thread queues another job.
+        self.job_leases.release(self.thread_jobtype, board, [thread_number])
+        sinks = self.board_sinks(board)
+
+        existing_threads = None
+        if len(sinks) == 1:
+            with MONGO_OPERATION_SECONDS.time(job="crawl_thread", operation="load_thread"):
+                existing_threads = sinks[0].load_threads(board, [thread_number])
+            if existing_threads is None:
+                self.retry_next_sweep(board, [thread_number])
+                return 0
+
+        thread_update = self.fetch_thread_update(chan_client, board, thread_number, (existing_threads or {}).get(thread_number))
+
+        # Thread unchanged since our last fetch (304), skip parsing, diffing and writing entirely.
+        if thread_update is NOT_MODIFIED:
+            self.logger.info(f"Thread {board}/{thread_number} not modified since last crawl. Skipping.")
+            return 1
+
+        # If a thread is deleted or archived or not found.
+        if thread_update is None:
+            self.handle_missing_thread(board, thread_number)
+            self.retry_next_sweep(board, [thread_number])
+            return 0
+        self.logger.info(f"Successfully fetched thread {board}/{thread_number}.")
+
+        crawled_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        stored = [sink.store_threads(board, {thread_number: thread_update}, crawled_at, existing_threads=existing_threads) for sink in sinks]
+        if any(writes is None for writes in stored):
+            self.retry_next_sweep(board, [thread_number])
+            return 0
+
+        # The thread is stored, so its validators can answer the next fetch with a 304.
+        chan_client.commit_validators()
+        return 1
+
+    # Crawls many threads of one board together: fetches them concurrently over one pool, decodes each once
+    # and hands the changed ones to every sink of the board, which writes them through bulk_write.
+    # Always full fetches: the -tail.json merge needs the stored replies, which differ per sink.
+    def crawl_threads(self, board, thread_numbers):
+        thread_numbers = list(thread_numbers)
+        self.logger.info(f"Fetching {len(thread_numbers)} threads from /{board}/...")
+        self.job_leases.release(self.thread_jobtype, board, thread_numbers)
+        fetched_threads, fetched_validators = fetch_threads_blocking(board, thread_numbers, validator_store=self.validator_store, rate_governor=self.rate_governor)
+
+        crawled_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        changed_threads = {}
+        failed_threads = []
+        for thread_number, thread_data in fetched_threads.items():
+            if thread_data is NOT_MODIFIED:
+                continue
+            if thread_data is None:
+                self.handle_missing_thread(board, thread_number)
+                failed_threads.append(thread_number)
+                continue
+            changed_threads[thread_number] = (*filter_thread_data(thread_data), thread_data['posts'][0].get('tail_size'))
+
+        # Validators are saved in one batch once every sink stored every changed thread, a failed write refetches them all.
+        sinks = self.board_sinks(board)
+        stored = [sink.store_threads(board, changed_threads, crawled_at) for sink in sinks]
+        if all(writes is not None for writes in stored):
+            self.validator_store.set_many(fetched_validators)
+        else:
+            failed_threads.extend(changed_threads)
+        self.retry_next_sweep(board, failed_threads)
+
+        self.logger.info(f"Crawled {len(thread_numbers)} threads from /{board}/, {len(changed_threads)} changed, {stored} written by {len(sinks)} sinks.")
+        return len(changed_threads)
+
+    # Lists the live threads of a board for a sweep.
+    # threads.json is enough for liveness and change detection, the catalog is only downloaded
+    # when OP metadata is needed or threads.json could not be fetched.
+    def fetch_board_listing(self, chan_client, board, sweep_mode=SWEEP_MODE):
+        if sweep_mode == "threads":
+            listing = self.retry_on_network_and_http_errors(chan_client.get_threads, board)
+            if listing is not None:
+                return listing
+            self.logger.warning(f"Failed to retrieve threads.json for /{board}/, falling back to the catalog.")
+        return self.retry_on_network_and_http_errors(chan_client.get_catalog, board)
+
+    # Thread numbers in the archive of a board, None if the board has no archive or it could not be fetched.
+    def load_archived_threads(self, board):
+        archive = self.retry_on_network_and_http_errors(self.archive_client.get_archive, board)
+        if archive is NOT_MODIFIED:
+            return self.archived_threads_cache.get(board)
+        if archive is None:
+            return None
+        self.archived_threads_cache[board] = set(archive)
+        self.archive_client.commit_validators()
+        return self.archived_threads_cache[board]
+
+    # Sweeps a board once for all its sinks: one listing and one archive.json, each sink reconciles the threads that
+    # left, then new, changed and final threads are queued once.
+    def crawl_board(self, board, sweep_mode=SWEEP_MODE):
+        chan_client = self.client_class(validator_store=self.validator_store, rate_governor=self.rate_governor)
+        catalog = self.fetch_board_listing(chan_client, board, sweep_mode)
+
+        # Listing unchanged since the last sweep (304), so there is nothing new to queue or reconcile.
+        if catalog is NOT_MODIFIED:
+            self.logger.info(f"Thread listing for /{board}/ not modified since last crawl. Skipping.")
+            return
+
+        if catalog is None:
+            self.logger.error(f"Failed to retrieve catalog for board /{board}/")
+            return
+
+        # Latest Crawl Thread Numbers which are active thread numbers in a specific board.
+        current_thread_numbers = thread_numbers_from_catalog(catalog)
+        total_original_posts = len(current_thread_numbers)
+
+        # archive.json is read once per sweep, it tells archived threads apart from deleted ones without any per-thread request.
+        archived_threads = self.load_archived_threads(board)
+        final_page_captures = load_final_captures(self.catalog_state_collection, board)
+
+        # Handling Deleted Threads again just to make sure.
+        archived_missing_threads = set()
+        for sink in self.board_sinks(board):
+            sink.run_maintenance()
+            archived_missing_threads |= sink.reconcile_missing_threads(board, current_thread_numbers, archived_threads, final_page_captures)
+
+        # Only threads that are new or whose catalog fingerprint changed since the previous sweep need a fetch.
+        current_fingerprints = thread_fingerprints_from_catalog(catalog)
+        previous_fingerprints = load_previous_fingerprints(self.catalog_state_collection, board)
+        changed_thread_numbers = find_changed_threads(previous_fingerprints, current_fingerprints)
+        self.logger.info(f"{len(changed_thread_numbers)} of {total_original_posts} threads on /{board}/ are new or changed since the last sweep.")
+
+        # Threads that just reached the final pages get one last fetch, closest to being pruned first.
+        # The final pages are recorded either way, a thread vanishing from there next sweep was pruned.
+        final_page_thread_numbers = final_page_threads(catalog, max(FINAL_CAPTURE_PAGES, 1))
+        final_thread_numbers = []
+        if FINAL_CAPTURE_PAGES:
+            final_thread_numbers = [thread_number for thread_number in final_page_thread_numbers if thread_number not in final_page_captures]
+        if FINAL_CAPTURE_ARCHIVE:
+            final_thread_numbers.extend(sorted(archived_missing_threads))
+        if final_thread_numbers:
+            self.logger.info(f"Queueing a final fetch for {len(final_thread_numbers)} threads on /{board}/ about to be pruned or archived.")
+        final_thread_set = set(final_thread_numbers)
+        queued_thread_numbers = final_thread_numbers + [thread_number for thread_number in changed_thread_numbers if thread_number not in final_thread_set]
+
+        # Threads that still have a job waiting in the queue are not queued again, that job fetches their latest state anyway.
+        queued_thread_numbers = self.job_leases.acquire(self.thread_jobtype, board, queued_thread_numbers)
+
+        # Queueing Jobs for crawl thread in faktory (Enqueued)
+        try:
+            with Client(faktory_url=self.faktory_url, role="producer") as client:
+                producer = Producer(client=client)
+                rejected_jobs = push_jobs(producer, thread_jobs(self.thread_jobtype, self.batch_jobtype, board, queued_thread_numbers))
+        except Exception:
+            # Nothing was queued for sure, so the next sweep must be able to queue these threads.
+            self.job_leases.release(self.thread_jobtype, board, queued_thread_numbers)
+            raise
+
+        # Threads whose jobs Faktory rejected were not queued: their leases are released and they are left out of
+        # the saved fingerprints and final captures, so the next sweep queues them again.
+        rejected_thread_numbers = set(job_thread_numbers(rejected_jobs))
+        if rejected_thread_numbers:
+            self.job_leases.release(self.thread_jobtype, board, rejected_thread_numbers)
+            current_fingerprints = {thread_number: fingerprint for thread_number, fingerprint in current_fingerprints.items() if int(thread_number) not in rejected_thread_numbers}
+            final_page_thread_numbers = [thread_number for thread_number in final_page_thread_numbers if thread_number not in rejected_thread_numbers]
+
+        # Saved only after the jobs are queued, so a failed push is retried on the next sweep.
+        save_fingerprints(self.catalog_state_collection, board, current_fingerprints)
+        save_final_captures(self.catalog_state_collection, board, final_page_thread_numbers)
+        chan_client.commit_validators()
+
+        self.logger.info(f"Queued crawl jobs for {len(queued_thread_numbers) - len(rejected_thread_numbers)} new, changed or final threads on /{board}/")
+        self.logger.info(f"Total original posts crawled from /{board}/: {total_original_posts}")
+
+    # Queues a board sweep for every board every interval_minutes.
+    def schedule_crawl_jobs_continuously(self, interval_minutes):
+        # Keeps track of which crawl we are currently performing.
+        crawl_count = 0
+        while True:
+            crawl_count += 1
+            with Client(faktory_url=self.faktory_url, role="producer") as client:
+                producer = Producer(client=client)
+                push_jobs(producer, [Job(jobtype=self.board_jobtype, args=(board,), queue=self.board_jobtype) for board in self.boards])
+                self.logger.info(f"Scheduled crawl job #{crawl_count} for all boards.")
+
+            self.logger.info(f"Crawl #{crawl_count} finished. Waiting for {interval_minutes} minutes before the next crawl.")
+            time.sleep(interval_minutes * 60)
+
+    # Queues thread crawls as they come due instead of sweeping whole boards on a fixed interval.
+    # Board listings are re-read every LISTING_INTERVAL_SECONDS (cheap and usually a 304) to find new threads,
+    # page positions and deletions. Crawled threads are rescheduled from their latest history entries.
+    def schedule_crawl_jobs_adaptively(self, listing_interval_seconds=LISTING_INTERVAL_SECONDS):
+        scheduler = RecrawlScheduler(final_pages=FINAL_CAPTURE_PAGES)
+        # Validators kept in memory only, so the first listing after a restart is always a full one to seed the queue.
+        chan_client = self.client_class(rate_governor=self.rate_governor)
+        next_listing_at = 0
+        while True:
+            now = time.time()
+            if now >= next_listing_at:
+                for board in self.boards:
+                    catalog = self.fetch_board_listing(chan_client, board)
+                    if catalog is NOT_MODIFIED or catalog is None:
+                        continue
+                    archived_threads = self.load_archived_threads(board)
+                    for sink in self.board_sinks(board):
+                        sink.reconcile_missing_threads(board, thread_numbers_from_catalog(catalog), archived_threads, scheduler.final_page_threads(board))
+                    scheduler.observe_listing(board, catalog, now)
+                    chan_client.commit_validators()
+                next_listing_at = now + listing_interval_seconds
+
+            due_threads = scheduler.pop_due(now)
+            if due_threads:
+                due_by_board = {}
+                for board, thread_number in due_threads:
+                    due_by_board.setdefault(board, []).append(thread_number)
+
+                with Client(faktory_url=self.faktory_url, role="producer") as client:
+                    producer = Producer(client=client)
+                    for board, thread_numbers in due_by_board.items():
+                        rejected_jobs = push_jobs(producer, thread_jobs(self.thread_jobtype, self.batch_jobtype, board, self.job_leases.acquire(self.thread_jobtype, board, thread_numbers)))
+                        # Rejected threads were not queued, releasing their leases lets their next due time queue them.
+                        self.job_leases.release(self.thread_jobtype, board, job_thread_numbers(rejected_jobs))
+
+                # Sinks of a board see the same crawls, the first one's history paces the thread.
+                for board, thread_numbers in due_by_board.items():
+                    histories = self.board_sinks(board)[0].load_thread_histories(board, thread_numbers)
+                    for thread_number in thread_numbers:
+                        scheduler.reschedule(board, thread_number, histories.get(thread_number, []), now)
+                self.logger.info(f"Queued crawl jobs for {len(due_threads)} due threads, {len(scheduler)} threads scheduled.")
+
+            next_due_at = scheduler.next_due_at()
+            wake_at = next_listing_at if next_due_at is None else min(next_listing_at, next_due_at)
+            time.sleep(max(1, wake_at - time.time()))
+
+    # Indexes the jobs and the sinks' writes rely on, created once per worker start.
+    def prepare_storage(self):
+        self.job_leases.ensure_indexes()
+        for sink in self.sinks:
+            sink.prepare_storage()
+
+    # Consumes the board, thread and thread-batch jobs with the crawler module's job functions.
+    def start_worker(self, concurrency, crawl_board, crawl_thread, crawl_threads):
+        self.prepare_storage()
+        with Client(faktory_url=self.faktory_url, role="consumer") as client:
+            consumer = Consumer(client=client, queues=self.worker_queues, concurrency=concurrency)
+            consumer.register(self.board_jobtype, TimedJob(crawl_board))
+            consumer.register(self.thread_jobtype, TimedJob(crawl_thread))
+            consumer.register(self.batch_jobtype, TimedJob(crawl_threads))
+            self.logger.info("Worker started. Listening for jobs...")
+            consumer.run()
+
+    # Jobs waiting in the worker queues, the supervisor sizes the worker pool from it.
+    def queue_depth(self):
+        return faktory_queue_depth(self.faktory_url, self.worker_queues)
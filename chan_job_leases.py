@@ -0,0 +1,85 @@
+import logging
+import os
+import datetime
+import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan job leases")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# How long a queued thread job holds its lease. A job that is lost (worker crash, queue flushed) stops
+# blocking its thread after this, so keep it above the longest expected queue wait.
+JOB_LEASE_SECONDS = int(os.getenv("CHAN_JOB_LEASE_SECONDS", 1800))
+
+# Duplicate key error code, raised when the upsert of a lease hits one that is still live.
+DUPLICATE_KEY_ERROR = 11000
+
+class JobLeases:
+    """
+    Keeps at most one pending crawl job per (jobtype, board, thread_number) across overlapping sweeps and schedulers.
+    A lease is one document per key holding its expiry. acquire() takes the leases of many threads with a single
+    unordered bulk upsert that only matches expired leases, so a live lease makes its upsert fail with a duplicate key
+    and that thread is dropped. Workers release the lease when the job starts, so changes seen while a thread
+    is being crawled queue it again. A TTL index cleans up leases of jobs that never ran.
+    """
+
+    def __init__(self, collection, lease_seconds=JOB_LEASE_SECONDS):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+
+    def ensure_indexes(self):
+        self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    @staticmethod
+    def lease_key(jobtype, board, thread_number):
+        return f"{jobtype}:{board}:{thread_number}"
+
+    # Takes the leases of the given threads and returns the ones that had no pending job, in order.
+    # If MongoDB fails every thread is returned, a duplicate job is better than a missed one.
+    def acquire(self, jobtype, board, thread_numbers):
+        thread_numbers = list(thread_numbers)
+        if not thread_numbers:
+            return []
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expires_at = now + datetime.timedelta(seconds=self.lease_seconds)
+        writes = [
+            UpdateOne(
+                {"_id": self.lease_key(jobtype, board, thread_number), "expires_at": {"$lte": now}},
+                {"$set": {"expires_at": expires_at}},
+                upsert=True
+            )
+            for thread_number in thread_numbers
+        ]
+        try:
+            self.collection.bulk_write(writes, ordered=False)
+            return thread_numbers
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                logger.error(f"Error taking job leases for /{board}/: {errors}")
+                return thread_numbers
+            pending = {error["index"] for error in errors}
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error taking job leases for /{board}/: {e}")
+            return thread_numbers
+
+        if pending:
+            logger.info(f"Skipped {len(pending)} threads on /{board}/ that already have a pending {jobtype} job.")
+        return [thread_number for index, thread_number in enumerate(thread_numbers) if index not in pending]
+
+    # Releases the leases of threads whose job started (or failed to be queued).
+    def release(self, jobtype, board, thread_numbers):
+        thread_numbers = list(thread_numbers)
+        if not thread_numbers:
+            return
+        try:
+            self.collection.delete_many({"_id": {"$in": [self.lease_key(jobtype, board, thread_number) for thread_number in thread_numbers]}})
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error releasing job leases for /{board}/: {e}")
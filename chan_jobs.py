@@ -0,0 +1,48 @@
+import logging
+import os
+from pyfaktory import Job
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan jobs")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Jobs sent per PUSHB command, one round trip to Faktory per batch instead of one per job.
+PUSH_BATCH_SIZE = int(os.getenv("CHAN_PUSH_BATCH_SIZE", 500))
+# Thread numbers carried by one thread-batch job, 1 keeps queueing a job per thread.
+THREADS_PER_JOB = int(os.getenv("CHAN_THREADS_PER_JOB", 1))
+
+# Builds the jobs crawling the given threads of a board, in order. With threads_per_job > 1 they are grouped into
+# batch jobs (batch_jobtype, args (board, [thread numbers])) so a worker crawls them with one client and one bulk write.
+def thread_jobs(jobtype, batch_jobtype, board, thread_numbers, threads_per_job=THREADS_PER_JOB):
+    thread_numbers = list(thread_numbers)
+    if threads_per_job <= 1:
+        return [Job(jobtype=jobtype, args=(board, thread_number), queue=jobtype) for thread_number in thread_numbers]
+    return [
+        Job(jobtype=batch_jobtype, args=(board, thread_numbers[start:start + threads_per_job]), queue=batch_jobtype)
+        for start in range(0, len(thread_numbers), threads_per_job)
+    ]
+
+# Pushes jobs over the producer's one connection in PUSHB batches. Returns the jobs Faktory rejected,
+# so callers can release what they reserved for them.
+def push_jobs(producer, jobs, batch_size=PUSH_BATCH_SIZE):
+    rejected = []
+    for start in range(0, len(jobs), batch_size):
+        batch = jobs[start:start + batch_size]
+        failures = producer.push_bulk(batch) or {}
+        if failures:
+            logger.error(f"Faktory rejected {len(failures)} of {len(batch)} jobs: {failures}")
+            rejected.extend(job for job in batch if job.jid in failures)
+    return rejected
+
+# Thread numbers crawled by jobs built by thread_jobs, single thread and batch jobs alike.
+def job_thread_numbers(jobs):
+    thread_numbers = []
+    for job in jobs:
+        job_threads = job.args[1]
+        thread_numbers.extend(job_threads if isinstance(job_threads, list) else [job_threads])
+    return thread_numbers
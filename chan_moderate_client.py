@@ -5,6 +5,11 @@ import json
 import os
 from dotenv import load_dotenv
 from requests.exceptions import HTTPError, RequestException
+from chan_validator_store import NOT_MODIFIED, ValidatorStore
+from chan_rate_governor import local_rate_governor
+from chan_decoder import decode_json
+from crawler_metrics import record_response, RETRY_SLEEP_SECONDS
+from response_capture import capture_response
 
 # Logging to help with debugging
 logger = logging.getLogger("4chan Moderate client")
@@ -24,31 +29,43 @@ class ChanModerateClient:
     # Base Url
     API_BASE = "http://a.4cdn.org"
 
-    def __init__(self):
-        # Caches the last modified time for each API call
-        self.last_modified_times = {}
+    def __init__(self, validator_store=None, rate_governor=None):
+        # Caches the Last-Modified/ETag validators for each API call.
+        # Pass a MongoValidatorStore to share them across jobs and worker restarts.
+        self.validator_store = validator_store if validator_store is not None else ValidatorStore()
+        # Every request waits for a slot from the rate governor, pass a MongoRateGovernor to share it across processes.
+        self.rate_governor = rate_governor if rate_governor is not None else local_rate_governor
+        # Validators of the responses fetched so far, kept here until the caller has stored their data.
+        self.fetched_validators = {}
 
-    def execute_request(self, api_call, headers={}, retries=MAX_RETRIES, retrying_wait_time=RETRY_DELAY):
+    def execute_request(self, api_call, retries=MAX_RETRIES, retrying_wait_time=RETRY_DELAY):
         """
         Executes the Http Get request to crawl from 4chan API Endpoints
         Also, implemented Error Handling and retrying incase of Http Errors
+        Returns NOT_MODIFIED when the server answers 304 to our conditional GET.
         """
+        headers = self.validator_store.conditional_headers(api_call)
         for attempt in range(1, retries + 1):
             try:
-                # Actual Get Request part
+                # Actual Get Request part, once the rate governor hands us a slot.
+                self.rate_governor.acquire()
+                started = time.perf_counter()
                 response = requests.get(api_call, headers=headers)
+                record_response(api_call, response.status_code, time.perf_counter() - started, len(response.content))
+                if response.status_code != 304:
+                    capture_response("chan", api_call, response.status_code, response.content)
 
                 if response.status_code == 304:
-                    logger.info("No new data since last modified.")
-                    return None
+                    logger.info(f"No new data since last modified: {api_call}")
+                    return NOT_MODIFIED
                 
                 response.raise_for_status()
 
-                # If available. we save the last modified time to use in subsequent requests.
-                if 'Last-Modified' in response.headers:
-                    self.last_modified_times[api_call] = response.headers['Last-Modified']
+                data = decode_json(response.content)
+                # If available. we keep the validators to use in subsequent requests, see commit_validators.
+                self.fetched_validators[api_call] = {"last_modified": response.headers.get('Last-Modified'), "etag": response.headers.get('ETag')}
 
-                return response.json()
+                return data
             
             except HTTPError as http_err:
                 status_code = response.status_code
@@ -61,12 +78,17 @@ class ChanModerateClient:
                 # Client-side error
                 elif 400 <= status_code < 500:
                     retry_after = int(response.headers.get("Retry-After", retrying_wait_time)) if status_code == 429 else retrying_wait_time
+                    # On 429 every client backs off, not just this one.
+                    if status_code == 429:
+                        self.rate_governor.penalize(retry_after)
                     logger.warning(f"Client error {status_code} on {api_call}. Retrying in {retry_after} seconds (Attempt {attempt}/{retries})...")
+                    RETRY_SLEEP_SECONDS.inc(retry_after, reason=str(status_code))
                     time.sleep(retry_after)
 
                 # Case when Server Side Error
                 elif 500 <= status_code < 600:
                     logger.error(f"Server error {status_code} on {api_call}. Retrying in {retrying_wait_time} seconds (Attempt {attempt}/{retries})...")
+                    RETRY_SLEEP_SECONDS.inc(retrying_wait_time, reason="5xx")
                     time.sleep(retrying_wait_time)
                     # Capped exponential backoff
                     retrying_wait_time = min(retrying_wait_time * 2, MAX_RETRY_DELAY)
@@ -77,35 +99,44 @@ class ChanModerateClient:
             except RequestException as req_err:
                 # Network-related error, retrying with backoff
                 logger.error(f"Network error: {req_err}. Retrying in {retrying_wait_time} seconds (Attempt {attempt}/{retries})...")
+                RETRY_SLEEP_SECONDS.inc(retrying_wait_time, reason="network")
                 time.sleep(retrying_wait_time)
                 retrying_wait_time = min(retrying_wait_time * 2, MAX_RETRY_DELAY)  
 
         logger.error(f"Max retries reached. Failed to execute request after {retries} attempts: {api_call}")
         return None
 
+    # Hands over the validators fetched since the last call, {api_call: {"last_modified", "etag"}}.
+    def pop_validators(self):
+        validators, self.fetched_validators = self.fetched_validators, {}
+        return validators
+
+    # Saves the fetched validators in one batch. Call it only after the fetched data is stored,
+    # otherwise a failed write would be followed by 304s and the data never fetched again.
+    def commit_validators(self):
+        self.validator_store.set_many(self.pop_validators())
+
     # Connects to API endpoint which fetches all the threads in a specific board.
     def get_threads(self, board):
         api_call = f"{self.API_BASE}/{board}/threads.json"
-        headers = {}
-        if board in self.last_modified_times:
-            headers['If-Modified-Since'] = self.last_modified_times[board]
-
-        return self.execute_request(api_call, headers)
+        return self.execute_request(api_call)
 
     # Connects to API endpoint which fetches all the attributes of a specific thread on a specific board.
     def get_thread(self, board, thread_number):
         api_call = f"{self.API_BASE}/{board}/thread/{thread_number}.json"
-        headers = {}
-        if api_call in self.last_modified_times:
-            headers['If-Modified-Since'] = self.last_modified_times[api_call]
+        return self.execute_request(api_call)
+
+    # Connects to API endpoint which fetches the OP and only the last tail_size replies of a large thread.
+    def get_thread_tail(self, board, thread_number):
+        api_call = f"{self.API_BASE}/{board}/thread/{thread_number}-tail.json"
+        return self.execute_request(api_call)
 
-        return self.execute_request(api_call, headers)
+    # Connects to API endpoint which lists the thread numbers in the archive of a specific board (boards without an archive return 404).
+    def get_archive(self, board):
+        api_call = f"{self.API_BASE}/{board}/archive.json"
+        return self.execute_request(api_call)
 
     # Connects to API endpoint which fetches the catalog (list of live threads) of a specific board.
     def get_catalog(self, board):
         api_call = f"{self.API_BASE}/{board}/catalog.json"
-        headers = {}
-        if board in self.last_modified_times:
-            headers['If-Modified-Since'] = self.last_modified_times[board]
-
-        return self.execute_request(api_call, headers)
\ No newline at end of file
+        return self.execute_request(api_call)
\ No newline at end of file
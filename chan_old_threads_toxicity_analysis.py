@@ -1,21 +1,20 @@
 import logging
 from logging.handlers import RotatingFileHandler
-import pymongo
-from dotenv import load_dotenv
 import os
 import time
-import requests
-from requests.exceptions import HTTPError, RequestException
 import hashlib
+from crawler_resources import load_environment, LazyMongoClient
+from chan_post_store import with_replies, replies_before_deletion
+from toxicity_backends import TOXICITY_BACKEND, get_backend
 
-load_dotenv()
+load_environment()
 
 logger = logging.getLogger("ToxicityAnalysis")
 logger.setLevel(logging.INFO)
 log_file = 'chan_old_toxicity_analysis.log'
 max_log_size = 1 * 1024 * 1024 
 backup_count = 1
-rotating_handler = RotatingFileHandler(log_file, maxBytes=max_log_size, backupCount=backup_count)
+rotating_handler = RotatingFileHandler(log_file, maxBytes=max_log_size, backupCount=backup_count, delay=True)
 rotating_handler.setLevel(logging.INFO)
 stream_handler = logging.StreamHandler()
 stream_handler.setLevel(logging.INFO)
@@ -25,66 +24,35 @@ stream_handler.setFormatter(formatter)
 logger.addHandler(rotating_handler)
 logger.addHandler(stream_handler)
 
-API_URL = "https://api.moderatehatespeech.com/api/v1/moderate/"
-MAX_RETRIES = 5
-RETRY_DELAY = 5
-MAX_RETRY_DELAY = 60
-
 MODERATE_HATESPEECH_API_KEY = os.getenv("CHAN_MODERATE_HATESPEECH_API_KEY_2")
-if not MODERATE_HATESPEECH_API_KEY:
+# Only the remote backend needs the key, the local one scores on this machine (see toxicity_backends).
+if not MODERATE_HATESPEECH_API_KEY and TOXICITY_BACKEND == "moderatehatespeech":
     raise ValueError("MODERATE_HATESPEECH_API_KEY environment variable not set.")
 
 MONGO_DB_URL = os.getenv("MONGO_DB_URL")
 if not MONGO_DB_URL:
     raise ValueError("MONGO_DB_URL environment variable not set.")
-mongo_client = pymongo.MongoClient(MONGO_DB_URL)
+mongo_client = LazyMongoClient(MONGO_DB_URL)
 
 db = mongo_client['4chan_toxicity_old_threads']
 g_tv_moderate_threads_collection = db['g_tv_old_threads']
+g_tv_moderate_posts_collection = db['g_tv_old_posts']
 
 class ToxicityAnalyzer:
     def __init__(self):
-        self.session = requests.Session()
         self.api_key = MODERATE_HATESPEECH_API_KEY
+        self.backend = get_backend(self.api_key)
+
+    # Scores many texts in one batch with the configured backend (the API concurrently and cached, or the local model).
+    # Returns {text: {'class', 'confidence'}}, empty, deleted and failed texts get the 'unknown' class.
+    def analyze_many(self, texts):
+        texts = list(dict.fromkeys(texts))
+        scored_texts = [text for text in texts if text.strip() and text.strip() != '[deleted]']
+        scores = dict(zip(scored_texts, self.backend.score_many(scored_texts))) if scored_texts else {}
+        return {text: scores.get(text) or {'class': 'unknown', 'confidence': 0.0} for text in texts}
 
     def analyze_text(self, text):
-        if not text.strip() or text.strip() == '[deleted]':
-            # Handles empty or deleted text
-            return {'class': 'unknown', 'confidence': 0.0}
-
-        payload = {
-            "token": self.api_key,
-            "text": text
-        }
-        headers = {
-            "Content-Type": "application/json"
-        }
-        retries = 0
-        delay = RETRY_DELAY
-
-        while retries < MAX_RETRIES:
-            try:
-                response = self.session.post(API_URL, json=payload, headers=headers, timeout=10)
-                response.raise_for_status()
-                data = response.json()
-
-                if data.get("response") == "Success":
-                    return {
-                        "class": data.get("class"),
-                        "confidence": float(data.get("confidence"))
-                    }
-                else:
-                    logger.error(f"API Error: {data.get('response')}")
-                    return {'class': 'unknown', 'confidence': 0.0}
-
-            except (HTTPError, RequestException) as e:
-                logger.error(f"Error communicating with ModerateHatespeech API: {e}. Retrying in {delay} seconds...")
-                time.sleep(delay)
-                retries += 1
-                delay = min(delay * 2, MAX_RETRY_DELAY)
-
-        logger.error(f"Max retries reached for text analysis. Text: {text[:30]}...")
-        return {'class': 'unknown', 'confidence': 0.0}
+        return self.analyze_many([text])[text]
 
 def get_content_hash(text):
     return hashlib.md5(text.encode('utf-8')).hexdigest()
@@ -108,13 +76,20 @@ def process_thread(thread):
         if history:
             latest_history = history[-1]
             original_post = latest_history.get('original_post', {})
-            replies = latest_history.get('replies', [])
+            replies = replies_before_deletion(thread, latest_history)
+            # A snapshot that counted replies but yields none would be analysed as a thread without replies.
+            if not replies and latest_history.get('number_of_replies', 0):
+                logger.error(f"Deleted thread {board}/{thread_number} had {latest_history['number_of_replies']} replies but none were found, "
+                             f"only its original post is analyzed.")
 
-            # Analyzing the original post in the historical snapshot
+            # The snapshot's OP and replies are scored together in one concurrent batch.
             original_com = original_post.get('com', '')
+            toxicities = analyzer.analyze_many([original_com] + [reply.get('com', '') for reply in replies])
+
+            # Analyzing the original post in the historical snapshot
             if original_com.strip():
                 original_hash = get_content_hash(original_com)
-                toxicity = analyzer.analyze_text(original_com)
+                toxicity = dict(toxicities[original_com])
                 toxicity['content_hash'] = original_hash
                 toxicity['com'] = original_com
                 latest_history['original_post_toxicity'] = toxicity
@@ -127,7 +102,7 @@ def process_thread(thread):
 
                 if reply_com.strip():
                     reply_hash = get_content_hash(reply_com)
-                    toxicity = analyzer.analyze_text(reply_com)
+                    toxicity = dict(toxicities[reply_com])
                     toxicity['content_hash'] = reply_hash
                     toxicity['reply_no'] = reply_no
                     toxicity['com'] = reply_com
@@ -149,14 +124,27 @@ def process_thread(thread):
     original_post = thread.get('original_post', {})
     replies = thread.get('replies', [])
 
-    # Analyzing the original post
+    existing_replies_toxicity = thread.get('replies_toxicity', [])
+    replies_toxicity_dict = {item['reply_no']: item for item in existing_replies_toxicity}
+
+    # The OP and every new or edited reply are scored together in one concurrent batch.
     original_com = original_post.get('com', '')
+    pending_texts = []
+    if original_com.strip() and original_com.strip() != '[deleted]' and thread.get('original_post_toxicity', {}).get('content_hash') != get_content_hash(original_com):
+        pending_texts.append(original_com)
+    for reply in replies:
+        reply_com = reply.get('com', '')
+        if reply_com.strip() and reply_com.strip() != '[deleted]' and replies_toxicity_dict.get(reply.get('no'), {}).get('content_hash') != get_content_hash(reply_com):
+            pending_texts.append(reply_com)
+    toxicities = analyzer.analyze_many(pending_texts)
+
+    # Analyzing the original post
     if original_com.strip() and original_com.strip() != '[deleted]':
         original_hash = get_content_hash(original_com)
         original_toxicity = thread.get('original_post_toxicity', {})
 
         if original_toxicity.get('content_hash') != original_hash:
-            toxicity = analyzer.analyze_text(original_com)
+            toxicity = dict(toxicities[original_com])
             toxicity['content_hash'] = original_hash
             toxicity['com'] = original_com
 
@@ -169,8 +157,6 @@ def process_thread(thread):
             logger.info(f"Original post in thread {board}/{thread_number} has not changed, skipping toxicity analysis")
 
     # Analyzing the replies
-    existing_replies_toxicity = thread.get('replies_toxicity', [])
-    replies_toxicity_dict = {item['reply_no']: item for item in existing_replies_toxicity}
 
     updated_replies_toxicity = []
     for reply in replies:
@@ -183,7 +169,7 @@ def process_thread(thread):
             existing_toxicity = replies_toxicity_dict.get(reply_no, {})
 
             if existing_toxicity.get('content_hash') != reply_hash:
-                toxicity = analyzer.analyze_text(reply_com)
+                toxicity = dict(toxicities[reply_com])
                 toxicity['content_hash'] = reply_hash
                 toxicity['reply_no'] = reply_no
                 toxicity['com'] = reply_com
@@ -202,7 +188,8 @@ def process_thread(thread):
 def process_threads():
     while True:
         try:
-            threads = g_tv_moderate_threads_collection.find({})
+            # Threads stored in the split post layout get their replies filled back in, deleted ones included.
+            threads = with_replies(g_tv_moderate_threads_collection.find({}), g_tv_moderate_posts_collection)
             for thread in threads:
                 process_thread(thread)
             logger.info("Completed processing all threads. Sleeping for a while...")
@@ -0,0 +1,84 @@
+import logging
+import os
+import importlib
+import multiprocessing
+import chan_crawler
+from chan_client import ChanClient
+from chan_validator_store import MongoValidatorStore
+from chan_job_leases import JobLeases
+from chan_fetch_pipeline import FetchPipeline, SWEEP_MODE
+from worker_supervisor import WorkerSupervisor
+
+# Single fetch, many sinks: every catalog and thread of a board is downloaded and decoded once, then handed to each
+# sink. The default sinks are the two crawlers' thread stores, chan_crawler (positional diff into g_tv_threads) and
+# chan_moderate_crawler (reply-number diff into g_tv_moderate_threads), so running this instead of both crawlers
+# halves the API traffic and decoding work. A sink module exposes thread_store, a chan_thread_store.ThreadStore with
+# the boards it stores (chan_moderate_crawler's come from BOARDS_MODERATE). Each board is swept once and handed only
+# to the sinks that store it.
+SINK_MODULES = os.getenv("CHAN_PIPELINE_SINKS", "chan_crawler,chan_moderate_crawler").split(',')
+SINKS = [importlib.import_module(sink_module).thread_store for sink_module in SINK_MODULES]
+
+# Logging to help with debugging
+logger = logging.getLogger("ChanPipeline")
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# FileHandler to log everything to a file
+log_file_path = "chan_pipeline.log"  # Define the log file path
+fh = logging.FileHandler(log_file_path, delay=True)
+fh.setFormatter(formatter)
+logger.addHandler(fh)
+
+# The pipeline keeps its own fetch state next to the shared rate governor: validators, fingerprints and job leases
+# describe what the pipeline fetched, which every sink has seen.
+pipeline_db = chan_crawler.client['4chan_shared']
+validator_store = MongoValidatorStore(pipeline_db['pipeline_http_validators'])
+rate_governor = chan_crawler.rate_governor
+catalog_state_collection = pipeline_db['pipeline_catalog_state']
+job_leases = JobLeases(pipeline_db['pipeline_job_leases'])
+
+FAKTORY_SERVER_URL = chan_crawler.FAKTORY_SERVER_URL
+SWEEP_INTERVAL_MINUTES = chan_crawler.SWEEP_INTERVAL_MINUTES
+WORKER_CONCURRENCY = chan_crawler.WORKER_CONCURRENCY
+
+fetch_pipeline = FetchPipeline(SINKS, ChanClient, validator_store, rate_governor, catalog_state_collection, job_leases,
+                               "pipeline-crawl-board", "pipeline-crawl-thread", "pipeline-crawl-thread-batch", FAKTORY_SERVER_URL, logger=logger)
+# Every board some sink stores, each scheduled once.
+BOARDS = fetch_pipeline.boards
+
+# Fetches and decodes threads of a board once and hands the changed ones to every sink of the board.
+def crawl_threads(board, thread_numbers):
+    return fetch_pipeline.crawl_threads(board, thread_numbers)
+
+def crawl_thread(board, thread_number):
+    return fetch_pipeline.crawl_thread(board, thread_number)
+
+# Sweeps a board once for all sinks: one listing, one archive.json, each sink reconciles the threads that left,
+# then new, changed and final threads are queued once.
+def crawl_board(board, sweep_mode=SWEEP_MODE):
+    return fetch_pipeline.crawl_board(board, sweep_mode)
+
+def start_worker(concurrency=WORKER_CONCURRENCY):
+    fetch_pipeline.start_worker(concurrency, crawl_board, crawl_thread, crawl_threads)
+
+# Jobs waiting in the worker queues, the supervisor sizes the worker pool from it.
+def queue_depth():
+    return fetch_pipeline.queue_depth()
+
+# Runs instead of chan_crawler and chan_moderate_crawler, not next to them.
+if __name__ == "__main__":
+    supervisor = WorkerSupervisor(start_worker, queue_depth, initial_concurrency=WORKER_CONCURRENCY)
+    worker_process = multiprocessing.Process(target=supervisor.run)
+    worker_process.start()
+    fetch_pipeline.schedule_crawl_jobs_continuously(interval_minutes=SWEEP_INTERVAL_MINUTES)
+
+    try:
+        worker_process.join()
+    except KeyboardInterrupt:
+        logger.info("Stopping processes...")
+        worker_process.terminate()
+        worker_process.join()
+        logger.info("Processes stopped.")
@@ -0,0 +1,194 @@
+import logging
+import pymongo
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan post store")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Split storage layout for chan threads:
+#   - the thread collection keeps a slim header (board, thread_number, original_post, counts, ...), the reply-count history is in chan_thread_history,
+#     marked with "post_store": "split" and without the replies array.
+#   - the posts collection keeps one document per reply, keyed by (board, no), with its thread_number.
+# New replies become inserts and edits/deletions become single-post updates, so a thread document
+# never grows with its replies and nothing is rewritten wholesale.
+
+SPLIT_LAYOUT = "split"
+EMBEDDED_LAYOUT = "embedded"
+
+# Duplicate key error code, an insert of a reply we already hold is harmless.
+DUPLICATE_KEY_ERROR = 11000
+
+POST_BULK_WRITE_BATCH_SIZE = 1000
+
+# Fields the posts collection adds to a reply, stripped again when replies are read back.
+POST_KEY_FIELDS = ("_id", "board", "thread_number")
+
+def ensure_post_indexes(posts_collection):
+    posts_collection.create_index([("board", pymongo.ASCENDING), ("no", pymongo.ASCENDING)], unique=True)
+    posts_collection.create_index([("board", pymongo.ASCENDING), ("thread_number", pymongo.ASCENDING), ("no", pymongo.ASCENDING)])
+
+def post_to_reply(post):
+    return {key: value for key, value in post.items() if key not in POST_KEY_FIELDS}
+
+# Reads the replies of one thread back in the same shape as the embedded replies array.
+def load_replies(posts_collection, board, thread_number):
+    cursor = posts_collection.find({"board": board, "thread_number": thread_number}).sort("no", pymongo.ASCENDING)
+    return [post_to_reply(post) for post in cursor]
+
+# Reads the replies of many threads of a board with one query. Returns {thread_number: replies}.
+def load_replies_for_threads(posts_collection, board, thread_numbers):
+    replies_by_thread = {thread_number: [] for thread_number in thread_numbers}
+    cursor = posts_collection.find({"board": board, "thread_number": {"$in": list(thread_numbers)}}).sort("no", pymongo.ASCENDING)
+    for post in cursor:
+        replies_by_thread.setdefault(post["thread_number"], []).append(post_to_reply(post))
+    return replies_by_thread
+
+# Diffs the stored replies of a thread against a fresh crawl and returns the per-post writes.
+#   compare_fields: None compares whole replies, otherwise only the listed fields (e.g. ("com",)).
+#   on_missing: "delete" drops replies that disappeared, "mark" keeps them with com set to "[deleted]".
+def build_reply_writes(board, thread_number, existing_replies, new_replies, compare_fields=None, on_missing="delete"):
+    def comparable(reply):
+        if compare_fields is None:
+            return reply
+        return {field: reply.get(field) for field in compare_fields}
+
+    existing_by_no = {reply.get("no"): reply for reply in existing_replies}
+    new_reply_nos = set()
+    writes = []
+
+    for reply in new_replies:
+        reply_no = reply.get("no")
+        new_reply_nos.add(reply_no)
+        existing_reply = existing_by_no.get(reply_no)
+        if existing_reply is None:
+            writes.append(InsertOne({"board": board, "thread_number": thread_number, **reply}))
+        elif comparable(existing_reply) != comparable(reply):
+            writes.append(UpdateOne({"board": board, "no": reply_no}, {"$set": reply}))
+
+    for reply_no, existing_reply in existing_by_no.items():
+        if reply_no in new_reply_nos:
+            continue
+        if on_missing == "mark":
+            if existing_reply.get("com") != "[deleted]":
+                writes.append(UpdateOne({"board": board, "no": reply_no}, {"$set": {"com": "[deleted]"}}))
+        else:
+            writes.append(DeleteOne({"board": board, "no": reply_no}))
+
+    return writes
+
+# Sends post writes in unordered bulk batches. Duplicate inserts (a reply we already hold) are ignored.
+# Returns False if any other write failed.
+def flush_post_writes(posts_collection, writes):
+    success = True
+    for start in range(0, len(writes), POST_BULK_WRITE_BATCH_SIZE):
+        batch = writes[start:start + POST_BULK_WRITE_BATCH_SIZE]
+        try:
+            posts_collection.bulk_write(batch, ordered=False)
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY_ERROR]
+            if errors:
+                logger.error(f"Bulk write of {len(batch)} posts had errors: {errors}")
+                success = False
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error writing {len(batch)} posts to MongoDB: {e}")
+            success = False
+    return success
+
+# Marks every post of the given threads as deleted, keeping the previous text in com_before_deletion.
+def mark_thread_posts_as_deleted(posts_collection, board, thread_numbers):
+    try:
+        posts_collection.update_many(
+            {"board": board, "thread_number": {"$in": list(thread_numbers)}, "com": {"$ne": "[deleted]"}},
+            [{"$set": {"com_before_deletion": "$com", "com": "[deleted]"}}]
+        )
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error marking posts of {len(thread_numbers)} threads on /{board}/ as deleted: {e}")
+
+# Read helper for analysis code: yields thread documents with the replies array filled back in,
+# so code written against the embedded layout keeps working on split threads.
+# Embedded threads are passed through untouched. Replies are loaded per batch of threads.
+def with_replies(thread_cursor, posts_collection, batch_size=200):
+    batch = []
+    for thread in thread_cursor:
+        batch.append(thread)
+        if len(batch) >= batch_size:
+            yield from hydrate_replies(batch, posts_collection)
+            batch = []
+    if batch:
+        yield from hydrate_replies(batch, posts_collection)
+
+def hydrate_replies(threads, posts_collection):
+    split_threads = {}
+    for thread in threads:
+        if thread.get("post_store") == SPLIT_LAYOUT:
+            split_threads.setdefault(thread["board"], []).append(thread["thread_number"])
+
+    replies = {}
+    for board, thread_numbers in split_threads.items():
+        for thread_number, thread_replies in load_replies_for_threads(posts_collection, board, thread_numbers).items():
+            replies[(board, thread_number)] = thread_replies
+
+    for thread in threads:
+        if thread.get("post_store") == SPLIT_LAYOUT:
+            thread["replies"] = replies.get((thread["board"], thread["thread_number"]), [])
+        yield thread
+
+# Replies of a deleted thread as they were before the deletion. Embedded threads keep them in the deletion snapshot
+# (see chan_board_state.deleted_thread_pipeline), split threads have none there: their posts, hydrated by with_replies,
+# are used instead with the text mark_thread_posts_as_deleted moved to com_before_deletion.
+def replies_before_deletion(thread, snapshot):
+    if thread.get("post_store") != SPLIT_LAYOUT:
+        return snapshot.get("replies", [])
+    replies = []
+    for reply in thread.get("replies", []):
+        reply = dict(reply)
+        if "com_before_deletion" in reply:
+            reply["com"] = reply.pop("com_before_deletion")
+        replies.append(reply)
+    return replies
+
+# One-off migration of embedded threads to the split layout. Safe to re-run: replies are inserted
+# idempotently and a thread header is only slimmed after its replies were written.
+def migrate_to_split_layout(threads_collection, posts_collection, board=None):
+    ensure_post_indexes(posts_collection)
+    query = {"post_store": {"$ne": SPLIT_LAYOUT}}
+    if board:
+        query["board"] = board
+
+    migrated = 0
+    for thread in threads_collection.find(query, {"board": 1, "thread_number": 1, "replies": 1}):
+        writes = [
+            InsertOne({"board": thread["board"], "thread_number": thread["thread_number"], **reply})
+            for reply in thread.get("replies", [])
+        ]
+        if not flush_post_writes(posts_collection, writes):
+            logger.error(f"Failed to copy replies of thread {thread['thread_number']} on /{thread['board']}/, leaving it embedded.")
+            continue
+        threads_collection.update_one(
+            {"_id": thread["_id"]},
+            {"$set": {"post_store": SPLIT_LAYOUT}, "$unset": {"replies": ""}}
+        )
+        migrated += 1
+    logger.info(f"Migrated {migrated} threads to the split post layout.")
+    return migrated
+
+# Usage: python chan_post_store.py <database> <threads collection> <posts collection> [board]
+# e.g.   python chan_post_store.py 4chan_data g_tv_threads g_tv_posts
+if __name__ == "__main__":
+    import os
+    import sys
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    if len(sys.argv) < 4:
+        print("Usage: python chan_post_store.py <database> <threads collection> <posts collection> [board]")
+        sys.exit(1)
+    database = pymongo.MongoClient(os.getenv("MONGO_DB_URL"))[sys.argv[1]]
+    migrate_to_split_layout(database[sys.argv[2]], database[sys.argv[3]], sys.argv[4] if len(sys.argv) > 4 else None)
@@ -0,0 +1,88 @@
+import logging
+import os
+import threading
+import time
+import pymongo
+from pymongo import ReturnDocument
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan rate governor")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# The 4chan API asks for no more than one request per second across all of our clients.
+REQUESTS_PER_SECOND = float(os.getenv("CHAN_REQUESTS_PER_SECOND", 1.0))
+# How many requests may go out back to back after an idle period.
+REQUEST_BURST = int(os.getenv("CHAN_REQUEST_BURST", 1))
+
+class RateGovernor:
+    """
+    Hands out request slots at a fixed rate (a token bucket kept as the time of the next free slot).
+    reserve() books the next slot and returns how many seconds to wait for it, acquire() also waits.
+    This base class only coordinates threads of one process, MongoRateGovernor coordinates processes.
+    """
+
+    def __init__(self, requests_per_second=REQUESTS_PER_SECOND, burst=REQUEST_BURST):
+        self.interval = 1.0 / requests_per_second
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def reserve(self):
+        with self.lock:
+            now = time.time()
+            slot = max(self.next_slot, now - (self.burst - 1) * self.interval)
+            self.next_slot = slot + self.interval
+        return max(0.0, slot - now)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    # Pushes every following slot back, used when the server answered 429 with a Retry-After.
+    def penalize(self, seconds):
+        with self.lock:
+            self.next_slot = max(self.next_slot, time.time() + seconds)
+
+class MongoRateGovernor(RateGovernor):
+    """
+    Rate governor shared by every process through one MongoDB document per key.
+    Each reservation is a single atomic find_one_and_update, so consumer threads, worker processes
+    and both chan crawlers draw from the same budget. Falls back to the in-process bucket if Mongo fails.
+    """
+
+    def __init__(self, collection, key="4chan-api", requests_per_second=REQUESTS_PER_SECOND, burst=REQUEST_BURST):
+        super().__init__(requests_per_second, burst)
+        self.collection = collection
+        self.key = key
+
+    def reserve(self):
+        now = time.time()
+        earliest = now - (self.burst - 1) * self.interval
+        try:
+            document = self.collection.find_one_and_update(
+                {"_id": self.key},
+                [{"$set": {"next_slot": {"$add": [{"$max": [{"$ifNull": ["$next_slot", earliest]}, earliest]}, self.interval]}}}],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error reserving a shared request slot, using the local one: {e}")
+            return super().reserve()
+        slot = document["next_slot"] - self.interval
+        return max(0.0, slot - now)
+
+    def penalize(self, seconds):
+        super().penalize(seconds)
+        try:
+            self.collection.update_one({"_id": self.key}, {"$max": {"next_slot": time.time() + seconds}}, upsert=True)
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error pushing back the shared request slot: {e}")
+
+# Used by the 4chan clients when no governor is passed in, so all clients of a process share one budget.
+local_rate_governor = RateGovernor()
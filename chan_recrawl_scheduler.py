@@ -0,0 +1,174 @@
+import logging
+import os
+import time
+import heapq
+import datetime
+import pymongo
+from chan_board_state import thread_positions_from_catalog
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan recrawl scheduler")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Bounds on how often a single thread is refetched, in minutes.
+MIN_RECRAWL_MINUTES = float(os.getenv("CHAN_RECRAWL_MIN_MINUTES", 1))
+MAX_RECRAWL_MINUTES = float(os.getenv("CHAN_RECRAWL_MAX_MINUTES", 60))
+# A thread is refetched about every time this many new replies are expected, based on its reply velocity.
+TARGET_NEW_REPLIES = float(os.getenv("CHAN_RECRAWL_TARGET_REPLIES", 5))
+# How many of the latest history entries (one per crawl) the reply velocity is measured over.
+HISTORY_WINDOW = int(os.getenv("CHAN_RECRAWL_HISTORY_WINDOW", 6))
+
+# Parses the "crawled_at" of a history entry into a unix timestamp, None if it is missing or malformed.
+def history_timestamp(entry):
+    try:
+        return datetime.datetime.strptime(entry["crawled_at"], '%Y-%m-%d %H:%M:%S').timestamp()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+# Replies per minute of a thread over its latest history entries, measured up to now so a thread that went
+# quiet (304s add no history) slows down on its own. current_replies is the count from the latest listing, if known.
+# Returns None when there is no usable history yet.
+def reply_velocity(history, now, current_replies=None):
+    entries = [(history_timestamp(entry), entry.get("number_of_replies", 0)) for entry in history[-HISTORY_WINDOW:]]
+    entries = [(timestamp, replies) for timestamp, replies in entries if timestamp is not None]
+    if not entries:
+        return None
+    first_timestamp, first_replies = entries[0]
+    last_replies = entries[-1][1] if current_replies is None else max(current_replies, entries[-1][1])
+    elapsed_minutes = (now - first_timestamp) / 60
+    if elapsed_minutes <= 0:
+        return None
+    return max(0, last_replies - first_replies) / elapsed_minutes
+
+# Reads the latest history entries of many threads of a board with one query. Returns {thread_number: history}.
+def load_thread_histories(threads_collection, board, thread_numbers, window=HISTORY_WINDOW):
+    try:
+        cursor = threads_collection.find(
+            {"board": board, "thread_number": {"$in": list(thread_numbers)}},
+            {"thread_number": 1, "history": {"$slice": -window}}
+        )
+        return {thread["thread_number"]: thread.get("history", []) for thread in cursor}
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error loading thread histories for /{board}/: {e}")
+        return {}
+
+class RecrawlScheduler:
+    """
+    Priority queue of live threads keyed by the time they are next due for a crawl.
+    Threads are first due as soon as they show up in a listing. After each crawl a thread is rescheduled from
+    its reply velocity (history number_of_replies over time): hot threads come back every minute or two,
+    quiet ones up to once an hour. Catalog page position caps the interval, threads near the front of a board
+    were bumped recently and are never left as long as the ones sinking to the last pages.
+    A thread that reaches the last final_pages pages is made due once more right away, so its final state is
+    captured before 4chan prunes it.
+    Superseded heap entries are skipped lazily when popped.
+    """
+
+    def __init__(self, min_minutes=MIN_RECRAWL_MINUTES, max_minutes=MAX_RECRAWL_MINUTES, target_new_replies=TARGET_NEW_REPLIES, final_pages=0):
+        self.min_seconds = min_minutes * 60
+        self.max_seconds = max_minutes * 60
+        self.target_new_replies = target_new_replies
+        self.final_pages = final_pages
+        self.heap = []
+        # (board, thread_number) -> due time of its live heap entry
+        self.due_at = {}
+        # (board, thread_number) -> (page, replies) from the latest listing
+        self.listed = {}
+        # board -> number of pages in the latest listing
+        self.page_counts = {}
+        # (board, thread_number) of threads on the final pages that already got their final crawl
+        self.final_captures = set()
+
+    def __len__(self):
+        return len(self.due_at)
+
+    def schedule(self, board, thread_number, due_at):
+        self.due_at[(board, thread_number)] = due_at
+        heapq.heappush(self.heap, (due_at, board, thread_number))
+
+    # Records the page and reply count of every live thread of a board, queues new threads right away
+    # and forgets threads that left the board.
+    def observe_listing(self, board, catalog, now=None):
+        now = time.time() if now is None else now
+        positions = thread_positions_from_catalog(catalog)
+        self.page_counts[board] = len(catalog)
+
+        for key in [key for key in self.listed if key[0] == board and key[1] not in positions]:
+            del self.listed[key]
+            self.due_at.pop(key, None)
+            self.final_captures.discard(key)
+
+        first_final_page = len(catalog) - self.final_pages + 1 if self.final_pages else None
+        new_threads = 0
+        final_threads = 0
+        for page in catalog:
+            for thread in page["threads"]:
+                key = (board, thread["no"])
+                self.listed[key] = (page["page"], thread.get("replies", 0))
+                if key not in self.due_at:
+                    self.schedule(board, thread["no"], now)
+                    new_threads += 1
+                if first_final_page is None or page["page"] < first_final_page:
+                    # Bumped back up, it gets another final crawl if it sinks again.
+                    self.final_captures.discard(key)
+                elif key not in self.final_captures:
+                    self.final_captures.add(key)
+                    if self.due_at.get(key, now) > now:
+                        self.schedule(board, thread["no"], now)
+                        final_threads += 1
+        if new_threads:
+            logger.info(f"{new_threads} new threads on /{board}/ queued for an immediate crawl.")
+        if final_threads:
+            logger.info(f"{final_threads} threads on the final pages of /{board}/ queued for a last crawl before pruning.")
+
+    # Threads of a board on the final pages of the previous listing (at least the last page).
+    # Call before observe_listing, threads vanishing from there were pruned rather than deleted.
+    def final_page_threads(self, board):
+        first_final_page = self.page_counts.get(board, 0) - max(self.final_pages, 1) + 1
+        return {thread_number for (thread_board, thread_number), (page, _) in self.listed.items() if thread_board == board and page >= first_final_page}
+
+    # Pops every thread whose due time has passed, as (board, thread_number) pairs.
+    # Popped threads stay out of the queue until they are rescheduled.
+    def pop_due(self, now=None):
+        now = time.time() if now is None else now
+        due_threads = []
+        while self.heap and self.heap[0][0] <= now:
+            due_at, board, thread_number = heapq.heappop(self.heap)
+            if self.due_at.get((board, thread_number)) != due_at:
+                continue
+            del self.due_at[(board, thread_number)]
+            due_threads.append((board, thread_number))
+        return due_threads
+
+    # Due time of the next thread, None when nothing is queued.
+    def next_due_at(self):
+        while self.heap and self.due_at.get((self.heap[0][1], self.heap[0][2])) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    # Seconds until a thread should be crawled again.
+    def recrawl_interval(self, board, thread_number, history, now):
+        page, listed_replies = self.listed.get((board, thread_number), (None, None))
+
+        interval = self.max_seconds
+        velocity = reply_velocity(history, now, listed_replies)
+        if velocity:
+            interval = self.target_new_replies / velocity * 60
+
+        if page is not None:
+            last_page = self.page_counts.get(board, 1)
+            interval = min(interval, self.max_seconds * page / last_page)
+
+        return min(max(interval, self.min_seconds), self.max_seconds)
+
+    # Puts a crawled thread back in the queue. Threads no longer listed are dropped.
+    def reschedule(self, board, thread_number, history, now=None):
+        now = time.time() if now is None else now
+        if (board, thread_number) not in self.listed:
+            return
+        self.schedule(board, thread_number, now + self.recrawl_interval(board, thread_number, history, now))
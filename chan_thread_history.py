@@ -0,0 +1,182 @@
+import logging
+import os
+import time
+import datetime
+import pymongo
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from chan_recrawl_scheduler import HISTORY_WINDOW, load_thread_histories as load_embedded_histories
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan thread history")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Reply-count history of chan threads, kept out of the thread documents in hourly buckets:
+#   - one document per (board, thread_number, hour), _id "<board>:<thread_number>:<hour>Z", with the samples
+#     of that hour in crawl order. hour is the UTC start of the hour, so the retention TTL counts from the real time. Reply growth of a thread (or a board) over a time range is an index range scan.
+#   - samples are run-length compressed: a crawl that sees the same number_of_replies as the previous sample
+#     only moves that sample's "until" and bumps its "crawls", so a quiet thread costs one sample per hour.
+#   - buckets older than CHAN_HISTORY_DOWNSAMPLE_DAYS are downsampled to a single sample (first and last count
+#     of the hour), and dropped after CHAN_HISTORY_RETENTION_DAYS if that is set.
+# Sample: {"crawled_at", "until", "number_of_replies", "crawls"}, times in the crawlers' '%Y-%m-%d %H:%M:%S' format.
+# The snapshot a deletion keeps on the thread document itself is untouched, see chan_board_state.deleted_thread_pipeline.
+
+HISTORY_DOWNSAMPLE_DAYS = int(os.getenv("CHAN_HISTORY_DOWNSAMPLE_DAYS", 7))
+# 0 keeps buckets forever.
+HISTORY_RETENTION_DAYS = int(os.getenv("CHAN_HISTORY_RETENTION_DAYS", 0))
+# Hours of buckets read back when rescheduling a thread, older samples do not describe its current pace.
+HISTORY_LOOKBACK_HOURS = int(os.getenv("CHAN_HISTORY_LOOKBACK_HOURS", 24))
+# Downsampling runs at most this often per process.
+HISTORY_MAINTENANCE_SECONDS = int(os.getenv("CHAN_HISTORY_MAINTENANCE_SECONDS", 3600))
+
+HISTORY_BULK_WRITE_BATCH_SIZE = 1000
+
+CRAWLED_AT_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def ensure_history_indexes(history_collection):
+    history_collection.create_index([("board", pymongo.ASCENDING), ("thread_number", pymongo.ASCENDING), ("hour", pymongo.ASCENDING)])
+    history_collection.create_index([("board", pymongo.ASCENDING), ("hour", pymongo.ASCENDING)])
+    if HISTORY_RETENTION_DAYS:
+        history_collection.create_index("hour", expireAfterSeconds=HISTORY_RETENTION_DAYS * 86400)
+
+# The UTC hour of a crawl, crawled_at being the crawlers' local time. Mongo reads naive datetimes as UTC,
+# so a local hour would make the TTL expire buckets early or late by the UTC offset.
+def bucket_hour(crawled_at):
+    crawled_at = datetime.datetime.strptime(crawled_at, CRAWLED_AT_FORMAT).astimezone(datetime.timezone.utc)
+    return crawled_at.replace(minute=0, second=0)
+
+# Builds the write recording one crawl of a thread in its hourly bucket. It is an aggregation pipeline upsert,
+# so MongoDB decides from the bucket itself whether the sample extends the previous one or starts a new one.
+def history_sample_write(board, thread_number, number_of_replies, crawled_at):
+    hour = bucket_hour(crawled_at)
+    samples = {"$ifNull": ["$samples", []]}
+    return UpdateOne(
+        {"_id": f"{board}:{thread_number}:{hour.strftime('%Y%m%d%H')}Z"},
+        [{"$set": {
+            "board": board,
+            "thread_number": thread_number,
+            "hour": hour,
+            "samples": {"$let": {
+                "vars": {"last": {"$arrayElemAt": [samples, -1]}},
+                "in": {"$cond": [
+                    {"$eq": ["$$last.number_of_replies", number_of_replies]},
+                    {"$concatArrays": [
+                        {"$slice": [samples, {"$subtract": [{"$size": samples}, 1]}]},
+                        [{"$mergeObjects": ["$$last", {"until": {"$literal": crawled_at}, "crawls": {"$add": [{"$ifNull": ["$$last.crawls", 1]}, 1]}}]}]
+                    ]},
+                    {"$concatArrays": [samples, [{
+                        "crawled_at": {"$literal": crawled_at},
+                        "until": {"$literal": crawled_at},
+                        "number_of_replies": number_of_replies,
+                        "crawls": 1
+                    }]]}
+                ]}
+            }}
+        }}],
+        upsert=True
+    )
+
+# Sends history writes in unordered bulk batches. Returns False if any batch failed.
+def flush_history_writes(history_collection, writes):
+    success = True
+    for start in range(0, len(writes), HISTORY_BULK_WRITE_BATCH_SIZE):
+        batch = writes[start:start + HISTORY_BULK_WRITE_BATCH_SIZE]
+        try:
+            history_collection.bulk_write(batch, ordered=False)
+        except BulkWriteError as e:
+            logger.error(f"Bulk write of {len(batch)} history samples had errors: {e.details.get('writeErrors')}")
+            success = False
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error writing {len(batch)} history samples to MongoDB: {e}")
+            success = False
+    return success
+
+# Turns samples back into history entries ({"crawled_at", "number_of_replies"}, one per distinct time),
+# the shape chan_recrawl_scheduler.reply_velocity reads.
+def expand_samples(samples):
+    entries = []
+    for sample in samples:
+        entries.append({"crawled_at": sample["crawled_at"], "number_of_replies": sample["number_of_replies"]})
+        if sample.get("until", sample["crawled_at"]) != sample["crawled_at"]:
+            entries.append({"crawled_at": sample["until"], "number_of_replies": sample["number_of_replies"]})
+    return entries
+
+# Reads the latest history entries of many threads of a board with one range scan over the recent buckets.
+# Threads crawled before the buckets existed fall back to the history embedded in threads_collection, if given.
+# Returns {thread_number: history}, threads without any history are left out.
+def load_thread_histories(history_collection, board, thread_numbers, window=HISTORY_WINDOW, lookback_hours=HISTORY_LOOKBACK_HOURS, threads_collection=None):
+    thread_numbers = list(thread_numbers)
+    since = datetime.datetime.now(datetime.timezone.utc).replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=lookback_hours)
+    histories = {}
+    try:
+        cursor = history_collection.find(
+            {"board": board, "thread_number": {"$in": thread_numbers}, "hour": {"$gte": since}},
+            {"thread_number": 1, "samples": 1}
+        ).sort([("thread_number", pymongo.ASCENDING), ("hour", pymongo.ASCENDING)])
+        for bucket in cursor:
+            histories.setdefault(bucket["thread_number"], []).extend(expand_samples(bucket.get("samples", [])))
+    except pymongo.errors.PyMongoError as e:
+        logger.error(f"Error loading thread histories for /{board}/: {e}")
+    histories = {thread_number: history[-window:] for thread_number, history in histories.items()}
+    legacy_thread_numbers = [thread_number for thread_number in thread_numbers if thread_number not in histories]
+    if threads_collection is not None and legacy_thread_numbers:
+        for thread_number, history in load_embedded_histories(threads_collection, board, legacy_thread_numbers, window).items():
+            if history:
+                histories[thread_number] = history
+    return histories
+
+# Reply counts of one thread between two times, oldest first, as history entries. Naive times are read as local time.
+def thread_history(history_collection, board, thread_number, start, end):
+    start = start.astimezone(datetime.timezone.utc)
+    cursor = history_collection.find(
+        {"board": board, "thread_number": thread_number, "hour": {"$gte": start.replace(minute=0, second=0, microsecond=0), "$lt": end.astimezone(datetime.timezone.utc)}},
+        {"samples": 1}
+    ).sort("hour", pymongo.ASCENDING)
+    return [entry for bucket in cursor for entry in expand_samples(bucket.get("samples", []))]
+
+# Collapses every bucket older than older_than_days into one sample spanning the hour: first crawl, last crawl,
+# last number_of_replies (first_replies keeps where the hour started) and the total number of crawls.
+def downsample_history(history_collection, older_than_days=HISTORY_DOWNSAMPLE_DAYS):
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=older_than_days)
+    result = history_collection.update_many(
+        {"hour": {"$lt": cutoff}, "downsampled": {"$ne": True}, "samples.0": {"$exists": True}},
+        [{"$set": {
+            "samples": {"$let": {
+                "vars": {"first": {"$arrayElemAt": ["$samples", 0]}, "last": {"$arrayElemAt": ["$samples", -1]}},
+                "in": [{
+                    "crawled_at": "$$first.crawled_at",
+                    "until": "$$last.until",
+                    "first_replies": "$$first.number_of_replies",
+                    "number_of_replies": "$$last.number_of_replies",
+                    "crawls": {"$sum": "$samples.crawls"}
+                }]
+            }},
+            "downsampled": True
+        }}]
+    )
+    return result.modified_count
+
+class HistoryMaintenance:
+    """Runs downsample_history on a collection at most every interval_seconds, cheap to call on every sweep."""
+
+    def __init__(self, history_collection, interval_seconds=HISTORY_MAINTENANCE_SECONDS):
+        self.history_collection = history_collection
+        self.interval_seconds = interval_seconds
+        # None until the first run, time.monotonic() starts at an arbitrary point and may be below the interval.
+        self.last_run = None
+
+    def run(self):
+        if self.last_run is not None and time.monotonic() - self.last_run < self.interval_seconds:
+            return
+        self.last_run = time.monotonic()
+        try:
+            downsampled = downsample_history(self.history_collection)
+            if downsampled:
+                logger.info(f"Downsampled {downsampled} history buckets older than {HISTORY_DOWNSAMPLE_DAYS} days.")
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error downsampling thread history: {e}")
@@ -0,0 +1,184 @@
+import logging
+import os
+import pymongo
+from pymongo.errors import BulkWriteError
+from chan_board_state import load_active_threads, load_stored_threads, add_active_threads, remove_active_threads, classify_missing_threads, resolve_missing_threads
+from chan_thread_history import ensure_history_indexes, history_sample_write, flush_history_writes, load_thread_histories, HistoryMaintenance
+from chan_post_store import SPLIT_LAYOUT, EMBEDDED_LAYOUT, ensure_post_indexes, load_replies, build_reply_writes, flush_post_writes, mark_thread_posts_as_deleted, with_replies
+from crawler_metrics import MONGO_OPERATION_SECONDS
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan thread store")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Mongo accepts up to 100k ops per bulk_write, smaller batches keep memory and error reports manageable.
+BULK_WRITE_BATCH_SIZE = 500
+
+# Storage layout for newly inserted threads: "embedded" keeps replies inside the thread document,
+# "split" keeps a slim thread header and one document per reply. Existing threads keep their layout until migrated.
+POST_STORE = os.getenv("CHAN_POST_STORE", EMBEDDED_LAYOUT)
+
+class ThreadStore:
+    """
+    The write side of a chan crawler, one per thread collection. It diffs crawled threads against the stored ones and
+    writes the changes in bulk, keeps the board's active thread index, the reply-count history and the split post
+    layout, and resolves the threads that left a board. chan_crawler and chan_moderate_crawler are one ThreadStore
+    each, they differ only in their collections and their diff strategy:
+      - build_thread_write(board, thread_number, existing_thread, original_post, replies, crawled_at, embed_replies, tail_size)
+        returns the one write bringing a thread up to date, or None.
+      - reply_diff, the build_reply_writes options of the split layout ({} for the positional diff).
+      - count_replies(replies), the number of replies recorded in the history.
+    The fetch side (see chan_fetch_pipeline) hands the same decoded threads to every store, which never modifies them.
+    """
+
+    def __init__(self, boards, threads_collection, posts_collection, active_threads_collection, history_collection,
+                 build_thread_write, reply_diff=None, count_replies=len, post_store=POST_STORE, logger=logger):
+        self.boards = boards
+        self.threads_collection = threads_collection
+        self.posts_collection = posts_collection
+        self.active_threads_collection = active_threads_collection
+        self.history_collection = history_collection
+        self.history_maintenance = HistoryMaintenance(history_collection)
+        self.build_thread_write = build_thread_write
+        self.reply_diff = reply_diff or {}
+        self.count_replies = count_replies
+        self.post_store = post_store
+        self.logger = logger
+
+    # Indexes the writes rely on, created once per worker start.
+    def prepare_storage(self):
+        ensure_history_indexes(self.history_collection)
+        if self.post_store == SPLIT_LAYOUT:
+            ensure_post_indexes(self.posts_collection)
+
+    # Buckets older than a week are collapsed to one sample per hour, at most once an hour per worker.
+    def run_maintenance(self):
+        self.history_maintenance.run()
+
+    # Layout of a thread: stored threads keep theirs, new threads get post_store.
+    def thread_layout(self, existing_thread):
+        if existing_thread is None:
+            return self.post_store
+        return existing_thread.get("post_store", EMBEDDED_LAYOUT)
+
+    # Loads stored threads of a board, split threads get their replies filled back in so they can be diffed like
+    # embedded ones. Returns {thread_number: thread}, None if MongoDB failed.
+    def load_threads(self, board, thread_numbers):
+        thread_numbers = list(thread_numbers)
+        try:
+            if len(thread_numbers) == 1:
+                thread = self.threads_collection.find_one({"board": board, "thread_number": thread_numbers[0]})
+                if thread and self.thread_layout(thread) == SPLIT_LAYOUT:
+                    thread["replies"] = load_replies(self.posts_collection, board, thread_numbers[0])
+                return {thread_numbers[0]: thread} if thread else {}
+            return {
+                thread["thread_number"]: thread
+                for thread in with_replies(self.threads_collection.find({"board": board, "thread_number": {"$in": thread_numbers}}), self.posts_collection)
+            }
+        except pymongo.errors.PyMongoError as e:
+            self.logger.error(f"Error fetching threads from MongoDB: {e}")
+            return None
+
+    # The history sample of this crawl, recorded for new and live threads only,
+    # a deleted thread keeps the snapshot it got when it was marked. Returns None for deleted threads.
+    def build_history_write(self, board, thread_number, existing_thread, filtered_replies, crawled_at):
+        if existing_thread and existing_thread.get("is_deleted", False):
+            return None
+        return history_sample_write(board, thread_number, self.count_replies(filtered_replies), crawled_at)
+
+    # Per-post writes for a thread in the split layout, diffed with the store's reply_diff.
+    def build_thread_post_writes(self, board, thread_number, existing_thread, filtered_replies):
+        existing_replies = existing_thread.get("replies", []) if existing_thread else []
+        return build_reply_writes(board, thread_number, existing_replies, filtered_replies, **self.reply_diff)
+
+    # Sends thread writes to MongoDB in unordered bulk batches, one round trip per BULK_WRITE_BATCH_SIZE threads.
+    # Returns False if any batch failed.
+    def flush_thread_writes(self, writes):
+        success = True
+        for start in range(0, len(writes), BULK_WRITE_BATCH_SIZE):
+            batch = writes[start:start + BULK_WRITE_BATCH_SIZE]
+            try:
+                result = self.threads_collection.bulk_write(batch, ordered=False)
+                self.logger.info(f"Bulk write of {len(batch)} threads: {result.inserted_count} inserted, {result.modified_count} modified.")
+            except BulkWriteError as e:
+                self.logger.error(f"Bulk write of {len(batch)} threads had errors: {e.details.get('writeErrors')}")
+                success = False
+            except pymongo.errors.PyMongoError as e:
+                self.logger.error(f"Error writing {len(batch)} threads to MongoDB: {e}")
+                success = False
+        return success
+
+    # Diffs freshly crawled threads of a board against the stored ones and writes the changes:
+    # one query for the stored threads and one bulk_write each for posts, thread headers and history.
+    # changed_threads maps thread numbers to (filtered_original_post, filtered_replies, tail_size), existing_threads
+    # may pass the stored threads if the caller already loaded them. Returns the number of thread writes,
+    # None if any write failed so callers don't save the validators of these threads.
+    def store_threads(self, board, changed_threads, crawled_at, existing_threads=None):
+        if not changed_threads:
+            return 0
+
+        if existing_threads is None:
+            with MONGO_OPERATION_SECONDS.time(job="store_threads", operation="load_threads"):
+                existing_threads = self.load_threads(board, changed_threads)
+            if existing_threads is None:
+                return None
+
+        writes = []
+        post_writes = []
+        history_writes = []
+        for thread_number, (filtered_original_post, filtered_replies, tail_size) in changed_threads.items():
+            existing_thread = existing_threads.get(thread_number)
+            layout = self.thread_layout(existing_thread)
+            history_write = self.build_history_write(board, thread_number, existing_thread, filtered_replies, crawled_at)
+            if history_write is not None:
+                history_writes.append(history_write)
+            # Post writes are built first, a diff strategy may mark vanished replies of the stored thread in place.
+            if layout == SPLIT_LAYOUT:
+                post_writes.extend(self.build_thread_post_writes(board, thread_number, existing_thread, filtered_replies))
+            write = self.build_thread_write(board, thread_number, existing_thread, filtered_original_post, filtered_replies, crawled_at,
+                                            embed_replies=(layout != SPLIT_LAYOUT), tail_size=tail_size)
+            if write is not None:
+                writes.append(write)
+        with MONGO_OPERATION_SECONDS.time(job="store_threads", operation="store_threads"):
+            stored = flush_post_writes(self.posts_collection, post_writes)
+            stored = self.flush_thread_writes(writes) and stored
+            stored = flush_history_writes(self.history_collection, history_writes) and stored
+        # New threads join the active index only once stored. A thread written by a batch that partly failed
+        # is indexed by the next reconcile_missing_threads.
+        if stored:
+            add_active_threads(self.active_threads_collection, board, [thread_number for thread_number in changed_threads if thread_number not in existing_threads])
+        return len(writes) if stored else None
+
+    # Reads the active (stored and not deleted) thread numbers of a board from the index in a single query.
+    def get_existing_thread_ids_from_db(self, board):
+        return load_active_threads(self.active_threads_collection, self.threads_collection, board)
+
+    # Resolves the stored threads missing from the current listing of a board, all together and without reading them:
+    # archived threads (in archive.json) and pruned ones (last seen on the final pages) keep their content,
+    # deleted ones are marked with their previous context kept in history. All of them leave the active index.
+    # Listed threads that are stored but missing from the index (their index update failed) join it again,
+    # so their deletion is noticed later. Returns the archived ones.
+    def reconcile_missing_threads(self, board, current_thread_numbers, archived_threads=None, final_page_thread_numbers=()):
+        previous_thread_numbers = self.get_existing_thread_ids_from_db(board)
+        unindexed_threads = load_stored_threads(self.threads_collection, board, set(current_thread_numbers) - set(previous_thread_numbers))
+        add_active_threads(self.active_threads_collection, board, sorted(unindexed_threads))
+        missing_threads = set(previous_thread_numbers) - set(current_thread_numbers)
+        if not missing_threads:
+            return set()
+
+        archived, pruned, deleted = classify_missing_threads(missing_threads, archived_threads, final_page_thread_numbers)
+        resolve_missing_threads(self.threads_collection, board, archived, pruned, deleted)
+        if deleted:
+            mark_thread_posts_as_deleted(self.posts_collection, board, deleted)
+        remove_active_threads(self.active_threads_collection, board, missing_threads)
+        self.logger.info(f"{len(missing_threads)} threads left /{board}/: {len(archived)} archived, {len(pruned)} pruned, {len(deleted)} deleted, historical data / previous context has been recorded.")
+        return archived
+
+    # Latest history entries of many threads of a board, for the adaptive scheduler.
+    def load_thread_histories(self, board, thread_numbers):
+        return load_thread_histories(self.history_collection, board, thread_numbers, threads_collection=self.threads_collection)
@@ -0,0 +1,107 @@
+import logging
+import datetime
+import pymongo
+from pymongo import UpdateOne
+
+# Logging to help with debugging
+logger = logging.getLogger("4chan validator store")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Returned by the 4chan clients when the server answers 304, so callers can tell
+# "nothing changed" apart from None which means deleted/unavailable.
+NOT_MODIFIED = object()
+
+class ValidatorStore:
+    """
+    Keeps the Last-Modified / ETag validators per API url so the 4chan clients can send
+    conditional GETs. This base class only lives in memory, MongoValidatorStore makes it durable.
+    """
+
+    def __init__(self):
+        self.validators = {}
+
+    def get(self, api_call):
+        return self.validators.get(api_call)
+
+    def set(self, api_call, last_modified=None, etag=None):
+        self.set_many({api_call: {"last_modified": last_modified, "etag": etag}})
+
+    # Saves many validators at once, {api_call: {"last_modified", "etag"}} as the clients collect them.
+    # Crawlers call it only once the data those responses carried is stored.
+    def set_many(self, validators):
+        for api_call, validator in validators.items():
+            if validator.get("last_modified") or validator.get("etag"):
+                self.validators[api_call] = {"last_modified": validator.get("last_modified"), "etag": validator.get("etag")}
+
+    # Loads validators for many urls at once, no-op for the in-memory store.
+    def preload(self, api_calls):
+        pass
+
+    # Builds the If-Modified-Since / If-None-Match headers for a url.
+    def conditional_headers(self, api_call):
+        headers = {}
+        validator = self.get(api_call)
+        if validator:
+            if validator.get("last_modified"):
+                headers['If-Modified-Since'] = validator["last_modified"]
+            if validator.get("etag"):
+                headers['If-None-Match'] = validator["etag"]
+        return headers
+
+class MongoValidatorStore(ValidatorStore):
+    """
+    Validator store backed by a MongoDB collection (one document per url, _id is the url),
+    so validators survive across Faktory jobs, consumer threads and worker restarts.
+    Documents read or written by this process are also kept in memory.
+    """
+
+    def __init__(self, collection):
+        super().__init__()
+        self.collection = collection
+
+    def get(self, api_call):
+        if api_call in self.validators:
+            return self.validators[api_call]
+        try:
+            document = self.collection.find_one({"_id": api_call})
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error reading validator for {api_call}: {e}")
+            return None
+        if document:
+            self.validators[api_call] = {"last_modified": document.get("last_modified"), "etag": document.get("etag")}
+        return self.validators.get(api_call)
+
+    # One unordered bulk upsert for every validator of a flush.
+    def set_many(self, validators):
+        validators = {api_call: validator for api_call, validator in validators.items() if validator.get("last_modified") or validator.get("etag")}
+        if not validators:
+            return
+        super().set_many(validators)
+        updated_at = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        writes = [
+            UpdateOne(
+                {"_id": api_call},
+                {"$set": {"last_modified": validator.get("last_modified"), "etag": validator.get("etag"), "updated_at": updated_at}},
+                upsert=True
+            )
+            for api_call, validator in validators.items()
+        ]
+        try:
+            self.collection.bulk_write(writes, ordered=False)
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error saving {len(writes)} validators: {e}")
+
+    def preload(self, api_calls):
+        missing = [api_call for api_call in api_calls if api_call not in self.validators]
+        if not missing:
+            return
+        try:
+            for document in self.collection.find({"_id": {"$in": missing}}):
+                self.validators[document["_id"]] = {"last_modified": document.get("last_modified"), "etag": document.get("etag")}
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error preloading validators: {e}")
@@ -0,0 +1,218 @@
+import logging
+import os
+import re
+import time
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# In-process metrics for the crawlers, in the Prometheus text format on a local HTTP /metrics endpoint.
+# Every crawler process (scheduler, supervisor, Faktory workers and their job pools) keeps its own registry and,
+# when METRICS_PORT is set, serves it on the first free port from METRICS_PORT on, starting the server the first
+# time it records anything. Scrape the port range and let Prometheus sum over the instances. A forked process
+# starts from an empty registry, so no sample is ever counted by two processes.
+
+# Logging to help with debugging
+logger = logging.getLogger("CrawlerMetrics")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# First port of the /metrics endpoints, 0 records metrics without serving them.
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Ports tried after METRICS_PORT, one per process.
+METRICS_PORT_RANGE = int(os.getenv("METRICS_PORT_RANGE", 64))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Seconds, from a fast Mongo round trip to a rate limited API call.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class Registry:
+    """Metrics of this process and the HTTP server exposing them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.server = None
+        self.serving_pid = None
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self.lock:
+            return "".join(metric.render() for metric in self.metrics)
+
+    # Starts the /metrics server of this process once, on the first free port of the range.
+    def ensure_serving(self):
+        if not METRICS_PORT or self.serving_pid == os.getpid():
+            return
+        with self.lock:
+            if self.serving_pid == os.getpid():
+                return
+            self.serving_pid = os.getpid()
+            for port in range(METRICS_PORT, METRICS_PORT + METRICS_PORT_RANGE):
+                try:
+                    self.server = ThreadingHTTPServer((METRICS_HOST, port), MetricsHandler)
+                except OSError:
+                    continue
+                self.server.daemon_threads = True
+                threading.Thread(target=self.server.serve_forever, daemon=True).start()
+                logger.info(f"Serving metrics of process {os.getpid()} on http://{METRICS_HOST}:{port}/metrics")
+                return
+            logger.warning(f"No free metrics port in {METRICS_PORT}-{METRICS_PORT + METRICS_PORT_RANGE - 1} for process {os.getpid()}.")
+
+    # A forked child owns neither the parent's samples nor its server thread.
+    def reset_after_fork(self):
+        self.lock = threading.Lock()
+        self.server = None
+        self.serving_pid = None
+        for metric in self.metrics:
+            metric.reset()
+
+REGISTRY = Registry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=REGISTRY.reset_after_fork)
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.reset()
+        registry.register(self)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        REGISTRY.ensure_serving()
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        with self.lock:
+            samples = self.samples()
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.type}\n"
+        return header + "".join(f"{name}{_format_labels(self.labelnames, key, extra)} {value}\n" for name, key, extra, value in samples)
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(f"{self.name}_total", key, (), value) for key, value in self.values.items()]
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        return [(self.name, key, (), value) for key, value in self.values.items()]
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            # [count per bucket..., sum, count]
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    # Observes the seconds spent in the with block.
+    @contextlib.contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        for key, state in self.values.items():
+            for bound, count in zip(self.buckets, state):
+                samples.append((f"{self.name}_bucket", key, (("le", repr(float(bound))),), count))
+            samples.append((f"{self.name}_bucket", key, (("le", "+Inf"),), state[-1]))
+            samples.append((f"{self.name}_sum", key, (), state[-2]))
+            samples.append((f"{self.name}_count", key, (), state[-1]))
+        return samples
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+THREAD_ENDPOINT = re.compile(r"/thread/\d+(-tail)?\.json$")
+
+# Low-cardinality endpoint label of an API url: thread, thread-tail, or the file name (catalog, threads, archive).
+def endpoint_label(api_call):
+    match = THREAD_ENDPOINT.search(api_call)
+    if match:
+        return "thread-tail" if match.group(1) else "thread"
+    return api_call.rstrip("/").rsplit("/", 1)[-1].split("?")[0].removesuffix(".json")
+
+HTTP_REQUEST_SECONDS = Histogram("crawler_http_request_seconds", "API request latency, rate governor wait excluded.", ["endpoint"])
+HTTP_RESPONSES = Counter("crawler_http_responses", "API responses by status code.", ["endpoint", "status"])
+HTTP_BYTES = Counter("crawler_http_downloaded_bytes", "Response body bytes downloaded from the API.", ["endpoint"])
+RETRY_SLEEP_SECONDS = Counter("crawler_retry_sleep_seconds", "Seconds slept before retrying a request.", ["reason"])
+MONGO_OPERATION_SECONDS = Histogram("crawler_mongo_operation_seconds", "MongoDB operation latency in the crawl jobs.", ["job", "operation"])
+JOBS = Counter("crawler_jobs", "Jobs processed by type and outcome.", ["job", "outcome"])
+JOB_SECONDS = Histogram("crawler_job_seconds", "Job run time by type.", ["job"])
+QUEUE_DEPTH = Gauge("crawler_queue_depth", "Jobs waiting in the worker queues.", ["worker"])
+TOXICITY_CACHE_LOOKUPS = Counter("crawler_toxicity_cache_lookups", "Toxicity score lookups by where they were answered: memory, store or miss.", ["result"])
+QUEUE_LAG_SECONDS = Gauge("crawler_queue_lag_seconds", "Estimated wait of a newly queued job: queue depth x mean job time / job slots.", ["worker"])
+
+# Records one API response: latency, status and downloaded bytes.
+def record_response(api_call, status_code, seconds, size=0):
+    endpoint = endpoint_label(api_call)
+    HTTP_REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    HTTP_RESPONSES.inc(endpoint=endpoint, status=status_code)
+    if size:
+        HTTP_BYTES.inc(size, endpoint=endpoint)
@@ -0,0 +1,121 @@
+import os
+import threading
+import pymongo
+from dotenv import load_dotenv
+
+# Process-wide resources shared by every crawler module and job.
+# The crawlers fork their Faktory worker (multiprocessing.Process) after importing, and a pymongo.MongoClient
+# must not be used across a fork: the child inherits the parent's sockets and monitor threads. So nothing connects
+# at import time. Modules hold lazy handles (LazyMongoClient, LazyDatabase, LazyCollection) that resolve to one
+# pooled MongoClient per process and url on first use, and a fork forgets the inherited clients so the child
+# opens its own pool the first time it touches MongoDB. Every job of a process then reuses that pool.
+
+_environment_loaded = False
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Loads the .env file once per process, the environment is inherited by forked workers.
+def load_environment():
+    global _environment_loaded
+    if not _environment_loaded:
+        load_dotenv()
+        _environment_loaded = True
+
+# Returns this process's pooled MongoClient for the url, connecting on first use.
+def get_mongo_client(mongo_url):
+    client = _clients.get(mongo_url)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(mongo_url)
+            if client is None:
+                client = pymongo.MongoClient(mongo_url)
+                _clients[mongo_url] = client
+    return client
+
+# Closes this process's clients, for orderly shutdown. Lazy handles reconnect if used afterwards.
+def close_mongo_clients():
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+# After a fork the child drops the parent's clients without closing them (closing would touch the parent's
+# sockets), and gets a fresh lock in case the fork happened while another thread held it.
+def _forget_clients_after_fork():
+    global _clients, _clients_lock
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_clients_after_fork)
+
+class LazyHandle:
+    """
+    Stand-in for a pymongo object that is only resolved when first used, once per process.
+    Attribute access and [] go to the resolved object, so a handle is used exactly like the client,
+    database or collection it stands for.
+    """
+
+    def __init__(self):
+        self._resolved = None
+        self._resolved_pid = None
+
+    def _resolve(self):
+        raise NotImplementedError
+
+    def resolve(self):
+        pid = os.getpid()
+        if self._resolved is None or self._resolved_pid != pid:
+            self._resolved = self._resolve()
+            self._resolved_pid = pid
+        return self._resolved
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, name):
+        return self.resolve()[name]
+
+class LazyMongoClient(LazyHandle):
+    def __init__(self, mongo_url):
+        super().__init__()
+        self.mongo_url = mongo_url
+
+    def _resolve(self):
+        return get_mongo_client(self.mongo_url)
+
+    def __getitem__(self, name):
+        return LazyDatabase(self, name)
+
+    def __repr__(self):
+        return f"LazyMongoClient({self.mongo_url!r})"
+
+class LazyDatabase(LazyHandle):
+    def __init__(self, client, name):
+        super().__init__()
+        self.client = client
+        self.name = name
+
+    def _resolve(self):
+        return self.client.resolve()[self.name]
+
+    def __getitem__(self, name):
+        return LazyCollection(self, name)
+
+    def __repr__(self):
+        return f"LazyDatabase({self.name!r})"
+
+class LazyCollection(LazyHandle):
+    def __init__(self, database, name):
+        super().__init__()
+        self.database = database
+        self.name = name
+
+    def _resolve(self):
+        return self.database.resolve()[self.name]
+
+    def __repr__(self):
+        return f"LazyCollection({self.database.name!r}, {self.name!r})"
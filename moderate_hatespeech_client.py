@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import time
+import random
+import aiohttp
+from crawler_metrics import record_response, RETRY_SLEEP_SECONDS
+from toxicity_cache import toxicity_cache
+
+# Logging to help with debugging
+logger = logging.getLogger("ModerateHatespeechClient")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+API_URL = "https://api.moderatehatespeech.com/api/v1/moderate/"
+
+# Requests in flight at once per client, every scoring call of a thread, post or video shares them.
+MODERATE_MAX_IN_FLIGHT = int(os.getenv("MODERATE_MAX_IN_FLIGHT", 8))
+MODERATE_REQUEST_TIMEOUT = float(os.getenv("MODERATE_REQUEST_TIMEOUT", 10))
+MAX_RETRIES = 5
+RETRY_DELAY = 2
+MAX_RETRY_DELAY = 60
+
+# Waits around delay, spread so that requests which failed together don't all retry at the same moment.
+def jittered(delay):
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class AsyncModerateHatespeechClient:
+    """
+    Asyncio client for the ModerateHatespeech API. Scores many texts concurrently over one aiohttp session,
+    with at most max_in_flight requests open, a timeout per request and jittered, capped exponential retries
+    on network errors, timeouts, 429 and 5xx. Results are the API's {"class", "confidence"}, None when a text
+    could not be scored. Texts already in the toxicity cache are never sent. Use it as an async context manager:
+
+        async with AsyncModerateHatespeechClient(api_token) as client:
+            scores = await client.score_many(["first text", "second text"])
+    """
+
+    def __init__(self, api_token, max_in_flight=MODERATE_MAX_IN_FLIGHT, timeout=MODERATE_REQUEST_TIMEOUT, max_retries=MAX_RETRIES, cache=toxicity_cache):
+        self.api_token = api_token
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.cache = cache
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.session.close()
+        self.session = None
+
+    # Sends one text to the API, bypassing the cache.
+    async def request_score(self, text):
+        payload = {"token": self.api_token, "text": text}
+        delay = RETRY_DELAY
+
+        for attempt in range(1, self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self.semaphore:
+                    started = time.perf_counter()
+                    async with self.session.post(API_URL, json=payload) as response:
+                        status_code = response.status
+                        body = await response.read()
+                        record_response(API_URL, status_code, time.perf_counter() - started, len(body))
+                        retry_after = response.headers.get("Retry-After")
+                        data = await response.json(content_type=None) if status_code == 200 and body.strip() else None
+
+                if status_code == 200 and data is not None:
+                    if data.get("response") == "Success":
+                        return {"class": data.get("class"), "confidence": float(data.get("confidence", 0.0))}
+                    # The API refused this text, asking again gets the same answer.
+                    logger.error(f"API Error: {data.get('response')}. Text: {text[:30]}...")
+                    return None
+                if status_code != 200 and status_code != 429 and status_code < 500:
+                    logger.error(f"Client error {status_code} from ModerateHatespeech API. Text: {text[:30]}...")
+                    return None
+                reason = "empty" if status_code == 200 else ("5xx" if status_code >= 500 else str(status_code))
+                logger.warning(f"ModerateHatespeech API answered {status_code} without a score (Attempt {attempt}/{self.max_retries}).")
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                reason = "network"
+                logger.warning(f"Error communicating with ModerateHatespeech API: {e!r} (Attempt {attempt}/{self.max_retries}).")
+
+            if attempt < self.max_retries:
+                wait = float(retry_after) if retry_after and retry_after.isdigit() else jittered(delay)
+                RETRY_SLEEP_SECONDS.inc(wait, reason=reason)
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+        logger.error(f"Max retries reached for text analysis. Text: {text[:30]}...")
+        return None
+
+    async def score(self, text):
+        return (await self.score_many([text]))[0]
+
+    # Scores many texts concurrently, returns their scores in the same order (None for texts that failed).
+    # Every distinct text is looked up in the cache and sent at most once, blank texts are never sent.
+    async def score_many(self, texts):
+        texts = list(texts)
+        distinct_texts = list(dict.fromkeys(text for text in texts if text and text.strip()))
+        scores = self.cache.get_many(distinct_texts) if self.cache is not None else {}
+        missing_texts = [text for text in distinct_texts if text not in scores]
+        if missing_texts:
+            results = await asyncio.gather(*(self.request_score(text) for text in missing_texts))
+            fresh_scores = dict(zip(missing_texts, results))
+            if self.cache is not None:
+                self.cache.put_many(fresh_scores)
+            scores.update(fresh_scores)
+            logger.info(f"Scored {len(missing_texts)} texts, {len(distinct_texts) - len(missing_texts)} more were cached.")
+        return [dict(scores[text]) if scores.get(text) is not None else None for text in texts]
+
+# Blocking helper so synchronous jobs and scripts can score a whole thread, post or video with one pool.
+def score_many_blocking(texts, api_token, **client_kwargs):
+    async def run():
+        async with AsyncModerateHatespeechClient(api_token, **client_kwargs) as client:
+            return await client.score_many(texts)
+
+    return asyncio.run(run())
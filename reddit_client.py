@@ -2,11 +2,12 @@ import logging
 import colorlog
 import requests
 import os
-import time
-from dotenv import load_dotenv
+from crawler_resources import load_environment
+from response_capture import capture_response
+from toxicity_backends import get_backend
 
 # Load environment variables
-load_dotenv()
+load_environment()
 
 # Get the current working directory
 current_dir = os.getcwd()
@@ -34,7 +35,7 @@ sh.setFormatter(color_formatter)
 logger.addHandler(sh)
 
 file_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-log_file_handler = logging.FileHandler(log_file_path)
+log_file_handler = logging.FileHandler(log_file_path, delay=True)
 log_file_handler.setFormatter(file_formatter)
 logger.addHandler(log_file_handler)
 
@@ -43,7 +44,6 @@ logger.addHandler(log_file_handler)
 
 
 MODERATE_API_TOKEN = os.getenv("MODERATE_API_TOKEN")
-MODERATE_API_URL = "https://api.moderatehatespeech.com/api/v1/moderate/"
 
 class RedditClient:
     API_BASE = "https://oauth.reddit.com"
@@ -65,6 +65,7 @@ class RedditClient:
         headers = {"Authorization": f"bearer {self.access_token}", "User-Agent": "RedditClient/0.1"}
         url = f"{self.API_BASE}{endpoint}"
         response = requests.get(url, headers=headers)
+        capture_response("reddit", url, response.status_code, response.content)
         if response.status_code != 200:
             logger.error(f"Error fetching data: {response.status_code}")
             return None
@@ -108,60 +109,21 @@ class RedditClient:
         logger.info(f"Fetching comments for post {post_id} from {subreddit}")
         return self.execute_request(endpoint)
 
-def get_toxicity_score(text, max_retries=3, delay=2):
-    if not MODERATE_API_TOKEN:
-        logger.error("ModerateHatespeech API token not found. Please set it in the .env file.")
-        return None
-
-    headers = {
-        "Content-Type": "application/json"
-    }
-    data = {
-        "token": MODERATE_API_TOKEN,
-        "text": text
+# Shapes a ModerateHatespeech result ({"class", "confidence"}) into the score stored with Reddit posts.
+def toxicity_score_from_result(result):
+    return {
+        "toxicity_score": float(result.get("confidence", 0.0)),
+        "is_toxic": result.get("class", "normal") == "flag",
+        "profanity_detected": "profanity" in result.get("class", "").lower()
     }
 
-    retries = 0
-    while retries < max_retries:
-        logger.info(f"Attempting to get toxicity score (attempt {retries + 1}) for text: {text[:50]}...")
-        try:
-            response = requests.post(MODERATE_API_URL, json=data, headers=headers)
-            if response.status_code != 200:
-                logger.error(f"Non-200 status code (attempt {retries + 1}): {response.status_code}, Response Content: {response.text}")
-                retries += 1
-                time.sleep(delay)  
-                continue
-
-            if not response.text.strip():  
-                logger.error(f"Received empty response content (attempt {retries + 1}).")
-                retries += 1
-                time.sleep(delay)
-                continue
-
-            try:
-                result = response.json()
-            except ValueError as ve:
-                logger.error(f"Error parsing JSON response (attempt {retries + 1}): {ve}")
-                retries += 1
-                time.sleep(delay)
-                continue
-
-            if result.get("response") == "Success":
-                logger.info(f"Received successful response for toxicity score on attempt {retries + 1}.")
-                return {
-                    "toxicity_score": float(result.get("confidence", 0.0)),
-                    "is_toxic": result.get("class", "normal") == "flag",
-                    "profanity_detected": "profanity" in result.get("class", "").lower()
-                }
-            else:
-                logger.error(f"API response failed (attempt {retries + 1}): {result.get('response')}")
-                retries += 1
-                time.sleep(delay) 
-                continue
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Network error during request (attempt {retries + 1}): {e}")
-            retries += 1
-            time.sleep(delay)
-
-    logger.error(f"Failed to get toxicity score after {max_retries} attempts.")
-    return None
\ No newline at end of file
+# Scores many texts in one batch with the configured backend (the API concurrently and cached, or the local model),
+# returns the scores in the same order, None for texts that could not be scored.
+def get_toxicity_scores(texts):
+    texts = list(texts)
+    logger.info(f"Getting toxicity scores for {len(texts)} texts...")
+    results = get_backend(MODERATE_API_TOKEN).score_many(texts)
+    return [toxicity_score_from_result(result) if result is not None else None for result in results]
+
+def get_toxicity_score(text):
+    return get_toxicity_scores([text])[0]
@@ -1,16 +1,17 @@
 import logging
-import pymongo
 import os
 import time
-from dotenv import load_dotenv
 from faktory import Client, Worker
-from reddit_client import RedditClient, get_toxicity_score  # Import get_toxicity_score here
+from reddit_client import RedditClient, get_toxicity_scores
 from datetime import datetime, timedelta
 import multiprocessing
 from requests.exceptions import HTTPError
+from crawler_resources import load_environment, LazyMongoClient
+from worker_supervisor import WorkerSupervisor, TimedJob, faktory_queue_depth
+from crawler_metrics import MONGO_OPERATION_SECONDS, RETRY_SLEEP_SECONDS
 
 # Load environment variables
-load_dotenv()
+load_environment()
 
 # Configurations and logging setup
 MONGO_DB_URL = os.getenv("MONGO_DB_URL") or "mongodb://localhost:27017/"
@@ -18,6 +19,10 @@ FAKTORY_SERVER_URL = os.getenv("FAKTORY_SERVER_URL") or 'tcp://:raj123@localhost
 MAX_RETRIES = 5
 RETRY_DELAY = 5
 
+# Queues consumed by the workers, and the jobs each worker process runs at once to start with (see worker_supervisor).
+WORKER_QUEUES = ['crawl_subreddit', 'crawl_post']
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 1))
+
 # Setup logger
 logger = logging.getLogger("RedditCrawler")
 logger.setLevel(logging.INFO)
@@ -29,11 +34,11 @@ logger.addHandler(sh)
 
 #-------------------------------------------------------------------------------------
 
+mongo_client = LazyMongoClient(MONGO_DB_URL)
+
 def initialize_mongo_client():
-    """Initialize MongoDB client within each worker to ensure fork-safety."""
-    mongo_client = pymongo.MongoClient(MONGO_DB_URL)
-    db = mongo_client['reddit_Data_moderate_speech']
-    return db
+    """Database of the worker process, backed by one pooled client per process that is reconnected after a fork."""
+    return mongo_client['reddit_Data_moderate_speech']
 
 
 
@@ -57,11 +62,13 @@ def retry_on_network_and_http_errors(func, *args):
                 logger.error(f"Server error (status {status_code}) occurred. Retrying in {delay} seconds...")
             else:
                 logger.error(f"Unexpected HTTP error: {http_err}")
+            RETRY_SLEEP_SECONDS.inc(delay, reason=str(status_code))
             time.sleep(delay)
             retries += 1
             delay *= 2
         except requests.exceptions.RequestException as req_err:
             logger.error(f"Network error: {req_err}. Retrying in {delay} seconds...")
+            RETRY_SLEEP_SECONDS.inc(delay, reason="network")
             time.sleep(delay)
             retries += 1
             delay *= 2
@@ -92,6 +99,27 @@ def crawl_post(subreddit, post_id, collection_name):
         status_code = http_err.response.status_code
         if status_code == 404:
             logger.warning(f"Post {post_id} Marking as deleted.")
+            with MONGO_OPERATION_SECONDS.time(job="crawl_post", operation="mark_deleted"):
+                collection.update_one(
+                    {"post_id": post_id},
+                    {
+                        "$set": {
+                            "post_title": "[Deleted Title]",
+                            "post_content": "[Deleted Content]",
+                            "is_deleted": True,
+                            "crawled_at": datetime.now()
+                        },
+                        "$push": {"crawl_history": datetime.now()}
+                    },
+                    upsert=True
+                )
+        else:
+            logger.error(f"HTTP error occurred: {http_err}")
+        return
+
+    if post_data is None or len(post_data[0]['data']['children']) == 0:
+        logger.warning(f"Post {post_id} might be deleted or unavailable.")
+        with MONGO_OPERATION_SECONDS.time(job="crawl_post", operation="mark_deleted"):
             collection.update_one(
                 {"post_id": post_id},
                 {
@@ -105,25 +133,6 @@ def crawl_post(subreddit, post_id, collection_name):
                 },
                 upsert=True
             )
-        else:
-            logger.error(f"HTTP error occurred: {http_err}")
-        return
-
-    if post_data is None or len(post_data[0]['data']['children']) == 0:
-        logger.warning(f"Post {post_id} might be deleted or unavailable.")
-        collection.update_one(
-            {"post_id": post_id},
-            {
-                "$set": {
-                    "post_title": "[Deleted Title]",
-                    "post_content": "[Deleted Content]",
-                    "is_deleted": True,
-                    "crawled_at": datetime.now()
-                },
-                "$push": {"crawl_history": datetime.now()}
-            },
-            upsert=True
-        )
         return
 
     current_time = datetime.now()
@@ -136,11 +145,18 @@ def crawl_post(subreddit, post_id, collection_name):
         post_content = "[No Content]"
         logger.warning(f"Post {post_id} in subreddit {subreddit} has no content.")
 
-    # Use get_toxicity_score for title and content
-    title_moderate_score = get_toxicity_score(post_title) if post_title and post_title != '[Deleted Title]' else None
-    content_moderate_score = get_toxicity_score(post_content) if post_content and post_content != '[Deleted Content]' else {"is_toxic": False, "toxicity_score": 0.0}
-
     all_comments = post_data[1]['data']['children']
+
+    # Title, content and every comment of the post are scored together in one concurrent batch.
+    score_title = bool(post_title) and post_title != '[Deleted Title]'
+    score_content = bool(post_content) and post_content != '[Deleted Content]'
+    scored_comment_texts = [comment['data'].get('body', '[Deleted]') for comment in all_comments]
+    scored_comment_texts = [comment_text for comment_text in scored_comment_texts if comment_text and comment_text != '[Deleted]']
+    scores = get_toxicity_scores(([post_title] if score_title else []) + ([post_content] if score_content else []) + scored_comment_texts)
+    title_moderate_score = scores.pop(0) if score_title else None
+    content_moderate_score = scores.pop(0) if score_content else {"is_toxic": False, "toxicity_score": 0.0}
+    comment_moderate_scores = dict(zip(scored_comment_texts, scores))
+
     comments = []
     for comment in all_comments:
         comment_data = comment['data']
@@ -157,7 +173,7 @@ def crawl_post(subreddit, post_id, collection_name):
             }
 
             # ---------------------------------------------------   Get moderate speech score for comment
-            comment_moderate_score = get_toxicity_score(comment_text)
+            comment_moderate_score = comment_moderate_scores.get(comment_text)
             if comment_moderate_score:
                 comment_entry['moderate_class'] = "flag" if comment_moderate_score["is_toxic"] else "normal"
                 comment_entry['moderate_confidence'] = comment_moderate_score["toxicity_score"]
@@ -182,14 +198,15 @@ def crawl_post(subreddit, post_id, collection_name):
         "content_moderate_confidence": content_moderate_score["toxicity_score"] if content_moderate_score else 0.0
     }
 
-    collection.update_one(
-        {"post_id": post_id},
-        {
-            "$set": post_info,
-            "$push": {"crawl_history": current_time}
-        },
-        upsert=True
-    )
+    with MONGO_OPERATION_SECONDS.time(job="crawl_post", operation="store_post"):
+        collection.update_one(
+            {"post_id": post_id},
+            {
+                "$set": post_info,
+                "$push": {"crawl_history": current_time}
+            },
+            upsert=True
+        )
     logger.info(
         f"Processed post {post_id} from subreddit {subreddit}. "
         f"Title moderate class: {post_info['title_moderate_class']}, "
@@ -230,13 +247,19 @@ def crawl_subreddit(subreddit, collection_name):
             {"$set": {"is_deleted": True, "crawled_at": datetime.now()}}
         )
 
-    # Queue jobs to crawl each post in hot_posts
-    for post in hot_posts:
-        post_id = post['data']['id']
-        existing_post = collection.find_one({"post_id": post_id})
-        
-        if existing_post is None or (existing_post['upvotes'] != post['data']['ups'] or existing_post['comment_count'] != post['data']['num_comments']):
-            with Client() as client:
+    # Stored counts of every hot post in one query instead of a find_one per post
+    stored_posts = {
+        post['post_id']: post
+        for post in collection.find({"post_id": {"$in": current_post_ids}}, {"post_id": 1, "upvotes": 1, "comment_count": 1})
+    }
+
+    # Queue jobs to crawl each new or changed post in hot_posts, all over one Faktory connection
+    with Client() as client:
+        for post in hot_posts:
+            post_id = post['data']['id']
+            existing_post = stored_posts.get(post_id)
+
+            if existing_post is None or (existing_post.get('upvotes') != post['data']['ups'] or existing_post.get('comment_count') != post['data']['num_comments']):
                 client.queue('crawl_post', args=(subreddit, post_id, collection_name), queue='crawl_post')
                 logger.info(f"Queued job to crawl post {post_id} from {subreddit} due to detected changes or new post.")
                 
@@ -248,11 +271,11 @@ def crawl_subreddit(subreddit, collection_name):
 
 
 
-def start_worker():
+def start_worker(concurrency=WORKER_CONCURRENCY):
     os.environ['FAKTORY_URL'] = FAKTORY_SERVER_URL
-    worker = Worker(queues=['crawl_subreddit', 'crawl_post'])
-    worker.register('crawl_subreddit', crawl_subreddit)
-    worker.register('crawl_post', crawl_post)
+    worker = Worker(queues=WORKER_QUEUES, concurrency=concurrency)
+    worker.register('crawl_subreddit', TimedJob(crawl_subreddit))
+    worker.register('crawl_post', TimedJob(crawl_post))
     logger.info("Worker started. Listening for jobs...")
     worker.run()
     
@@ -320,10 +343,15 @@ def monitor_queue():
         
         time.sleep(120) 
 
+# Jobs waiting in the worker queues, the supervisor sizes the worker pool from it.
+def queue_depth():
+    return faktory_queue_depth(FAKTORY_SERVER_URL, WORKER_QUEUES)
+
 if __name__ == "__main__":
     os.environ['FAKTORY_URL'] = FAKTORY_SERVER_URL
 
-    worker_process = multiprocessing.Process(target=start_worker)
+    supervisor = WorkerSupervisor(start_worker, queue_depth, initial_concurrency=WORKER_CONCURRENCY)
+    worker_process = multiprocessing.Process(target=supervisor.run)
     worker_process.start()
 
     monitor_process = multiprocessing.Process(target=monitor_queue)
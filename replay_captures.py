@@ -0,0 +1,139 @@
+import argparse
+import datetime
+import importlib
+import logging
+import re
+from chan_decoder import decode_json, filter_thread_data
+from chan_board_state import thread_positions_from_catalog, final_page_threads
+from chan_fetch_pipeline import FINAL_CAPTURE_PAGES, board_sinks
+from response_capture import read_captures
+
+# Replays captured 4chan responses (see response_capture) through the crawlers' parse, diff and write stages,
+# at disk speed and without a single network call: thread bodies are decoded and filtered again with the current
+# chan_decoder and handed to each sink's thread store, like chan_pipeline does with freshly fetched threads.
+# With --reconcile the captured listings also drive reconcile_missing_threads, so threads that left a board are
+# archived, pruned or marked deleted as they were during the crawl.
+# Threads captured as -tail.json only carry the newest replies and are merged against stored replies by the live
+# crawlers, so replay skips them and relies on the full thread captures.
+# Reddit and YouTube captures can be listed with --list, their crawl jobs score text through the toxicity API
+# and have no offline write stage to replay into.
+# Usage: python replay_captures.py captures/ [--sinks chan_crawler,chan_moderate_crawler] [--reconcile] [--batch-seconds 60]
+#        python replay_captures.py captures/ --list --source youtube
+
+# Logging to help with debugging
+logger = logging.getLogger("ReplayCaptures")
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+THREAD_URL = re.compile(r"/(\w+)/thread/(\d+)(-tail)?\.json$")
+LISTING_URL = re.compile(r"/(\w+)/(catalog|threads|archive)\.json$")
+
+def format_crawled_at(fetched_at):
+    return datetime.datetime.fromtimestamp(fetched_at).strftime('%Y-%m-%d %H:%M:%S')
+
+class ChanReplay:
+    """
+    Feeds captured chan responses in capture order to the sinks (thread stores) of their board. Threads of a board are batched like a
+    crawl-thread-batch job: a batch holds the threads captured within batch_seconds of its first one and is stored
+    with that crawled_at. A batch is flushed early when it would hold a thread twice or a listing of its board comes next.
+    """
+
+    def __init__(self, sinks, reconcile=False, batch_seconds=60, batch_size=500):
+        self.sinks = sinks
+        self.reconcile = reconcile
+        self.batch_seconds = batch_seconds
+        self.batch_size = batch_size
+        # board -> (first fetched_at, {thread_number: (filtered_original_post, filtered_replies, tail_size)})
+        self.batches = {}
+        # board -> set of archived thread numbers, from the latest archive.json capture
+        self.archived_threads = {}
+        # board -> the previous catalog.json or threads.json capture, its final pages tell pruned threads from deleted ones
+        self.previous_listings = {}
+        self.counts = {"threads": 0, "writes": 0, "listings": 0, "skipped_tail": 0, "skipped_status": 0, "other": 0}
+
+    def flush(self, board):
+        batch = self.batches.pop(board, None)
+        if not batch:
+            return
+        fetched_at, changed_threads = batch
+        crawled_at = format_crawled_at(fetched_at)
+        for sink in board_sinks(self.sinks, board):
+            self.counts["writes"] += sink.store_threads(board, changed_threads, crawled_at) or 0
+
+    def add_thread(self, board, thread_number, response):
+        thread_data = decode_json(response.body)
+        batch = self.batches.get(board)
+        if batch and (thread_number in batch[1] or len(batch[1]) >= self.batch_size or response.fetched_at - batch[0] > self.batch_seconds):
+            self.flush(board)
+            batch = None
+        if batch is None:
+            batch = self.batches[board] = (response.fetched_at, {})
+        batch[1][thread_number] = (*filter_thread_data(thread_data), thread_data['posts'][0].get('tail_size'))
+        self.counts["threads"] += 1
+
+    def add_listing(self, board, kind, response):
+        listing = decode_json(response.body)
+        if kind == "archive":
+            self.archived_threads[board] = set(listing)
+            return
+        self.counts["listings"] += 1
+        if not self.reconcile:
+            return
+        self.flush(board)
+        current_thread_numbers = list(thread_positions_from_catalog(listing))
+        # Like crawl_board, threads that were on the final pages of the previous listing count as pruned, not deleted.
+        previous_listing = self.previous_listings.get(board)
+        final_page_thread_numbers = final_page_threads(previous_listing, max(FINAL_CAPTURE_PAGES, 1)) if previous_listing else ()
+        for sink in board_sinks(self.sinks, board):
+            sink.reconcile_missing_threads(board, current_thread_numbers, self.archived_threads.get(board), final_page_thread_numbers)
+        self.previous_listings[board] = listing
+
+    def replay(self, responses):
+        for response in responses:
+            thread_match = THREAD_URL.search(response.url)
+            listing_match = LISTING_URL.search(response.url) if thread_match is None else None
+            if thread_match is None and listing_match is None:
+                self.counts["other"] += 1
+                continue
+            # 404s and errors carry no data, the listings replayed around them decide liveness.
+            if response.status != 200:
+                self.counts["skipped_status"] += 1
+                continue
+            if thread_match:
+                if thread_match.group(3):
+                    self.counts["skipped_tail"] += 1
+                    continue
+                self.add_thread(thread_match.group(1), int(thread_match.group(2)), response)
+            else:
+                self.add_listing(listing_match.group(1), listing_match.group(2), response)
+        for board in list(self.batches):
+            self.flush(board)
+        return self.counts
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured API responses through the crawlers without network calls.")
+    parser.add_argument("paths", nargs="+", help="segment files or capture directories")
+    parser.add_argument("--source", default="chan", choices=["chan", "reddit", "youtube"])
+    parser.add_argument("--sinks", default="chan_crawler,chan_moderate_crawler", help="crawler modules whose thread_store the threads are replayed into")
+    parser.add_argument("--reconcile", action="store_true", help="also replay listings into reconcile_missing_threads")
+    parser.add_argument("--batch-seconds", type=float, default=60, help="threads captured within this window are stored as one batch")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--list", action="store_true", help="only list the captured responses")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    responses = read_captures(args.paths, source=args.source)
+    if args.list:
+        for response in responses:
+            print(f"{format_crawled_at(response.fetched_at)} {response.status} {len(response.body):>9} {response.url}")
+    elif args.source != "chan":
+        raise SystemExit(f"Only chan captures can be replayed into the crawlers, use --list for {args.source} captures.")
+    else:
+        sinks = [importlib.import_module(sink_module).thread_store for sink_module in args.sinks.split(',')]
+        counts = ChanReplay(sinks, reconcile=args.reconcile, batch_seconds=args.batch_seconds, batch_size=args.batch_size).replay(responses)
+        logger.info(f"Replayed {counts['threads']} threads ({counts['writes']} thread writes) and {counts['listings']} listings, "
+                    f"skipped {counts['skipped_tail']} tail and {counts['skipped_status']} non-200 responses, {counts['other']} other urls.")
@@ -0,0 +1,175 @@
+import logging
+import os
+import re
+import io
+import gzip
+import json
+import time
+import threading
+import datetime
+
+try:
+    import zstandard
+except ImportError:  # optional, captures fall back to gzip segments
+    zstandard = None
+
+# Optional capture of every raw API response (url, status, fetch time and body) into rotating compressed segment
+# files, so crawls can be reprocessed after a schema or filter change without going back to sites that have
+# since deleted the data (see replay_captures.py). Set RESPONSE_CAPTURE_DIR to enable it.
+#
+# A segment is a stream of records, each a JSON header line {"url", "status", "fetched_at", "size"} followed by
+# the size bytes of the body and a newline. Segments are zstd compressed when zstandard is installed, gzip
+# otherwise, and flushed after every record so a crashed process leaves a readable segment.
+# Every process writes its own segments: <source>-<started>-<pid>-<sequence>.capture.zst (or .gz).
+
+# Logging to help with debugging
+logger = logging.getLogger("ResponseCapture")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+RESPONSE_CAPTURE_DIR = os.getenv("RESPONSE_CAPTURE_DIR", "")
+# A segment is closed and a new one started past this compressed size or age.
+CAPTURE_SEGMENT_MAX_BYTES = int(os.getenv("CAPTURE_SEGMENT_MAX_BYTES", 256 * 1024 * 1024))
+CAPTURE_SEGMENT_MAX_SECONDS = int(os.getenv("CAPTURE_SEGMENT_MAX_SECONDS", 3600))
+CAPTURE_ZSTD_LEVEL = int(os.getenv("CAPTURE_ZSTD_LEVEL", 3))
+
+# Credentials in query strings (the YouTube API key) never reach the segments.
+SECRET_QUERY_PARAMETERS = re.compile(r"([?&](?:key|token|access_token)=)[^&]*")
+
+def redact_url(url):
+    return SECRET_QUERY_PARAMETERS.sub(r"\1REDACTED", url)
+
+class CapturedResponse:
+    __slots__ = ("url", "status", "fetched_at", "body")
+
+    def __init__(self, url, status, fetched_at, body):
+        self.url = url
+        self.status = status
+        self.fetched_at = fetched_at
+        self.body = body
+
+class SegmentWriter:
+    """Appends responses of one source to the current segment of this process, rotating by size and age."""
+
+    def __init__(self, directory, source, max_bytes=CAPTURE_SEGMENT_MAX_BYTES, max_seconds=CAPTURE_SEGMENT_MAX_SECONDS):
+        self.directory = directory
+        self.source = source
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.lock = threading.Lock()
+        self.pid = None
+        self.sequence = 0
+        self.file = None
+        self.stream = None
+        self.opened_at = 0
+        # Segments inherited over a fork, kept referenced so that closing them never writes into the parent's file.
+        self.inherited = []
+
+    def open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.sequence += 1
+        started = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+        extension = "zst" if zstandard is not None else "gz"
+        path = os.path.join(self.directory, f"{self.source}-{started}-{os.getpid()}-{self.sequence:04d}.capture.{extension}")
+        self.file = open(path, "ab")
+        if zstandard is not None:
+            self.stream = zstandard.ZstdCompressor(level=CAPTURE_ZSTD_LEVEL).stream_writer(self.file, closefd=False)
+        else:
+            self.stream = gzip.GzipFile(fileobj=self.file, mode="ab")
+        self.opened_at = time.monotonic()
+        logger.info(f"Capturing {self.source} responses to {path}")
+
+    def close_segment(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.file.close()
+        self.stream = None
+        self.file = None
+
+    def write(self, url, status, body, fetched_at):
+        body = body or b""
+        header = json.dumps({"url": redact_url(url), "status": status, "fetched_at": fetched_at, "size": len(body)}).encode()
+        with self.lock:
+            # A forked child leaves the parent's segment alone and starts its own.
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                if self.stream is not None:
+                    self.inherited.append((self.stream, self.file))
+                self.stream = None
+                self.file = None
+            elif self.stream is not None and (self.file.tell() >= self.max_bytes or time.monotonic() - self.opened_at >= self.max_seconds):
+                self.close_segment()
+            if self.stream is None:
+                self.open_segment()
+            self.stream.write(header + b"\n" + body + b"\n")
+            if zstandard is not None:
+                self.stream.flush(zstandard.FLUSH_BLOCK)
+            else:
+                self.stream.flush()
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+# Records one raw response of a source (chan, reddit, youtube), a no-op unless RESPONSE_CAPTURE_DIR is set.
+# Capture failures are logged and never break the crawl.
+def capture_response(source, url, status, body, fetched_at=None):
+    if not RESPONSE_CAPTURE_DIR:
+        return
+    writer = _writers.get(source)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.setdefault(source, SegmentWriter(RESPONSE_CAPTURE_DIR, source))
+    try:
+        writer.write(url, status, body, fetched_at if fetched_at is not None else time.time())
+    except OSError as e:
+        logger.error(f"Error capturing response of {redact_url(url)}: {e}")
+
+# Segment files of a directory (or the given files) in capture order, optionally of one source only.
+def segment_paths(paths, source=None):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in os.listdir(path) if ".capture." in name)
+        else:
+            files.append(path)
+    if source is not None:
+        files = [path for path in files if os.path.basename(path).startswith(f"{source}-")]
+    # <source>-<started>-<pid>-<sequence>: ordered by start time, then by process and sequence.
+    return sorted(files, key=lambda path: os.path.basename(path).split("-", 1)[-1])
+
+def open_segment(path):
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is needed to read {path}, pip install zstandard")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True))
+    return gzip.open(path, "rb")
+
+# Streams the responses of one segment. A record cut short by a crash ends the segment.
+def read_segment(path):
+    with open_segment(path) as stream:
+        while True:
+            try:
+                header = stream.readline()
+                if not header:
+                    return
+                header = json.loads(header)
+                body = stream.read(header["size"] + 1)[:header["size"]]
+            except EOFError:
+                # gzip segments only get their trailer when closed, a segment still being written ends here.
+                return
+            except (ValueError, OSError, zstandard.ZstdError if zstandard is not None else OSError) as e:
+                logger.warning(f"Segment {path} ends with a truncated record: {e}")
+                return
+            if len(body) < header["size"]:
+                logger.warning(f"Segment {path} ends with a truncated record.")
+                return
+            yield CapturedResponse(header["url"], header["status"], header["fetched_at"], body)
+
+# Streams every response of the given segment files or directories, in capture order.
+def read_captures(paths, source=None):
+    for path in segment_paths(paths, source):
+        yield from read_segment(path)
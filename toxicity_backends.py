@@ -0,0 +1,208 @@
+import argparse
+import json
+import logging
+import os
+import re
+import zlib
+import hashlib
+import numpy as np
+from toxicity_cache import normalize_text
+
+# Logging to help with debugging
+logger = logging.getLogger("ToxicityBackends")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Scoring backends behind the chan ToxicityAnalyzer, reddit_client.get_toxicity_scores and
+# YouTubeClient.analyze_toxicity_many. Every backend turns a list of texts into the ModerateHatespeech result shape,
+# {"class": "flag" | "normal", "confidence"} per text (None when a text could not be scored), so the stored
+# documents look the same whichever backend scored them. TOXICITY_BACKEND picks the backend:
+#   - moderatehatespeech (default): the remote API through the async client and the shared toxicity cache.
+#   - local: a linear model over hashed word n-grams, scored in vectorized numpy batches on the CPU without network
+#     access. It loads the model trained into TOXICITY_LOCAL_MODEL, or falls back to a small built-in lexicon.
+# Train a local model from texts the API already scored (one {"text", "class"} JSON object per line):
+#   python toxicity_backends.py train labels.jsonl --out toxicity_model.npz
+
+TOXICITY_BACKEND = os.getenv("TOXICITY_BACKEND", "moderatehatespeech")
+TOXICITY_LOCAL_MODEL = os.getenv("TOXICITY_LOCAL_MODEL", "")
+# Texts scored per numpy batch by the local backend.
+LOCAL_BATCH_SIZE = 4096
+# Feature space of the hashed n-grams, 2**20 float32 weights are 4 MB.
+DEFAULT_HASH_BITS = 20
+
+TOKEN = re.compile(r"[a-z0-9']+")
+
+# Seed lexicon of the local backend when no trained model is configured: term -> weight, unigrams and bigrams.
+LEXICON = {
+    "idiot": 2.5, "idiots": 2.5, "stupid": 2.0, "moron": 2.5, "morons": 2.5, "dumb": 1.5, "retard": 3.0,
+    "retarded": 3.0, "loser": 1.5, "pathetic": 1.5, "trash": 1.5, "scum": 2.5, "disgusting": 1.5, "worthless": 2.0,
+    "hate": 1.5, "kill": 2.0, "die": 1.5, "shut up": 2.0, "kill yourself": 4.0, "kys": 4.0, "go die": 3.5,
+    "fuck": 1.5, "fucking": 1.5, "shit": 1.0, "bitch": 2.5, "bastard": 2.0, "asshole": 2.5, "cunt": 3.0,
+}
+LEXICON_BIAS = -2.0
+
+class ScoringBackend:
+    """Scores texts into ModerateHatespeech results. Subclasses implement score_many."""
+
+    name = None
+
+    def score_many(self, texts):
+        raise NotImplementedError
+
+    def score(self, text):
+        return self.score_many([text])[0]
+
+class ModerateHatespeechBackend(ScoringBackend):
+    """The remote ModerateHatespeech API, concurrent and cached (see moderate_hatespeech_client)."""
+
+    name = "moderatehatespeech"
+
+    def __init__(self, api_token, **client_kwargs):
+        self.api_token = api_token
+        self.client_kwargs = client_kwargs
+
+    def score_many(self, texts):
+        texts = list(texts)
+        if not self.api_token:
+            logger.error("ModerateHatespeech API token not found. Please set it in the .env file.")
+            return [None] * len(texts)
+        # Imported here so the local backend runs without aiohttp installed.
+        from moderate_hatespeech_client import score_many_blocking
+        return score_many_blocking(texts, self.api_token, **self.client_kwargs)
+
+# Word unigrams and bigrams of a text, the same normalization the toxicity cache keys on.
+def text_ngrams(text):
+    tokens = TOKEN.findall(normalize_text(text).lower())
+    return tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+
+# crc32 rather than hash(), which is salted per process and would scatter a model's weights.
+def ngram_index(ngram, hash_bits):
+    return zlib.crc32(ngram.encode("utf-8")) & ((1 << hash_bits) - 1)
+
+# Hashed n-gram features of a batch as flat arrays: feature index and row (text position) of every n-gram.
+def hashed_features(texts, hash_bits):
+    indices = []
+    rows = []
+    for row, text in enumerate(texts):
+        ngram_indices = [ngram_index(ngram, hash_bits) for ngram in text_ngrams(text)]
+        indices.extend(ngram_indices)
+        rows.extend([row] * len(ngram_indices))
+    return np.array(indices, dtype=np.int64), np.array(rows, dtype=np.int64)
+
+def sigmoid(values):
+    return 1.0 / (1.0 + np.exp(-np.clip(values, -30, 30)))
+
+class LocalLinearBackend(ScoringBackend):
+    """
+    Logistic model over hashed word n-grams, scored on the CPU: the features of a whole batch are gathered into flat
+    arrays and summed per text with one np.bincount, so thousands of texts are scored per second with no network
+    access. The class is "flag" when the flag probability reaches the threshold, confidence is the probability of
+    the returned class, as in the API's results.
+    """
+
+    name = "local"
+
+    def __init__(self, weights, bias, threshold=0.5, version="lexicon"):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = float(bias)
+        self.threshold = threshold
+        self.hash_bits = int(self.weights.size).bit_length() - 1
+        self.model_version = f"local-{version}"
+
+    @classmethod
+    def from_lexicon(cls, lexicon=LEXICON, bias=LEXICON_BIAS, hash_bits=DEFAULT_HASH_BITS):
+        weights = np.zeros(1 << hash_bits, dtype=np.float32)
+        for term, weight in lexicon.items():
+            weights[ngram_index(term, hash_bits)] += weight
+        return cls(weights, bias)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as model:
+            return cls(model["weights"], float(model["bias"]), float(model["threshold"]), str(model["version"]))
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, threshold=self.threshold, version=self.model_version.removeprefix("local-"))
+
+    # Flag probability of every text.
+    def probabilities(self, texts):
+        indices, rows = hashed_features(texts, self.hash_bits)
+        logits = np.bincount(rows, weights=self.weights[indices], minlength=len(texts)) + self.bias
+        return sigmoid(logits)
+
+    def score_many(self, texts):
+        texts = list(texts)
+        scores = []
+        for start in range(0, len(texts), LOCAL_BATCH_SIZE):
+            batch = texts[start:start + LOCAL_BATCH_SIZE]
+            probabilities = self.probabilities(batch)
+            flagged = probabilities >= self.threshold
+            confidences = np.where(flagged, probabilities, 1.0 - probabilities)
+            scores.extend(
+                {"class": "flag" if is_flagged else "normal", "confidence": round(float(confidence), 4)} if text and text.strip() else None
+                for text, is_flagged, confidence in zip(batch, flagged, confidences)
+            )
+        return scores
+
+    # Fits a model to texts labelled flag (1) or normal (0), by full-batch gradient descent on the log loss with L2.
+    @classmethod
+    def train(cls, texts, labels, hash_bits=DEFAULT_HASH_BITS, epochs=50, learning_rate=0.5, l2=1e-6, threshold=0.5):
+        texts = list(texts)
+        labels = np.asarray(labels, dtype=np.float64)
+        indices, rows = hashed_features(texts, hash_bits)
+        weights = np.zeros(1 << hash_bits, dtype=np.float64)
+        bias = 0.0
+        for epoch in range(epochs):
+            logits = np.bincount(rows, weights=weights[indices], minlength=len(texts)) + bias
+            errors = sigmoid(logits) - labels
+            weights -= learning_rate * (np.bincount(indices, weights=errors[rows], minlength=weights.size) / len(texts) + l2 * weights)
+            bias -= learning_rate * errors.mean()
+        version = hashlib.sha1(weights.astype(np.float32).tobytes()).hexdigest()[:12]
+        return cls(weights, bias, threshold, version)
+
+_backends = {}
+
+# The configured backend for an API token, one instance per token and process.
+def get_backend(api_token=None, backend=TOXICITY_BACKEND):
+    key = (backend, api_token if backend == ModerateHatespeechBackend.name else None)
+    if key not in _backends:
+        if backend == LocalLinearBackend.name:
+            _backends[key] = LocalLinearBackend.load(TOXICITY_LOCAL_MODEL) if TOXICITY_LOCAL_MODEL else LocalLinearBackend.from_lexicon()
+            logger.info(f"Scoring toxicity locally with model {_backends[key].model_version}.")
+        elif backend == ModerateHatespeechBackend.name:
+            _backends[key] = ModerateHatespeechBackend(api_token)
+        else:
+            raise ValueError(f"Unknown toxicity backend {backend!r}, use moderatehatespeech or local.")
+    return _backends[key]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train or try the local toxicity scoring backend.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="fit a local model to texts labelled by the API")
+    train_parser.add_argument("labels", help='JSON lines with {"text", "class"}, class flag or normal')
+    train_parser.add_argument("--out", default="toxicity_model.npz")
+    train_parser.add_argument("--hash-bits", type=int, default=DEFAULT_HASH_BITS)
+    train_parser.add_argument("--epochs", type=int, default=50)
+    score_parser = subparsers.add_parser("score", help="score texts, one per line")
+    score_parser.add_argument("texts", help="text file, one text per line")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "train":
+        with open(args.labels, encoding="utf-8") as labels_file:
+            examples = [json.loads(line) for line in labels_file if line.strip()]
+        examples = [example for example in examples if example.get("class") in ("flag", "normal")]
+        model = LocalLinearBackend.train([example["text"] for example in examples], [example["class"] == "flag" for example in examples],
+                                         hash_bits=args.hash_bits, epochs=args.epochs)
+        model.save(args.out)
+        logger.info(f"Trained {model.model_version} on {len(examples)} texts, saved to {args.out}.")
+    else:
+        with open(args.texts, encoding="utf-8") as texts_file:
+            texts = [line.rstrip("\n") for line in texts_file]
+        for text, score in zip(texts, get_backend(backend=LocalLinearBackend.name).score_many(texts)):
+            print(json.dumps({"text": text, **(score or {})}))
@@ -0,0 +1,173 @@
+import logging
+import os
+import re
+import hashlib
+import datetime
+import threading
+import unicodedata
+import collections
+import pymongo
+from pymongo import UpdateOne
+from crawler_resources import load_environment, LazyMongoClient
+from crawler_metrics import TOXICITY_CACHE_LOOKUPS
+
+# Logging to help with debugging
+logger = logging.getLogger("ToxicityCache")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Toxicity scores shared by the chan toxicity scripts, the Reddit crawler and the YouTube crawler, so a text that was
+# scored once (a recrawled comment, a reposted title, a copypasta) is never sent to the scoring API again.
+# Scores are the raw API result {"class", "confidence"}, every platform keeps shaping it its own way.
+# Lookups go through an in-process LRU first, then one MongoDB collection shared by all crawlers, keyed by
+# "<model version>:<sha256 of the normalized text>". Bump TOXICITY_MODEL_VERSION when the scoring model changes
+# and every text gets scored again. Failed scorings are never cached.
+
+load_environment()
+
+TOXICITY_MODEL_VERSION = os.getenv("TOXICITY_MODEL_VERSION", "moderatehatespeech-v1")
+# Scores kept in memory per process.
+TOXICITY_CACHE_SIZE = int(os.getenv("TOXICITY_CACHE_SIZE", 100000))
+# Durable store, empty keeps the cache in memory only.
+TOXICITY_CACHE_MONGO_URL = os.getenv("TOXICITY_CACHE_MONGO_URL", os.getenv("MONGO_DB_URL", ""))
+# 0 keeps stored scores forever.
+TOXICITY_CACHE_TTL_DAYS = int(os.getenv("TOXICITY_CACHE_TTL_DAYS", 0))
+
+WHITESPACE = re.compile(r"\s+")
+
+# Texts that differ only in Unicode representation or whitespace share a score.
+def normalize_text(text):
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+def text_key(text, model_version=TOXICITY_MODEL_VERSION):
+    return f"{model_version}:{hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()}"
+
+class ToxicityCache:
+    """
+    In-process LRU of toxicity scores keyed by normalized text hash and model version.
+    This base class only lives in memory, MongoToxicityCache makes it durable and shared between crawlers.
+    Callers get copies, so annotating a returned score never changes the cached one.
+    """
+
+    def __init__(self, max_size=TOXICITY_CACHE_SIZE, model_version=TOXICITY_MODEL_VERSION):
+        self.max_size = max_size
+        self.model_version = model_version
+        self.lock = threading.Lock()
+        self.scores = collections.OrderedDict()
+
+    def key(self, text):
+        return text_key(text, self.model_version)
+
+    def remember(self, key, score):
+        with self.lock:
+            self.scores[key] = score
+            self.scores.move_to_end(key)
+            while len(self.scores) > self.max_size:
+                self.scores.popitem(last=False)
+
+    def recall(self, key):
+        with self.lock:
+            score = self.scores.get(key)
+            if score is not None:
+                self.scores.move_to_end(key)
+            return score
+
+    # Stored scores for many keys, {key: score}. Nothing is stored in memory-only caches.
+    def load(self, keys):
+        return {}
+
+    def store(self, scores):
+        pass
+
+    def get(self, text):
+        return self.get_many([text]).get(text)
+
+    # Cached scores of many texts in one store round trip, {text: score} for the texts that have one.
+    def get_many(self, texts):
+        found = {}
+        missing = {}
+        for text in texts:
+            key = self.key(text)
+            score = self.recall(key)
+            if score is not None:
+                TOXICITY_CACHE_LOOKUPS.inc(result="memory")
+                found[text] = dict(score)
+            else:
+                missing.setdefault(key, []).append(text)
+        if missing:
+            stored = self.load(list(missing))
+            for key, key_texts in missing.items():
+                score = stored.get(key)
+                TOXICITY_CACHE_LOOKUPS.inc(len(key_texts), result="store" if score is not None else "miss")
+                if score is not None:
+                    self.remember(key, score)
+                    for text in key_texts:
+                        found[text] = dict(score)
+        return found
+
+    def put(self, text, score):
+        self.put_many({text: score})
+
+    # Caches freshly scored texts, {text: {"class", "confidence"}}. None scores (failures) are skipped.
+    def put_many(self, scores):
+        entries = {}
+        for text, score in scores.items():
+            if score is None:
+                continue
+            entries[self.key(text)] = {"class": score.get("class"), "confidence": score.get("confidence")}
+        for key, score in entries.items():
+            self.remember(key, score)
+        if entries:
+            self.store(entries)
+
+class MongoToxicityCache(ToxicityCache):
+    """
+    Toxicity cache backed by a MongoDB collection (one document per key, _id is the key), shared by every
+    crawler process and platform. Store errors are logged and turn into cache misses, scoring goes on without it.
+    """
+
+    def __init__(self, collection, max_size=TOXICITY_CACHE_SIZE, model_version=TOXICITY_MODEL_VERSION):
+        super().__init__(max_size, model_version)
+        self.collection = collection
+        self.indexes_ensured = False
+
+    # The TTL index is created by the first write of a process, the toxicity scripts have no setup step.
+    # scored_at is stored in UTC, Mongo reads naive times as UTC and would expire local ones off by the UTC offset.
+    def ensure_indexes(self):
+        if self.indexes_ensured:
+            return
+        self.indexes_ensured = True
+        if TOXICITY_CACHE_TTL_DAYS:
+            self.collection.create_index("scored_at", expireAfterSeconds=TOXICITY_CACHE_TTL_DAYS * 86400)
+
+    def load(self, keys):
+        try:
+            return {
+                document["_id"]: {"class": document.get("class"), "confidence": document.get("confidence")}
+                for document in self.collection.find({"_id": {"$in": keys}}, {"class": 1, "confidence": 1})
+            }
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error reading {len(keys)} toxicity scores: {e}")
+            return {}
+
+    def store(self, scores):
+        scored_at = datetime.datetime.now(datetime.timezone.utc)
+        writes = [
+            UpdateOne({"_id": key}, {"$set": {**score, "model_version": self.model_version, "scored_at": scored_at}}, upsert=True)
+            for key, score in scores.items()
+        ]
+        try:
+            self.ensure_indexes()
+            self.collection.bulk_write(writes, ordered=False)
+        except pymongo.errors.PyMongoError as e:
+            logger.error(f"Error storing {len(writes)} toxicity scores: {e}")
+
+# The cache every platform shares, durable when a MongoDB url is configured.
+if TOXICITY_CACHE_MONGO_URL:
+    toxicity_cache = MongoToxicityCache(LazyMongoClient(TOXICITY_CACHE_MONGO_URL)['toxicity_shared']['scores'])
+else:
+    toxicity_cache = ToxicityCache()
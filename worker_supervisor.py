@@ -0,0 +1,217 @@
+import logging
+import os
+import math
+import time
+import queue
+import signal
+import collections
+import multiprocessing
+from pyfaktory import Client
+from crawler_metrics import JOBS, JOB_SECONDS, QUEUE_DEPTH, QUEUE_LAG_SECONDS
+
+# Logging to help with debugging
+logger = logging.getLogger("WorkerSupervisor")
+logger.propagate = False
+logger.setLevel(logging.INFO)
+sh = logging.StreamHandler()
+formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+sh.setFormatter(formatter)
+logger.addHandler(sh)
+
+# Worker processes run by the supervisor, it scales between the minimum and the maximum (the core count by default).
+WORKER_MAX_PROCESSES = int(os.getenv("WORKER_MAX_PROCESSES", os.cpu_count() or 1))
+WORKER_MIN_PROCESSES = int(os.getenv("WORKER_MIN_PROCESSES", 1))
+# Jobs each worker process runs at once, scaled between 1 and the maximum.
+WORKER_MAX_CONCURRENCY = int(os.getenv("WORKER_MAX_CONCURRENCY", 20))
+# The pool is sized so the queued jobs would be done within this many seconds at the measured job latency.
+WORKER_TARGET_DRAIN_SECONDS = int(os.getenv("WORKER_TARGET_DRAIN_SECONDS", 300))
+WORKER_SCALE_INTERVAL_SECONDS = int(os.getenv("WORKER_SCALE_INTERVAL_SECONDS", 30))
+# Consecutive checks that must ask for a smaller pool before it shrinks, so short lulls do not churn processes.
+WORKER_SCALE_DOWN_AFTER = int(os.getenv("WORKER_SCALE_DOWN_AFTER", 4))
+# Seconds a stopped worker gets to finish its jobs after SIGTERM before it is killed.
+WORKER_STOP_TIMEOUT_SECONDS = int(os.getenv("WORKER_STOP_TIMEOUT_SECONDS", 30))
+# Job latency assumed until the workers have reported any.
+DEFAULT_JOB_SECONDS = 1.0
+# Job latencies kept for the running mean.
+LATENCY_WINDOW = 200
+
+# Set in worker processes started by a supervisor, TimedJob reports job latencies through it.
+_latency_queue = None
+
+class TimedJob:
+    """
+    Wraps a job function, counts its runs in the crawler metrics and reports how long each run took to the supervisor
+    of the process, if there is one. A class rather than a closure so it pickles by reference into the consumers' process pools.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.__name__ = getattr(func, "__name__", "job")
+
+    def __call__(self, *args, **kwargs):
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            result = self.func(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            seconds = time.monotonic() - started
+            JOBS.inc(job=self.__name__, outcome=outcome)
+            JOB_SECONDS.observe(seconds, job=self.__name__)
+            if _latency_queue is not None:
+                try:
+                    _latency_queue.put_nowait(seconds)
+                except queue.Full:
+                    pass
+
+# Jobs waiting in the given queues, from the Faktory INFO command.
+def faktory_queue_depth(faktory_url, queues):
+    with Client(faktory_url=faktory_url, role="producer") as client:
+        info = client.info()
+    sizes = info.get("faktory", info).get("queues", {})
+    if isinstance(sizes, list):
+        sizes = {entry["name"]: entry["size"] for entry in sizes}
+    return sum(size for name, size in sizes.items() if name in queues)
+
+def _run_worker(start_worker, concurrency, latency_queue):
+    global _latency_queue
+    _latency_queue = latency_queue
+    start_worker(concurrency=concurrency)
+
+class WorkerSupervisor:
+    """
+    Runs start_worker(concurrency=...) in several processes and resizes the pool from the queue depth and the job latency.
+    Every check it computes the job slots needed to drain the queued jobs within target_drain_seconds at the mean
+    measured latency, spreads them over processes (more processes first, for the CPU-bound decoding and diffing)
+    and per-process concurrency (once the processes are maxed out, for jobs that mostly wait on the network).
+    Growing happens at once, shrinking only after scale_down_after checks in a row asked for less. Processes are
+    stopped with SIGTERM, which the Faktory consumers handle by finishing their jobs, and killed if they are still
+    running stop_timeout_seconds later. A process running with an outdated concurrency is replaced one per check.
+    Crashed processes are restarted.
+    """
+
+    def __init__(self, start_worker, queue_depth, initial_concurrency=1, min_processes=WORKER_MIN_PROCESSES,
+                 max_processes=WORKER_MAX_PROCESSES, max_concurrency=WORKER_MAX_CONCURRENCY,
+                 target_drain_seconds=WORKER_TARGET_DRAIN_SECONDS, interval_seconds=WORKER_SCALE_INTERVAL_SECONDS,
+                 scale_down_after=WORKER_SCALE_DOWN_AFTER, stop_timeout_seconds=WORKER_STOP_TIMEOUT_SECONDS):
+        self.start_worker = start_worker
+        self.queue_depth = queue_depth
+        # Crawler name for the metrics, the crawler module usually runs as __main__.
+        self.name = os.path.splitext(os.path.basename(start_worker.__code__.co_filename))[0]
+        self.min_processes = max(1, min(min_processes, max_processes))
+        self.max_processes = max(1, max_processes)
+        self.max_concurrency = max(1, max_concurrency)
+        self.target_drain_seconds = target_drain_seconds
+        self.interval_seconds = interval_seconds
+        self.scale_down_after = scale_down_after
+        self.stop_timeout_seconds = stop_timeout_seconds
+        # The pool starts small, the first check grows it right away if the queue asks for more.
+        self.processes = self.min_processes
+        self.concurrency = max(1, min(initial_concurrency, self.max_concurrency))
+        self.smaller_checks = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.latency_queue = None
+        # [(process, concurrency)]
+        self.workers = []
+        self.stopping = False
+
+    def mean_latency(self):
+        if not self.latencies:
+            return DEFAULT_JOB_SECONDS
+        return sum(self.latencies) / len(self.latencies)
+
+    # Returns the (processes, concurrency) that drains queue_depth jobs in time at the given job latency.
+    def plan(self, queue_depth, latency):
+        slots = max(1, math.ceil(queue_depth * latency / max(self.target_drain_seconds, 1)))
+        processes = min(max(slots, self.min_processes), self.max_processes)
+        concurrency = min(max(math.ceil(slots / processes), 1), self.max_concurrency)
+        return processes, concurrency
+
+    def spawn(self, concurrency):
+        process = multiprocessing.Process(target=_run_worker, args=(self.start_worker, concurrency, self.latency_queue), daemon=False)
+        process.start()
+        self.workers.append((process, concurrency))
+
+    def stop_worker(self, process):
+        process.terminate()
+        self.join_or_kill([process])
+
+    # Waits up to stop_timeout_seconds for terminated processes, shared by all of them, then kills the ones left.
+    def join_or_kill(self, processes):
+        deadline = time.monotonic() + self.stop_timeout_seconds
+        for process in processes:
+            process.join(max(0, deadline - time.monotonic()))
+        for process in processes:
+            if process.is_alive():
+                logger.warning(f"Worker process {process.pid} still running {self.stop_timeout_seconds} s after SIGTERM, killing it.")
+                process.kill()
+                process.join()
+
+    def collect_latencies(self):
+        while True:
+            try:
+                self.latencies.append(self.latency_queue.get_nowait())
+            except queue.Empty:
+                return
+
+    # One control step: restart crashed workers, rescale and converge the pool to the target size.
+    def check(self):
+        self.collect_latencies()
+        for process, concurrency in list(self.workers):
+            if not process.is_alive():
+                logger.warning(f"Worker process {process.pid} exited with code {process.exitcode}, restarting it.")
+                self.workers.remove((process, concurrency))
+
+        try:
+            depth = self.queue_depth()
+        except Exception as e:
+            logger.error(f"Error reading the queue depth, keeping {self.processes} processes x {self.concurrency}: {e}")
+            depth = None
+        if depth is not None:
+            latency = self.mean_latency()
+            # A job queued now waits for the jobs ahead of it, spread over the running job slots.
+            QUEUE_DEPTH.set(depth, worker=self.name)
+            QUEUE_LAG_SECONDS.set(depth * latency / max(len(self.workers) * self.concurrency, 1), worker=self.name)
+            processes, concurrency = self.plan(depth, latency)
+            if processes * concurrency >= self.processes * self.concurrency:
+                self.smaller_checks = 0
+            else:
+                self.smaller_checks += 1
+            if (processes, concurrency) != (self.processes, self.concurrency) and (self.smaller_checks == 0 or self.smaller_checks >= self.scale_down_after):
+                logger.info(f"{depth} queued jobs at {latency:.2f} s each, scaling from {self.processes} processes x {self.concurrency} "
+                            f"to {processes} x {concurrency}.")
+                self.processes, self.concurrency = processes, concurrency
+                self.smaller_checks = 0
+
+        while len(self.workers) > self.processes:
+            process, _ = self.workers.pop()
+            self.stop_worker(process)
+        outdated = [worker for worker in self.workers if worker[1] != self.concurrency]
+        if outdated:
+            self.workers.remove(outdated[0])
+            self.stop_worker(outdated[0][0])
+        while len(self.workers) < self.processes:
+            self.spawn(self.concurrency)
+
+    def handle_sigterm(self, *_):
+        self.stopping = True
+
+    def run(self):
+        self.latency_queue = multiprocessing.Queue(maxsize=10000)
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        logger.info(f"Supervising {self.processes} worker processes x {self.concurrency} jobs ({self.min_processes}-{self.max_processes} processes).")
+        try:
+            while not self.stopping:
+                self.check()
+                deadline = time.monotonic() + self.interval_seconds
+                while not self.stopping and time.monotonic() < deadline:
+                    time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info(f"Stopping {len(self.workers)} worker processes...")
+            for process, _ in self.workers:
+                process.terminate()
+            self.join_or_kill([process for process, _ in self.workers])
+            self.workers = []
@@ -2,10 +2,11 @@ import os
 import requests
 import logging
 import re
-from dotenv import load_dotenv
-import time
+from crawler_resources import load_environment
+from response_capture import capture_response
+from toxicity_backends import get_backend
 
-load_dotenv()
+load_environment()
 
 logger = logging.getLogger("YouTubeClient")
 logger.setLevel(logging.INFO)
@@ -20,13 +21,13 @@ class YouTubeClient:
         self.api_key_t = os.getenv("YOUTUBE_KEY")
         self.base_url = "https://www.googleapis.com/youtube/v3"
         self.hate_speech_api_key = os.getenv("MODERATE_HATESPEECH_API_KEY")
-        self.hate_speech_api_url = "https://api.moderatehatespeech.com/api/v1/moderate/"
 
     def get_channel_details(self, channel_id, toxicity=False):
         api_key = self.api_key_t if toxicity else self.api_key
         logger.info(f"Fetching details for channel ID: {channel_id}")
         url = f"{self.base_url}/channels?part=snippet,statistics&id={channel_id}&key={self.api_key}"
         response = requests.get(url)
+        capture_response("youtube", url, response.status_code, response.content)
         
         if response.status_code != 200:
             logger.error(f"Error fetching channel details: {response.status_code}")
@@ -40,6 +41,7 @@ class YouTubeClient:
         logger.info(f"Fetching videos for channel ID: {channel_id}")
         url = f"{self.base_url}/search?part=snippet&channelId={channel_id}&maxResults={limit}&order=viewCount&type=video&key={self.api_key}"
         response = requests.get(url)
+        capture_response("youtube", url, response.status_code, response.content)
         
         if response.status_code != 200:
             logger.error(f"Error fetching videos: {response.status_code}")
@@ -53,6 +55,7 @@ class YouTubeClient:
         logger.info(f"Fetching details for video ID: {video_id}")
         url = f"{self.base_url}/videos?part=snippet,statistics&id={video_id}&key={self.api_key}"
         response = requests.get(url)
+        capture_response("youtube", url, response.status_code, response.content)
         
         if response.status_code != 200:
             logger.error(f"Error fetching video details: {response.status_code}")
@@ -61,47 +64,21 @@ class YouTubeClient:
         data = response.json()
         return data['items'][0]
 
-    def analyze_toxicity(self, comment_text, retries=3, delay=2):
-        if not comment_text:
+    # Scores many texts in one batch with the configured backend (the API concurrently and cached, or the local model),
+    # returns the results in the same order, None for empty texts and texts that could not be scored.
+    def analyze_toxicity_many(self, texts):
+        texts = list(texts)
+        if not any(texts):
             logger.warning("Skipping toxicity analysis: No text provided")
-            return None
-
-        for attempt in range(retries):
-            try:
-                headers = {"Content-Type": "application/json"}
-                payload = {
-                    "token": self.hate_speech_api_key,
-                    "text": comment_text
-                }
-                response = requests.post(self.hate_speech_api_url, headers=headers, json=payload)
-                
-                if response.status_code == 200:
-                    try:
-                        data = response.json()
-                        if data.get("response") == "Success":
-                            return {
-                                "is_toxic": data.get("class"),
-                                "toxicity": data.get("confidence")
-                            }
-                        else:
-                            logger.warning(f"Toxicity API error: {data.get('response')}")
-                            return None
-                    except ValueError:
-                        logger.error(f"Error analyzing toxicity: Response was not valid JSON. Raw response: {response.text}")
-                        return None
-                else:
-                    logger.warning(f"Toxicity API returned status {response.status_code}")
-                    return None
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error analyzing toxicity (attempt {attempt + 1}/{retries}): {e}")
-                if attempt < retries - 1:
-                    time.sleep(delay)  
-                    delay *= 2  
-                else:
-                    logger.error("Max retries reached. Skipping this comment.")
-                    return None
-
+            return [None] * len(texts)
+        results = get_backend(self.hate_speech_api_key).score_many(texts)
+        return [
+            {"is_toxic": result.get("class"), "toxicity": result.get("confidence")} if result is not None else None
+            for result in results
+        ]
 
+    def analyze_toxicity(self, comment_text):
+        return self.analyze_toxicity_many([comment_text])[0]
 
     def get_video_comments(self, video_id, limit=100):
         logger.info(f"Fetching up to {limit} comments for video ID: {video_id}")
@@ -115,16 +92,18 @@ class YouTubeClient:
                 url += f"&pageToken={page_token}"
             
             response = requests.get(url)
+            capture_response("youtube", url, response.status_code, response.content)
             if response.status_code != 200:
                 logger.error(f"Error fetching comments: {response.status_code}")
                 break
 
             data = response.json()
-            for item in data.get('items', []):
+            items = data.get('items', [])[:limit - len(comments)]
+            clean_texts = [re.sub(r'<.*?>', '', item['snippet']['topLevelComment']['snippet'].get("textDisplay", "")) for item in items]
+            # Every comment of the page is scored together in one concurrent batch.
+            toxicities = self.analyze_toxicity_many(clean_texts)
+            for item, clean_text, toxicity_data in zip(items, clean_texts, toxicities):
                 comment = item['snippet']['topLevelComment']['snippet']
-                text = comment.get("textDisplay", "")
-                clean_text = re.sub(r'<.*?>', '', text) 
-                toxicity_data = self.analyze_toxicity(clean_text)
 
                 if toxicity_data and toxicity_data.get("class") == "flag":
                     print(f"Toxic comment detected at index {comment_index}")
@@ -1,19 +1,21 @@
 import logging
-import pymongo
 import os
 import time
-from dotenv import load_dotenv
 from faktory import Client, Worker
 from youtube_client import YouTubeClient
 from datetime import datetime
 import multiprocessing
 import requests
 from requests.exceptions import HTTPError
+from crawler_resources import load_environment, LazyMongoClient
+from worker_supervisor import WorkerSupervisor, TimedJob, faktory_queue_depth
+from crawler_metrics import MONGO_OPERATION_SECONDS, RETRY_SLEEP_SECONDS
 
-load_dotenv()
+load_environment()
 
 MONGO_DB_URL = os.getenv("MONGO_DB_URL")
-mongo_client = pymongo.MongoClient(MONGO_DB_URL)
+# Connects lazily, once per process, so the forked workers never inherit the parent's connections.
+mongo_client = LazyMongoClient(MONGO_DB_URL)
 db = mongo_client['youtube_data']
 channels_collection = db['channels']
 videos_collection = db['videos']
@@ -35,6 +37,10 @@ FAKTORY_SERVER_URL = os.getenv("FAKTORY_SERVER_URL")
 MAX_RETRIES = 5
 RETRY_DELAY = 5  
 
+# Queues consumed by the workers, and the jobs each worker process runs at once to start with (see worker_supervisor).
+WORKER_QUEUES = ['crawl_channel', 'crawl_video']
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 1))
+
 def retry_on_network_and_http_errors(func, *args, **kwargs):
     retries = 0
     delay = RETRY_DELAY
@@ -55,12 +61,14 @@ def retry_on_network_and_http_errors(func, *args, **kwargs):
 
             elif 500 <= status_code < 600:
                 logger.error(f"Server error (status {status_code}) occurred. Retrying in {delay} seconds...")
+                RETRY_SLEEP_SECONDS.inc(delay, reason="5xx")
                 time.sleep(delay)
                 retries += 1
                 delay *= 2  
                 
         except requests.exceptions.RequestException as req_err:
             logger.error(f"Network error: {req_err}. Retrying in {delay} seconds...")
+            RETRY_SLEEP_SECONDS.inc(delay, reason="network")
             time.sleep(delay)
             retries += 1
             delay *= 2  
@@ -156,11 +164,12 @@ def crawl_video(channel_id, video_id):
 
     if not video_data or not video_data_toxicity:
         logger.warning(f"Video {video_id} might be deleted or unavailable.")
-        videos_collection.update_one(
-            {"video_id": video_id},
-            {"$set": {"isDeleted": True, "crawled_at": datetime.now()}},
-            upsert=True
-        )
+        with MONGO_OPERATION_SECONDS.time(job="crawl_video", operation="mark_deleted"):
+            videos_collection.update_one(
+                {"video_id": video_id},
+                {"$set": {"isDeleted": True, "crawled_at": datetime.now()}},
+                upsert=True
+            )
         return
 
     title = video_data['snippet'].get('title', '[Deleted Title]')
@@ -170,8 +179,7 @@ def crawl_video(channel_id, video_id):
     like_count = video_data['statistics'].get('likeCount', 0)
     comment_count = video_data['statistics'].get('commentCount', 0)
 
-    title_toxicity = youtube_client.analyze_toxicity(title)
-    description_toxicity = youtube_client.analyze_toxicity(description)
+    title_toxicity, description_toxicity = youtube_client.analyze_toxicity_many([title, description])
     comments_data = retry_on_network_and_http_errors(youtube_client.get_video_comments, video_id)
 
     videos = {
@@ -188,11 +196,12 @@ def crawl_video(channel_id, video_id):
         "isDeleted": False
     }
 
-    db['videos'].update_one(
-        {"video_id": video_id},
-        {"$set": videos},
-        upsert=True
-    )
+    with MONGO_OPERATION_SECONDS.time(job="crawl_video", operation="store_video"):
+        db['videos'].update_one(
+            {"video_id": video_id},
+            {"$set": videos},
+            upsert=True
+        )
 
     toxicity = {
         "channel_id": channel_id,
@@ -210,19 +219,20 @@ def crawl_video(channel_id, video_id):
         "isDeleted": False
     }
 
-    db1['videos_toxicity'].update_one(
-        {"video_id": video_id},
-        {"$set": toxicity},
-        upsert=True
-    )
+    with MONGO_OPERATION_SECONDS.time(job="crawl_video", operation="store_video_toxicity"):
+        db1['videos_toxicity'].update_one(
+            {"video_id": video_id},
+            {"$set": toxicity},
+            upsert=True
+        )
 
 
 
-def start_worker():
+def start_worker(concurrency=WORKER_CONCURRENCY):
     os.environ['FAKTORY_URL'] = FAKTORY_SERVER_URL
-    worker = Worker(queues=['crawl_channel', 'crawl_video'])
-    worker.register('crawl_channel', crawl_channel)
-    worker.register('crawl_video', crawl_video)
+    worker = Worker(queues=WORKER_QUEUES, concurrency=concurrency)
+    worker.register('crawl_channel', TimedJob(crawl_channel))
+    worker.register('crawl_video', TimedJob(crawl_video))
     logger.info("Worker started. Listening for jobs...")
     worker.run()
 
@@ -249,10 +259,15 @@ def monitor_queue():
             logger.info(f"Jobs in queue: {total_enqueued}, Jobs in progress: {total_in_progress}")
         time.sleep(240)
 
+# Jobs waiting in the worker queues, the supervisor sizes the worker pool from it.
+def queue_depth():
+    return faktory_queue_depth(FAKTORY_SERVER_URL, WORKER_QUEUES)
+
 if __name__ == "__main__":
     os.environ['FAKTORY_URL'] = FAKTORY_SERVER_URL
 
-    worker_process = multiprocessing.Process(target=start_worker)
+    supervisor = WorkerSupervisor(start_worker, queue_depth, initial_concurrency=WORKER_CONCURRENCY)
+    worker_process = multiprocessing.Process(target=supervisor.run)
     worker_process.start()
 
     monitor_process = multiprocessing.Process(target=monitor_queue)